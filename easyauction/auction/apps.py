@@ -1,5 +1,24 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Sets up every new SQLite connection for concurrent use: WAL lets readers run while a write commits,
+    and the busy timeout makes a writer wait for the lock instead of failing with 'database is locked'
+    """
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={int(settings.AUCTION_SQLITE_BUSY_TIMEOUT)}')
 
 
 class AuctionConfig(AppConfig):
     name = 'auction'
+
+    def ready(self):
+        connection_created.connect(configure_sqlite, dispatch_uid='auction.configure_sqlite')
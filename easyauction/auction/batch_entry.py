@@ -0,0 +1,228 @@
+import csv
+import io
+from collections import Counter, defaultdict, namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .bidding import valid_amount
+from .caching import bump_listing_version
+from .events import item_event, publish_on_commit
+from .ledger import GUARANTEED, POSSIBLE, post, transfer
+from .models import Bid, Item
+from .notifications import collect_notifications, item_won, outbid
+
+
+# Live results: one row per item with the winner and hammer price.
+# Bid sheets: paper silent-auction sheets, one row per written bid, in the order they appear on the sheet
+RESULTS = 'results'
+BID_SHEETS = 'bids'
+MODES = [RESULTS, BID_SHEETS]
+
+# A validated row: item and user resolved, price parsed
+Entry = namedtuple('Entry', ['line', 'item', 'user', 'price'])
+
+
+def parse_rows(text):
+    """
+    Reads pasted or typed CSV, one "item, winner or bidder, price" row per line. Blank lines are skipped
+    :return: list of field lists
+    """
+    return [fields for fields in csv.reader(io.StringIO(text)) if any(field.strip() for field in fields)]
+
+
+def _lookup(objects, keys, key_fields):
+    """
+    Maps each key to the one object whose pk or any of key_fields matches it.
+    Numeric keys are tried as pks first, since clerks write item numbers and paddle (user id) numbers
+    """
+    by_key = defaultdict(set)
+    for obj in objects:
+        by_key[str(obj.pk)].add(obj)
+        for field in key_fields:
+            by_key[getattr(obj, field)].add(obj)
+    found = {}
+    for key in keys:
+        matches = by_key.get(key, set())
+        if key.isdigit():
+            matches = {obj for obj in matches if str(obj.pk) == key} or matches
+        if len(matches) == 1:
+            found[key] = matches.pop()
+        elif matches:
+            found[key] = None
+    return found
+
+
+def resolve_rows(auction, rows):
+    """
+    Validates rows and resolves their items and users, one query each. Run inside the batch's transaction:
+    the items are locked before they are read, so no online bid can land between reading and writing them
+    :param auction: auction the rows belong to
+    :param rows: list of [item number or name, username or paddle number, price] rows
+    :return: list of Entry
+    :raises ValidationError: listing every bad row
+    """
+    errors = []
+    cleaned = []
+    for line, fields in enumerate(rows, 1):
+        if len(fields) != 3:
+            errors.append(f'Line {line}: expected item, bidder and price')
+            continue
+        item_key, user_key, price = (str(field).strip() for field in fields)
+        try:
+            price = Decimal(price.lstrip('$'))
+        except InvalidOperation:
+            errors.append(f'Line {line}: "{price}" is not a price')
+            continue
+        # NaN, infinities and prices the price columns cannot hold would otherwise fail inside the transaction
+        if not valid_amount(price):
+            errors.append(f'Line {line}: ${price} is not a price that can be recorded')
+            continue
+        cleaned.append((line, item_key, user_key, price))
+
+    item_keys = {item_key for _, item_key, _, _ in cleaned}
+    user_keys = {user_key for _, _, user_key, _ in cleaned}
+    item_pks = [int(key) for key in item_keys if key.isdigit()]
+    user_pks = [int(key) for key in user_keys if key.isdigit()]
+    items = auction.item_set.filter(Q(pk__in=item_pks) | Q(name__in=item_keys))
+    # Written before anything is read, so the write lock is taken first, as when bidding
+    items.update(updated_at=timezone.now())
+    items = _lookup(items.select_related('top_bid'), item_keys, ['name'])
+    users = _lookup(auction.participants.filter(Q(pk__in=user_pks) | Q(username__in=user_keys))
+                    .only('pk', 'username'), user_keys, ['username'])
+
+    entries = []
+    for line, item_key, user_key, price in cleaned:
+        item = items.get(item_key)
+        user = users.get(user_key)
+        if item_key not in items:
+            errors.append(f'Line {line}: no item "{item_key}" in this auction')
+        elif item is None:
+            errors.append(f'Line {line}: more than one item is called "{item_key}", use its number')
+        if user_key not in users:
+            errors.append(f'Line {line}: "{user_key}" is not a participant of this auction')
+        elif user is None:
+            errors.append(f'Line {line}: "{user_key}" matches more than one participant, use the paddle number')
+        if item and user:
+            entries.append(Entry(line, item, user, price))
+
+    if errors:
+        raise ValidationError(errors)
+    return entries
+
+
+def record_batch(auction, mode, rows):
+    """
+    Validates and records a clerk's batch in one transaction. Nothing is written if any row is invalid
+    :param auction: auction the rows belong to
+    :param mode: RESULTS or BID_SHEETS
+    :param rows: list of [item, user, price] rows
+    :return: number of rows recorded
+    :raises ValidationError: listing every bad row
+    """
+    if mode not in MODES:
+        raise ValidationError(f'Unknown entry mode "{mode}"')
+    with collect_notifications(), transaction.atomic():
+        entries = resolve_rows(auction, rows)
+        if mode == RESULTS:
+            record_results(entries)
+        else:
+            record_bid_sheets(entries)
+        bump_listing_version(auction.pk)
+    return len(entries)
+
+
+def record_results(entries):
+    """
+    Sells each live item to its winner at the hammer price. Re-entering an item replaces its earlier result
+    """
+    errors = [f'Line {e.line}: {e.item} is a silent item, enter its bids as a bid sheet'
+              for e in entries if e.item.auction_type != 'live']
+    errors += [f'{item} is entered more than once'
+               for item, count in Counter(e.item for e in entries).items() if count > 1]
+    if errors:
+        raise ValidationError(errors)
+
+    now = timezone.now()
+    balance_entries = []
+    for e in entries:
+        item = e.item
+        won_before = (item.winner_id, item.current_price) if item.is_sold and item.winner_id else None
+        balance_entries += transfer(item, GUARANTEED, won_before, (e.user.pk, e.price), 'result')
+        item.winner_id = e.user.pk
+        item.current_price = e.price
+        item.is_sold = True
+        item.is_open = False
+        item.updated_at = now
+        item_won(item.pk, item.name, e.user.pk)
+
+    Item.objects.bulk_update([e.item for e in entries], ['winner', 'current_price', 'is_sold', 'is_open', 'updated_at'],
+                             batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+    post(balance_entries)
+
+
+def record_bid_sheets(entries):
+    """
+    Adds paper bids to silent items. On each item the sheet's bids must start at the current minimum bid and rise
+    line by line. Bid statistics, prices, possible balances and outbid notifications follow as for online bids
+    """
+    errors = []
+    last_price = {}
+    for e in entries:
+        item = e.item
+        if item.auction_type != 'silent':
+            errors.append(f'Line {e.line}: {item} is a live item, enter it as a result')
+        elif item.is_sold:
+            errors.append(f'Line {e.line}: {item} is already sold')
+        elif item not in last_price and e.price < item.min_bid:
+            errors.append(f'Line {e.line}: the minimum bid on {item} is ${item.min_bid}')
+        elif item in last_price and e.price <= last_price[item]:
+            errors.append(f'Line {e.line}: bids on {item} must go up, the line before bid ${last_price[item]}')
+        last_price[item] = e.price
+    if errors:
+        raise ValidationError(errors)
+
+    Bid.objects.bulk_create([Bid(item=e.item, bidder=e.user, price=e.price) for e in entries],
+                           batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+
+    # The new top bids need pks, so read the top two of each touched item back in one ordered pass
+    items = {e.item.pk: e.item for e in entries}
+    stats = {}
+    for item_id, bid_id, bidder_id, price in (Bid.objects.filter(item_id__in=items)
+                                              .order_by('item_id', '-price', '-pk')
+                                              .values_list('item_id', 'pk', 'bidder_id', 'price')):
+        count, top_two = stats.setdefault(item_id, [0, []])
+        stats[item_id][0] = count + 1
+        if len(top_two) < 2:
+            top_two.append((bid_id, bidder_id, price))
+
+    now = timezone.now()
+    balance_entries = []
+    for item_id, item in items.items():
+        count, top_two = stats[item_id]
+        (top_id, top_bidder_id, top_price) = top_two[0]
+        held_before = None
+        if item.top_bid:
+            held_before = (item.top_bid.bidder_id, item.top_bid.price)
+            if item.top_bid.bidder_id != top_bidder_id:
+                outbid(item.top_bid.bidder_id, item)
+        balance_entries += transfer(item, POSSIBLE, held_before, (top_bidder_id, top_price), 'bid')
+
+        item.bid_count = count
+        item.top_bid_id = top_id
+        item.runner_up_bid_id = top_two[1][0] if len(top_two) > 1 else None
+        item.current_price = top_price
+        item.min_bid = top_price + item.bid_increment
+        item.updated_at = now
+        publish_on_commit(item.auction_id, item_event(item.pk, price=str(item.current_price),
+                                                      min_bid=str(item.min_bid), bid_count=count,
+                                                      is_open=item.is_open))
+
+    Item.objects.bulk_update(list(items.values()),
+                             ['bid_count', 'top_bid', 'runner_up_bid', 'current_price', 'min_bid', 'updated_at'],
+                             batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+    post(balance_entries)
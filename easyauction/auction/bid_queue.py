@@ -0,0 +1,122 @@
+import concurrent.futures
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .bidding import REJECTED_BUSY, BidResult, place_bid
+from .notifications import collect_notifications
+
+
+BidRequest = namedtuple('BidRequest', ['item', 'bidder', 'amount', 'future'])
+
+
+class BidPending(Exception):
+    """
+    The request stopped waiting after the writer had started placing its bid, so the bid may still be accepted
+    """
+
+
+class BidWriter:
+    """
+    Applies queued bids from a single thread, a batch per transaction (group commit).
+    Request threads never write bids themselves, so they cannot collide on SQLite's write lock:
+    within a process there is one writer, and each batch takes the lock once however many bids it holds
+    """
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item, bidder, amount):
+        future = Future()
+        self._start()
+        self.queue.put(BidRequest(item, bidder, amount, future))
+        return future
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='bid-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # Take whatever queued up while the previous batch was committing
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.apply(batch)
+
+    def apply(self, batch):
+        """
+        Places a batch of bids in one transaction. Each bid runs in its own savepoint, so a failing bid only fails
+        its own request. Results are handed back once the batch has committed
+        :param batch: list of BidRequest
+        """
+        # Bids whose requests gave up waiting are dropped; the rest can no longer be withdrawn
+        batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        outcomes = []
+        try:
+            # Outbid notifications for the whole batch go out in one insert after commit
+            with collect_notifications(), transaction.atomic():
+                for request in batch:
+                    try:
+                        outcomes.append((request, place_bid(request.item, request.bidder, request.amount), None))
+                    except Exception as e:
+                        outcomes.append((request, None, e))
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            # Start the next batch on a fresh connection
+            connection.close()
+            return
+
+        for request, result, error in outcomes:
+            if error is None:
+                request.future.set_result(result)
+            else:
+                request.future.set_exception(error)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = BidWriter(settings.AUCTION_BID_BATCH_SIZE)
+        return _writer
+
+
+def enqueue_bid(item, bidder, amount):
+    """
+    Places a bid through this process's bid writer and waits for its result.
+    Inside a transaction the bid is placed directly instead, since the writer's connection could not see
+    anything the transaction has not committed yet.
+    A bid still queued after AUCTION_BID_QUEUE_TIMEOUT seconds is withdrawn and rejected as REJECTED_BUSY
+    :return: BidResult, as from place_bid
+    :raises BidPending: if the wait ran out while the bid was being placed
+    """
+    if not settings.AUCTION_BID_QUEUE or connection.in_atomic_block:
+        return place_bid(item, bidder, amount)
+    future = get_writer().submit(item, bidder, amount)
+    try:
+        return future.result(timeout=settings.AUCTION_BID_QUEUE_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        if future.cancel():
+            return BidResult(False, None, REJECTED_BUSY)
+        if future.done():
+            return future.result()
+        raise BidPending
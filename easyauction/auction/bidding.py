@@ -0,0 +1,109 @@
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+from django.core.validators import DecimalValidator
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .caching import bump_listing_version
+from .events import item_event, publish_on_commit
+from .ledger import POSSIBLE, entry, post
+from .models import Bid, Item
+from .notifications import collect_notifications, outbid
+
+
+# Outcome of a bid attempt. `bid` is only set when the bid was accepted, `reason` only when it was rejected
+BidResult = namedtuple('BidResult', ['accepted', 'bid', 'reason'])
+
+REJECTED_CLOSED = 'closed'
+REJECTED_OUTBID = 'outbid'
+REJECTED_INVALID = 'invalid'
+# Not placed: the bid queue did not reach it before the request stopped waiting
+REJECTED_BUSY = 'busy'
+
+
+def valid_amount(amount):
+    """
+    :return: whether a bid amount is a positive number that fits Bid.price without rounding
+    """
+    if not amount.is_finite() or amount <= 0:
+        return False
+    price = Bid._meta.get_field('price')
+    try:
+        DecimalValidator(price.max_digits, price.decimal_places)(amount)
+    except ValidationError:
+        return False
+    return True
+
+
+def place_bid(item, bidder, amount):
+    """
+    Places a bid on an item in a single transaction.
+    The price check and the price raise are one conditional UPDATE, so concurrent bids for the same minimum cannot
+    both be accepted and no update is lost. The query count is fixed no matter how many bids the item already has.
+    :param item: item being bid on (only its pk and in-memory flags are used, it is not re-read)
+    :param bidder: user placing the bid
+    :param amount: bid amount as a Decimal
+    :return: BidResult telling whether the bid is now the high bid
+    """
+    # NaN, infinities and amounts the price columns cannot hold would otherwise fail inside the transaction
+    if not valid_amount(amount):
+        return BidResult(False, None, REJECTED_INVALID)
+
+    now = timezone.now()
+    # Notifications are written once the bid transaction has committed, not while it holds the write lock
+    with collect_notifications(), transaction.atomic():
+        # Check and raise the price in one statement. This also takes the write lock before anything is read.
+        # The current top bid becomes the runner-up; the new bid is linked as top bid once it has a pk.
+        # Bids past the item's deadline are refused even if the scheduler has not closed it yet
+        updated = (Item.objects.filter(Q(closes_at__isnull=True) | Q(closes_at__gt=now),
+                                       pk=item.pk, is_open=True, min_bid__lte=amount)
+                   .update(current_price=amount,
+                           min_bid=amount + F('bid_increment'),
+                           bid_count=F('bid_count') + 1,
+                           runner_up_bid=F('top_bid'),
+                           updated_at=now))
+        if not updated:
+            past_deadline = item.closes_at is not None and item.closes_at <= now
+            reason = REJECTED_OUTBID if item.is_open and not past_deadline else REJECTED_CLOSED
+            return BidResult(False, None, reason)
+
+        # Safe to read now: no other bid on this item can commit until this transaction does
+        bid_count, closes_at, soft_close, prev_bidder_id, prev_price = (Item.objects.filter(pk=item.pk)
+                                                                        .values_list('bid_count',
+                                                                                     'closes_at',
+                                                                                     'soft_close',
+                                                                                     'runner_up_bid__bidder_id',
+                                                                                     'runner_up_bid__price')
+                                                                        .get())
+
+        bid = Bid.objects.create(item=item, bidder=bidder, price=amount)
+        # A bid inside the soft-close window moves the deadline back, so there is time to answer it
+        if closes_at and soft_close and closes_at < now + soft_close:
+            closes_at = now + soft_close
+            Item.objects.filter(pk=item.pk).update(top_bid=bid, closes_at=closes_at)
+        else:
+            Item.objects.filter(pk=item.pk).update(top_bid=bid)
+
+        # The top bid is held against the new high bidder's possible balance instead of the previous one's
+        entries = [entry(bidder.pk, item, POSSIBLE, amount, 'bid')]
+        if prev_bidder_id:
+            entries.append(entry(prev_bidder_id, item, POSSIBLE, -prev_price, 'outbid'))
+
+            # send outbid notification to previous highest bidder
+            outbid(prev_bidder_id, item)
+        post(entries)
+
+        bump_listing_version(item.auction_id)
+        publish_on_commit(item.auction_id, item_event(item.pk, price=str(amount), min_bid=str(amount + item.bid_increment),
+                                                      bid_count=bid_count, is_open=True,
+                                                      closes_at=closes_at and closes_at.isoformat()))
+
+    # Keep the caller's instance in step with what was written
+    item.current_price = amount
+    item.closes_at = closes_at
+    item.min_bid = amount + item.bid_increment
+    item.top_bid = bid
+
+    return BidResult(True, bid, None)
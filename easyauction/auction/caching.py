@@ -0,0 +1,71 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.middleware.csrf import get_token
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .listing import items_page
+from .models import Auction, Item
+
+
+def listing_key(auction):
+    """
+    Cache key part for an auction's item listing. The version lives on the auction row, so every process sees a bump
+    as soon as it commits. The creation time keeps keys unique if auction pks are ever reused
+    """
+    return f'{auction.pk}.{auction.time_created.timestamp():f}.{auction.listing_version}'
+
+
+def bump_listing_version(auction_id):
+    # Saves of an existing auction must pass update_fields without listing_version, or they write back the version
+    # they loaded and undo bumps made meanwhile
+    Auction.objects.filter(pk=auction_id).update(listing_version=F('listing_version') + 1, updated_at=timezone.now())
+
+
+def item_listing(auction):
+    """
+    Returns the first page of an auction's items of each type, reading the database only when the listing version has
+    changed. Later pages are fetched by the page from the JSON item listing
+    :param auction: auction to list
+    :return: dict with 'silent' and 'live' lists of items, winners joined in, 'next' with the cursor after each list,
+             and 'count' of all items
+    """
+    key = f'auction_listing:{listing_key(auction)}'
+    listing = cache.get(key)
+    if listing is None:
+        listing = {'next': {}, 'count': auction.item_set.count()}
+        for auction_type, _ in Item.AUCTION_TYPES:
+            listing[auction_type], listing['next'][auction_type] = items_page(auction, auction_type=auction_type)
+        cache.set(key, listing, settings.AUCTION_LISTING_CACHE_TIMEOUT)
+    return listing
+
+
+def page_etag(request, last_modified, *parts):
+    """
+    Builds an ETag for a page from when its content last changed and who is viewing it.
+    The CSRF secret is part of the key because the page's forms embed the token
+    :param request: request being answered
+    :param last_modified: latest updated_at behind the page
+    :param parts: anything else the page shows that the timestamp does not cover
+    """
+    # get_token makes sure the secret exists, so the first response carries the same ETag as later ones
+    get_token(request)
+    key = repr((last_modified.isoformat(), request.user.pk, request.META['CSRF_COOKIE'], parts))
+    return f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+
+def not_modified(request, etag, last_modified):
+    # A 304 response if the client's copy is current, otherwise None
+    return get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Pages are per user, and clients should check back each time rather than reuse a stale copy
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,140 @@
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.db import transaction
+
+
+# Recent events kept per auction so reconnecting and long-polling clients can catch up
+HISTORY_SIZE = 200
+# Events buffered for one slow subscriber before the oldest are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+# Comment line sent on an idle stream so proxies keep the connection open
+KEEPALIVE_SECONDS = 15
+# Streams end after this long; EventSource reconnects on its own with Last-Event-ID
+STREAM_SECONDS = 300
+
+
+class EventBroker:
+    """
+    In-process publish/subscribe for auction events, one channel per auction.
+    Subscribers only see events published in the same process, so no external broker is needed
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._subscribers = defaultdict(set)
+        self._history = defaultdict(lambda: deque(maxlen=HISTORY_SIZE))
+
+    def publish(self, channel, data):
+        with self._lock:
+            event = (next(self._ids), data)
+            self._history[channel].append(event)
+            for q in self._subscribers[channel]:
+                try:
+                    q.put_nowait(event)
+                except queue.Full:
+                    # A stalled client loses its oldest event rather than blocking the bid path
+                    q.get_nowait()
+                    q.put_nowait(event)
+
+    def subscribe(self, channel, since=None):
+        """
+        Registers a subscriber queue, pre-filled with any retained events newer than `since`
+        :param channel: auction pk
+        :param since: id of the last event the client saw, if any
+        :return: queue of (id, data) events; pass it to unsubscribe when done
+        """
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if since is not None:
+                missed = [event for event in self._history[channel] if event[0] > since]
+                for event in missed[-SUBSCRIBER_QUEUE_SIZE:]:
+                    q.put_nowait(event)
+            self._subscribers[channel].add(q)
+        return q
+
+    def unsubscribe(self, channel, q):
+        with self._lock:
+            self._subscribers[channel].discard(q)
+            if not self._subscribers[channel]:
+                del self._subscribers[channel]
+
+    def events_since(self, channel, since):
+        with self._lock:
+            return [event for event in self._history[channel] if event[0] > since]
+
+    def last_id(self, channel):
+        with self._lock:
+            history = self._history[channel]
+            return history[-1][0] if history else 0
+
+
+broker = EventBroker()
+
+
+def publish_on_commit(auction_id, data):
+    # Subscribers must never see a change that is later rolled back
+    transaction.on_commit(lambda: broker.publish(auction_id, data))
+
+
+def item_event(item_id, **fields):
+    return dict(type='item', item=item_id, **fields)
+
+
+def auction_event(**fields):
+    return dict(type='auction', **fields)
+
+
+def import_event(done, total):
+    return dict(type='import', done=done, total=total)
+
+
+def format_sse(event):
+    event_id, data = event
+    return f'id: {event_id}\nevent: {data["type"]}\ndata: {json.dumps(data)}\n\n'
+
+
+def stream_events(channel, since=None):
+    """
+    Yields server-sent event text for an auction until STREAM_SECONDS have passed
+    :param channel: auction pk
+    :param since: Last-Event-ID sent by a reconnecting client, if any
+    """
+    q = broker.subscribe(channel, since)
+    deadline = time.monotonic() + STREAM_SECONDS
+    try:
+        # Tell the browser how long to wait before reconnecting
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < deadline:
+            try:
+                yield format_sse(q.get(timeout=KEEPALIVE_SECONDS))
+            except queue.Empty:
+                yield ': keepalive\n\n'
+    finally:
+        broker.unsubscribe(channel, q)
+
+
+def wait_for_events(channel, since, timeout):
+    """
+    Long-poll: returns retained events newer than `since`, waiting up to `timeout` seconds for one to arrive
+    :param channel: auction pk
+    :param since: id of the last event the client saw
+    :param timeout: seconds to wait when nothing is pending
+    :return: list of (id, data) events, empty on timeout
+    """
+    q = broker.subscribe(channel, since)
+    try:
+        events = []
+        try:
+            events.append(q.get(timeout=timeout))
+            while True:
+                events.append(q.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+    finally:
+        broker.unsubscribe(channel, q)
@@ -0,0 +1,50 @@
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Item
+
+
+# Filters a user may apply on the My Bids page. Each compiles to a condition the database can answer from an index,
+# instead of arbitrary lookups taken from the query string
+def _winning():
+    return Exists(Item.objects.filter(top_bid=OuterRef('pk')))
+
+
+BID_FILTERS = {
+    'winning': _winning,
+    'won': lambda: Q(won=True),
+    'open': lambda: Q(item__is_open=True),
+}
+
+# Values the My Bids page used to send as raw JSON lookups
+LEGACY_BID_FILTERS = {
+    '{"won": "True"}': 'won',
+    '{"item__is_open": "True"}': 'open',
+}
+
+BID_ORDERINGS = ['-timestamp', 'timestamp', '-price', 'price']
+DEFAULT_BID_ORDERING = '-timestamp'
+
+
+def filter_bids(queryset, name):
+    """
+    Applies a whitelisted filter to a bid queryset
+    :param queryset: bids to filter
+    :param name: filter name from BID_FILTERS (or a legacy JSON value); unknown names leave the queryset unfiltered
+    :return: filtered queryset
+    """
+    name = LEGACY_BID_FILTERS.get(name, name)
+    if name not in BID_FILTERS:
+        return queryset
+    return queryset.filter(BID_FILTERS[name]())
+
+
+def order_bids(queryset, ordering):
+    """
+    Orders a bid queryset by a whitelisted field, newest first within equal values
+    :param queryset: bids to order
+    :param ordering: one of BID_ORDERINGS; anything else falls back to newest first
+    :return: ordered queryset
+    """
+    if ordering not in BID_ORDERINGS:
+        ordering = DEFAULT_BID_ORDERING
+    return queryset.order_by(ordering, '-timestamp')
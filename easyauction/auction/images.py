@@ -0,0 +1,120 @@
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .timing import timed
+
+
+# Derivatives generated once per distinct upload: (max width, max height, JPEG quality)
+DERIVATIVES = {
+    'thumbnail': (200, 200, 80),   # item cards and watchlist
+    'medium': (1000, 1000, 85),    # item page
+    'print': (720, 720, 90),       # QR code label sheet, ~300 dpi at the printed size
+}
+
+_pool = None
+
+
+def derivative_name(image_hash, variant):
+    return f'item_pics/{variant}/{image_hash}.jpg'
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=settings.AUCTION_IMAGE_WORKERS, thread_name_prefix='image-ingest')
+    return _pool
+
+
+def schedule_ingest(item):
+    """
+    Queues an item's uploaded image for ingestion once the current transaction commits.
+    With AUCTION_IMAGE_WORKERS = 0 the image is ingested immediately on the calling thread
+    :param item: saved item whose image was just uploaded
+    """
+    if not item.image or item.image.name == item._meta.get_field('image').default:
+        return
+    if settings.AUCTION_IMAGE_WORKERS == 0:
+        ingest_item_image(item.pk)
+    else:
+        item_pk = item.pk
+        transaction.on_commit(lambda: _get_pool().submit(_ingest_in_worker, item_pk))
+
+
+def _ingest_in_worker(item_pk):
+    try:
+        ingest_item_image(item_pk)
+    finally:
+        # Worker threads get their own connection, which would otherwise stay open for the life of the pool
+        connection.close()
+
+
+@timed('images')
+def ingest_item_image(item_pk):
+    """
+    Hashes an item's uploaded image, de-duplicates it against images already ingested and writes any missing
+    derivatives with EXIF orientation applied. The original upload is never re-encoded
+    :param item_pk: pk of the item to ingest
+    :return: content hash of the image, or None if the item no longer exists
+    """
+    from .caching import bump_listing_version
+    from .models import Item
+
+    item = Item.objects.filter(pk=item_pk).only('pk', 'auction', 'image', 'image_hash').first()
+    if item is None:
+        return None
+
+    with default_storage.open(item.image.name, 'rb') as f:
+        data = f.read()
+    image_hash = hashlib.sha256(data).hexdigest()
+
+    # Same picture uploaded before: point at the stored copy and drop the duplicate upload
+    image_name = item.image.name
+    existing = (Item.objects.filter(image_hash=image_hash)
+                .exclude(pk=item_pk)
+                .values_list('image', flat=True)
+                .first())
+    if existing and existing != image_name and default_storage.exists(existing):
+        default_storage.delete(image_name)
+        image_name = existing
+
+    write_derivatives(data, image_hash)
+
+    Item.objects.filter(pk=item_pk).update(image=image_name, image_hash=image_hash, updated_at=timezone.now())
+    # Listings show the new thumbnail
+    bump_listing_version(item.auction_id)
+    return image_hash
+
+
+def write_derivatives(data, image_hash):
+    """
+    Writes whichever derivatives of an image are not stored yet, with EXIF orientation applied
+    :param data: original image bytes
+    :param image_hash: sha256 of data
+    """
+    missing = [variant for variant in DERIVATIVES if not default_storage.exists(derivative_name(image_hash, variant))]
+    if missing:
+        with Image.open(io.BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            for variant in missing:
+                write_derivative(image, image_hash, variant)
+
+
+def write_derivative(image, image_hash, variant):
+    width, height, quality = DERIVATIVES[variant]
+    resized = image.copy()
+    resized.thumbnail((width, height), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    resized.save(buffer, format='JPEG', quality=quality, optimize=True)
+    name = derivative_name(image_hash, variant)
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(buffer.getvalue()))
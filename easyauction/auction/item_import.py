@@ -0,0 +1,192 @@
+import csv
+import hashlib
+import io
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .caching import bump_listing_version
+from .forms import AddItemForm
+from .images import write_derivatives
+from .models import Item
+
+
+# Columns a spreadsheet must have; the rest are optional. `image` names a file in the ZIP
+REQUIRED_COLUMNS = ['name', 'starting_price', 'description']
+COLUMNS = REQUIRED_COLUMNS + ['bid_increment', 'auction_type', 'image']
+# Used for cells left blank, so donors' sheets don't need every column filled in
+DEFAULTS = {'bid_increment': '1', 'auction_type': 'silent'}
+
+# Progress is reported about this many times over an import
+PROGRESS_STEPS = 20
+
+
+def read_rows(csv_file):
+    """
+    Streams rows out of an uploaded CSV file without reading it into memory
+    :param csv_file: binary file object, e.g. an UploadedFile
+    :return: iterator of (line number, row dict with lower-case column names)
+    :raises ValidationError: if a required column is missing
+    """
+    reader = csv.DictReader(io.TextIOWrapper(csv_file, encoding='utf-8-sig', newline=''))
+    columns = [column.strip().lower() for column in reader.fieldnames or []]
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ValidationError(f'The CSV is missing the {", ".join(missing)} column{"s" if len(missing) > 1 else ""}')
+    reader.fieldnames = columns
+
+    for row in reader:
+        if not any((value or '').strip() for value in row.values()):
+            continue
+        yield reader.line_num, {column: (row.get(column) or '').strip() or DEFAULTS.get(column, '')
+                                for column in COLUMNS}
+
+
+def build_items(auction, csv_file, archive_names):
+    """
+    Validates every row with the add item form rules
+    :return: list of (unsaved Item, ZIP member name or None)
+    :raises ValidationError: listing every bad row
+    """
+    errors = []
+    rows = []
+    for line, row in read_rows(csv_file):
+        form = AddItemForm(row)
+        if not form.is_valid():
+            errors += [f'Line {line}: {field}: {message}'
+                       for field, messages in form.errors.items() for message in messages]
+            continue
+        member = None
+        if row['image']:
+            member = archive_names.get(row['image'].lower())
+            if member is None:
+                errors.append(f'Line {line}: image {row["image"]} is not in the ZIP')
+                continue
+
+        item = form.save(commit=False)
+        item.auction = auction
+        item.current_price = item.starting_price
+        item.min_bid = item.starting_price
+        rows.append((item, member))
+
+    if errors:
+        raise ValidationError(errors)
+    if not rows:
+        raise ValidationError('The CSV has no items')
+    return rows
+
+
+class ImageImporter:
+    """
+    Hashes an import's images and writes their derivatives from a pool of worker threads, then stores each distinct
+    picture once. Workers never touch the database
+    """
+    def __init__(self, archive):
+        self.archive = archive
+        self._lock = threading.Lock()
+
+    def read(self, member):
+        # ZipFile reads through one shared file handle
+        with self._lock:
+            return self.archive.read(member)
+
+    def derive(self, member):
+        """
+        :param member: ZIP member name
+        :return: content hash
+        """
+        data = self.read(member)
+        image_hash = hashlib.sha256(data).hexdigest()
+        try:
+            write_derivatives(data, image_hash)
+        except OSError:
+            raise ValidationError(f'{os.path.basename(member)} in the ZIP is not a readable image')
+        return image_hash
+
+    def hash_all(self, members, progress=None):
+        """
+        :param members: distinct ZIP member names
+        :param progress: optional callable(done, total)
+        :return: {member: content hash}
+        """
+        hashes = {}
+        total = len(members)
+        step = max(1, total // PROGRESS_STEPS)
+
+        def report():
+            if progress and (len(hashes) % step == 0 or len(hashes) == total):
+                progress(len(hashes), total)
+
+        if settings.AUCTION_IMAGE_WORKERS == 0:
+            for member in members:
+                hashes[member] = self.derive(member)
+                report()
+            return hashes
+
+        with ThreadPoolExecutor(max_workers=settings.AUCTION_IMAGE_WORKERS,
+                                thread_name_prefix='item-import') as pool:
+            futures = {pool.submit(self.derive, member): member for member in members}
+            for future in as_completed(futures):
+                hashes[futures[future]] = future.result()
+                report()
+        return hashes
+
+    def store(self, members, progress=None):
+        """
+        :return: {member: (image name in storage, content hash)}
+        """
+        hashes = self.hash_all(members, progress)
+
+        # Pictures an earlier item already stored keep pointing at that copy, as with a single upload
+        names = dict(Item.objects.filter(image_hash__in=set(hashes.values())).exclude(image='')
+                     .values_list('image_hash', 'image'))
+        names = {image_hash: name for image_hash, name in names.items() if default_storage.exists(name)}
+        for member, image_hash in hashes.items():
+            if image_hash not in names:
+                names[image_hash] = default_storage.save(f'item_pics/{os.path.basename(member)}',
+                                                         ContentFile(self.read(member)))
+        return {member: (names[image_hash], image_hash) for member, image_hash in hashes.items()}
+
+
+def import_items(auction, csv_file, zip_file=None, progress=None):
+    """
+    Adds the items listed in a CSV to an auction, with their pictures from an optional ZIP.
+    Every row is validated before any image is processed or item created; items are then created in bulk
+    :param auction: auction to add items to
+    :param csv_file: binary file with one item per row
+    :param zip_file: binary file with the images named in the CSV's image column
+    :param progress: optional callable(done, total), called as images are processed
+    :return: number of items created
+    :raises ValidationError: listing every bad row
+    """
+    archive = None
+    archive_names = {}
+    if zip_file:
+        try:
+            archive = zipfile.ZipFile(zip_file)
+        except zipfile.BadZipFile:
+            raise ValidationError('The images file is not a ZIP')
+        # Matched by file name alone, so it doesn't matter which folder the donor zipped them in
+        archive_names = {os.path.basename(name).lower(): name for name in archive.namelist()
+                         if not name.endswith('/')}
+
+    rows = build_items(auction, csv_file, archive_names)
+
+    members = sorted({member for _, member in rows if member})
+    if members:
+        images = ImageImporter(archive).store(members, progress)
+        for item, member in rows:
+            if member:
+                item.image, item.image_hash = images[member]
+
+    with transaction.atomic():
+        Item.objects.bulk_create([item for item, _ in rows], batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+        bump_listing_version(auction.pk)
+    return len(rows)
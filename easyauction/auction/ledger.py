@@ -0,0 +1,85 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import AuctionUser, Balance, BalanceEntry
+
+
+POSSIBLE = 'possible'
+GUARANTEED = 'guaranteed'
+CENT = Decimal('0.01')
+
+
+def entry(user_id, item, account, amount, reason):
+    """
+    :param user_id: user whose balance changes
+    :param item: item the change is about
+    :param account: POSSIBLE or GUARANTEED
+    :param amount: signed change
+    :param reason: one of BalanceEntry.REASONS
+    :return: unsaved BalanceEntry, for post
+    """
+    return BalanceEntry(user_id=user_id, auction_id=item.auction_id, item_id=item.pk,
+                        account=account, amount=amount, reason=reason)
+
+
+def transfer(item, account, before, after, reason):
+    """
+    Entries moving an item's amount on one account from one holder to another, e.g. a top bid or a win
+    :param before: (user id, amount) held before the change, or None
+    :param after: (user id, amount) held after the change, or None
+    :return: list of unsaved BalanceEntry, empty if nothing changed
+    """
+    if before == after:
+        return []
+    entries = []
+    if before:
+        entries.append(entry(before[0], item, account, -before[1], reason))
+    if after:
+        entries.append(entry(after[0], item, account, after[1], reason))
+    return entries
+
+
+def post(entries):
+    """
+    Appends entries to the ledger and adds them to the materialized balances. Three statements however many
+    entries and users there are: the entries, the users' totals, and an upsert of their per-auction balances
+    :param entries: unsaved BalanceEntry objects; zero amounts are skipped
+    """
+    entries = list(entries)
+    # Rounded to the columns' cents up front, so the raw upsert below stores exactly what the entries record
+    for e in entries:
+        e.amount = Decimal(e.amount).quantize(CENT)
+    entries = [e for e in entries if e.amount]
+    if not entries:
+        return
+
+    totals = defaultdict(lambda: {POSSIBLE: Decimal(0), GUARANTEED: Decimal(0)})
+    balances = defaultdict(lambda: {POSSIBLE: Decimal(0), GUARANTEED: Decimal(0)})
+    for e in entries:
+        totals[e.user_id][e.account] += e.amount
+        balances[e.user_id, e.auction_id][e.account] += e.amount
+
+    with transaction.atomic(savepoint=False):
+        BalanceEntry.objects.bulk_create(entries, batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+
+        users = [AuctionUser(pk=pk,
+                             possible_balance=F('possible_balance') + total[POSSIBLE],
+                             guaranteed_balance=F('guaranteed_balance') + total[GUARANTEED])
+                 for pk, total in totals.items()]
+        AuctionUser.objects.bulk_update(users, ['possible_balance', 'guaranteed_balance'],
+                                        batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+
+        # ON CONFLICT upserts are understood by both SQLite (3.24+) and PostgreSQL
+        table = connection.ops.quote_name(Balance._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {table} (user_id, auction_id, possible, guaranteed) VALUES (%s, %s, %s, %s) '
+                f'ON CONFLICT (user_id, auction_id) DO UPDATE SET '
+                f'possible = {table}.possible + excluded.possible, '
+                f'guaranteed = {table}.guaranteed + excluded.guaranteed',
+                [(user_id, auction_id, total[POSSIBLE], total[GUARANTEED])
+                 for (user_id, auction_id), total in balances.items()])
@@ -0,0 +1,76 @@
+from django.conf import settings
+
+
+# Most items a client can ask for at once
+MAX_PAGE_SIZE = 200
+
+# Listing fields a client can ask for, with the columns each needs. Joined columns come in the same query
+FIELDS = {
+    'name': ['name'],
+    'description': ['description'],
+    'auction_type': ['auction_type'],
+    'thumbnail': ['image', 'image_hash'],
+    'starting_price': ['starting_price'],
+    'current_price': ['current_price'],
+    'min_bid': ['min_bid'],
+    'bid_increment': ['bid_increment'],
+    'is_open': ['is_open'],
+    'is_sold': ['is_sold'],
+    'closes_at': ['closes_at'],
+    'bid_count': ['bid_count'],
+    'top_bid': ['top_bid__price', 'top_bid__bidder__username'],
+    'winner': ['winner__username'],
+}
+# Everything but the description, which is most of an item's size and only shown on the item page
+DEFAULT_FIELDS = [field for field in FIELDS if field != 'description']
+
+
+def items_page(auction, fields=DEFAULT_FIELDS, after=None, limit=None, **filters):
+    """
+    Reads one page of an auction's items in pk order, loading only the columns the fields need.
+    Pages are keyed on the last pk seen rather than an offset, so each costs the same however deep it is
+    :param auction: auction to list
+    :param fields: names from FIELDS
+    :param after: pk of the last item on the previous page, or None for the first page
+    :param limit: items per page, AUCTION_LISTING_PAGE_SIZE by default
+    :param filters: Item field lookups, e.g. auction_type='silent', is_open=True
+    :return: (list of items, pk to pass as `after` for the next page or None if this is the last)
+    """
+    limit = limit or settings.AUCTION_LISTING_PAGE_SIZE
+    columns = ['pk', 'auction'] + [column for field in fields for column in FIELDS[field]]
+    items = auction.item_set.filter(**filters)
+    if after is not None:
+        items = items.filter(pk__gt=after)
+    # Joined columns come through select_related, which needs every foreign key on the way loaded too
+    related = {column.rsplit('__', n)[0] for column in columns for n in range(1, column.count('__') + 1)}
+    if related:
+        items = items.select_related(*related)
+        columns += sorted(related)
+
+    items = list(items.only(*columns).order_by('pk')[:limit + 1])
+    if len(items) > limit:
+        return items[:limit], items[limit - 1].pk
+    return items, None
+
+
+def serialize(item, fields, user, user_is_admin):
+    """
+    :return: dict of the item's fields for a JSON listing. Who holds the top bid is only shown to the admin;
+             other users are told whether it is theirs
+    """
+    data = {'id': item.pk}
+    for field in fields:
+        if field == 'thumbnail':
+            data[field] = item.thumbnail_url
+        elif field == 'top_bid':
+            top_bid = item.top_bid
+            data[field] = None
+            if top_bid is not None:
+                data[field] = {'price': top_bid.price, 'mine': top_bid.bidder == user}
+                if user_is_admin:
+                    data[field]['bidder'] = top_bid.bidder.username
+        elif field == 'winner':
+            data[field] = item.winner.username if item.winner else None
+        else:
+            data[field] = getattr(item, field)
+    return data
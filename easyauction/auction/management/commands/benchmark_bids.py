@@ -0,0 +1,93 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+
+from auction.bid_queue import BidPending, enqueue_bid
+from auction.bidding import place_bid
+from auction.models import AuctionUser, Item
+
+
+class Command(BaseCommand):
+    help = 'Hammers a single open item with concurrent bids and reports accepted bids per second'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Number of concurrent bidders')
+        parser.add_argument('--bids', type=int, default=50, help='Bids attempted by each bidder')
+        parser.add_argument('--queue', action='store_true',
+                            help='Place bids through the group-commit bid writer instead of directly')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark auction and users afterwards')
+
+    def handle(self, *args, **options):
+        n_threads = options['threads']
+        n_bids = options['bids']
+        bid = enqueue_bid if options['queue'] else place_bid
+
+        admin = AuctionUser.objects.create_user(username='bench_admin', password='bench12345')
+        admin.create_auction(name='Bid benchmark', description='Created by benchmark_bids')
+        auction = admin.auction_set.get(name='Bid benchmark')
+        item = auction.add_item(name='Benchmark item', starting_price=1, item_desc='Hammered by benchmark_bids')
+        Item.objects.filter(pk=item.pk).update(is_open=True)
+        bidders = [AuctionUser.objects.create_user(username=f'bench_bidder{x}', password='bench12345')
+                   for x in range(n_threads)]
+
+        counts = {'accepted': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        start = threading.Barrier(n_threads + 1)
+
+        def hammer(bidder):
+            accepted = rejected = errors = 0
+            start.wait()
+            try:
+                for _ in range(n_bids):
+                    # Bid the minimum as last seen, like a phone that has not refreshed yet
+                    target = Item.objects.only('pk', 'is_open', 'closes_at', 'min_bid', 'bid_increment').get(pk=item.pk)
+                    try:
+                        result = bid(target, bidder, Decimal(target.min_bid))
+                    except (OperationalError, BidPending):
+                        errors += 1
+                        continue
+                    if result.accepted:
+                        accepted += 1
+                    else:
+                        rejected += 1
+            finally:
+                connection.close()
+            with lock:
+                counts['accepted'] += accepted
+                counts['rejected'] += rejected
+                counts['errors'] += errors
+
+        threads = [threading.Thread(target=hammer, args=(bidder,)) for bidder in bidders]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        began = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        item.refresh_from_db()
+        n_bids_stored = item.bid_set.count()
+        balances = sum(b.possible_balance for b in AuctionUser.objects.filter(pk__in=[b.pk for b in bidders]))
+
+        self.stdout.write(f"Threads: {n_threads}, attempts: {n_threads * n_bids}, elapsed: {elapsed:.2f}s")
+        self.stdout.write(f"Accepted: {counts['accepted']}, rejected: {counts['rejected']}, "
+                          f"errors: {counts['errors']}")
+        self.stdout.write(f"Accepted bids/sec: {counts['accepted'] / elapsed:.1f}, "
+                          f"attempts/sec: {n_threads * n_bids / elapsed:.1f}")
+
+        # Every accepted bid must be stored and only the top bid may be held against a balance
+        consistent = n_bids_stored == counts['accepted'] and balances == item.current_price
+        if consistent:
+            self.stdout.write(self.style.SUCCESS('Consistency check passed'))
+        else:
+            self.stdout.write(self.style.ERROR(
+                f"Consistency check failed: {n_bids_stored} bids stored, balances total {balances}, "
+                f"final price {item.current_price}"))
+
+        if not options['keep']:
+            auction.delete()
+            AuctionUser.objects.filter(pk__in=[admin.pk] + [b.pk for b in bidders]).delete()
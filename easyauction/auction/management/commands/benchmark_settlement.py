@@ -0,0 +1,66 @@
+import io
+import random
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from auction.models import AuctionUser, Bid, Item
+from auction.settlement import settle_auction
+
+
+class Command(BaseCommand):
+    help = 'Builds a large synthetic auction and times settling it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=10000)
+        parser.add_argument('--bids', type=int, default=200000)
+        parser.add_argument('--bidders', type=int, default=500)
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark auction and users afterwards')
+
+    def handle(self, *args, **options):
+        n_items = options['items']
+        n_bids = options['bids']
+        n_bidders = options['bidders']
+        rng = random.Random(0)
+
+        self.stdout.write(f'Seeding {n_items} items, {n_bids} bids, {n_bidders} bidders...')
+        with transaction.atomic():
+            admin = AuctionUser.objects.create_user(username='settle_admin', password='bench12345')
+            admin.create_auction(name='Settlement benchmark', description='Created by benchmark_settlement')
+            auction = admin.auction_set.get(name='Settlement benchmark')
+
+            AuctionUser.objects.bulk_create(
+                [AuctionUser(username=f'settle_bidder{x}') for x in range(n_bidders)],
+                batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+            bidder_ids = list(AuctionUser.objects.filter(username__startswith='settle_bidder')
+                              .values_list('pk', flat=True))
+
+            Item.objects.bulk_create(
+                [Item(auction=auction, name=f'Item {x}', description='', starting_price=1, current_price=1, min_bid=1)
+                 for x in range(n_items)], batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+            item_ids = list(auction.item_set.values_list('pk', flat=True))
+
+            bids = []
+            next_price = dict.fromkeys(item_ids, 1)
+            for _ in range(n_bids):
+                item_id = rng.choice(item_ids)
+                bids.append(Bid(item_id=item_id, bidder_id=rng.choice(bidder_ids), price=Decimal(next_price[item_id])))
+                next_price[item_id] += 1
+            Bid.objects.bulk_create(bids, batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+        call_command('rebuild_bid_stats', auction=auction.pk, stdout=io.StringIO())
+
+        with CaptureQueriesContext(connection) as queries:
+            began = time.perf_counter()
+            settled = settle_auction(auction)
+            elapsed = time.perf_counter() - began
+
+        self.stdout.write(f'Settled {settled} items in {elapsed:.2f}s using {len(queries)} queries')
+
+        if not options['keep']:
+            auction.delete()
+            AuctionUser.objects.filter(pk__in=[admin.pk] + bidder_ids).delete()
@@ -0,0 +1,26 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auction.models import Auction
+from auction.reports import report_rows
+
+
+class Command(BaseCommand):
+    help = 'Writes the CSV report of an auction, at any point in its life, to stdout or a file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('auction_id', type=int)
+        parser.add_argument('--output', help='File to write instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            auction = Auction.objects.get(pk=options['auction_id'])
+        except Auction.DoesNotExist:
+            raise CommandError(f"Auction {options['auction_id']} does not exist")
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                csv.writer(f).writerows(report_rows(auction))
+        else:
+            csv.writer(self.stdout).writerows(report_rows(auction))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from auction.images import ingest_item_image
+from auction.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Generates image derivatives for items whose uploads have not been ingested yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-check every uploaded image, not only new ones')
+
+    def handle(self, *args, **options):
+        items = Item.objects.exclude(image=Item._meta.get_field('image').default)
+        if not options['all']:
+            items = items.filter(image_hash='')
+
+        count = 0
+        for item_pk in items.values_list('pk', flat=True).iterator():
+            ingest_item_image(item_pk)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Ingested {count} item image(s)'))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from auction.models import Bid, Item
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds Item.bid_count, top_bid and runner_up_bid from the Bid table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--auction', type=int, help='Only rebuild the items of this auction')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        items = Item.objects.all()
+        bids = Bid.objects.all()
+        if options['auction']:
+            items = items.filter(auction_id=options['auction'])
+            bids = bids.filter(item__auction_id=options['auction'])
+
+        # One ordered pass over the bids: the first two rows seen for an item are its top and runner-up
+        stats = {}
+        for item_id, bid_id in bids.order_by('item_id', '-price', '-pk').values_list('item_id', 'pk').iterator():
+            count, top_two = stats.setdefault(item_id, [0, []])
+            stats[item_id][0] = count + 1
+            if len(top_two) < 2:
+                top_two.append(bid_id)
+
+        changed = []
+        for item in items.only('pk', 'bid_count', 'top_bid', 'runner_up_bid').iterator():
+            count, top_two = stats.get(item.pk, (0, []))
+            top_bid_id = top_two[0] if len(top_two) > 0 else None
+            runner_up_bid_id = top_two[1] if len(top_two) > 1 else None
+            if (item.bid_count, item.top_bid_id, item.runner_up_bid_id) != (count, top_bid_id, runner_up_bid_id):
+                item.bid_count = count
+                item.top_bid_id = top_bid_id
+                item.runner_up_bid_id = runner_up_bid_id
+                changed.append(item)
+
+        with transaction.atomic():
+            Item.objects.bulk_update(changed, ['bid_count', 'top_bid', 'runner_up_bid'],
+                                     batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt bid statistics, {len(changed)} item(s) corrected'))
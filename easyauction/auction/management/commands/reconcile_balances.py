@@ -0,0 +1,129 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from auction.ledger import GUARANTEED, POSSIBLE, post
+from auction.models import Auction, AuctionUser, Balance, BalanceEntry, Item
+
+
+ZERO = (Decimal(0), Decimal(0))
+
+
+class Command(BaseCommand):
+    help = ('Recomputes every balance from the ledger in one aggregate pass and reports where the materialized '
+            'balances have drifted from it, and where the ledger disagrees with the items themselves '
+            '(top bids held, items won). With --fix, rewrites the materialized balances from the ledger and posts '
+            'adjusting entries for the disagreements')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Correct what is found instead of only reporting it')
+
+    def handle(self, *args, **options):
+        ledger = self.ledger_balances()
+        expected = self.item_balances()
+        materialized = {(user_id, auction_id): (possible, guaranteed)
+                        for user_id, auction_id, possible, guaranteed
+                        in Balance.objects.values_list('user_id', 'auction_id', 'possible', 'guaranteed')}
+        users = {pk: (username, (possible, guaranteed))
+                 for pk, username, possible, guaranteed
+                 in AuctionUser.objects.values_list('pk', 'username', 'possible_balance', 'guaranteed_balance')}
+        auctions = dict(Auction.objects.values_list('pk', 'name'))
+
+        ledger_totals = defaultdict(lambda: ZERO)
+        for (user_id, _), (possible, guaranteed) in ledger.items():
+            total = ledger_totals[user_id]
+            ledger_totals[user_id] = (total[0] + possible, total[1] + guaranteed)
+
+        def describe(key):
+            user_id, auction_id = key
+            return f'{users[user_id][0]} in {auctions[auction_id]}'
+
+        drifted = sorted(key for key in ledger.keys() | materialized.keys()
+                         if ledger.get(key, ZERO) != materialized.get(key, ZERO))
+        for key in drifted:
+            self.stdout.write(f'{describe(key)}: balance (possible, guaranteed) {self.pair(materialized.get(key))}, '
+                              f'ledger {self.pair(ledger.get(key))}')
+        drifted_users = sorted(pk for pk, (_, total) in users.items() if total != ledger_totals[pk])
+        for pk in drifted_users:
+            self.stdout.write(f'{users[pk][0]}: total (possible, guaranteed) {self.pair(users[pk][1])}, '
+                              f'ledger {self.pair(ledger_totals[pk])}')
+        unposted = sorted(key for key in expected.keys() | ledger.keys()
+                          if expected.get(key, ZERO) != ledger.get(key, ZERO))
+        for key in unposted:
+            self.stdout.write(f'{describe(key)}: ledger (possible, guaranteed) {self.pair(ledger.get(key))}, '
+                              f'items {self.pair(expected.get(key))}')
+
+        if not (drifted or drifted_users or unposted):
+            self.stdout.write(self.style.SUCCESS('All balances agree with the ledger and the items'))
+            return
+        if not options['fix']:
+            self.stdout.write(self.style.WARNING(
+                f'{len(drifted)} auction balance(s) and {len(drifted_users)} user total(s) drifted from the ledger, '
+                f'{len(unposted)} auction balance(s) disagree with the items; run with --fix to correct them'))
+            return
+
+        with transaction.atomic():
+            # Materialized balances become exactly the ledger's sums, then adjustments are posted on top
+            Balance.objects.all().delete()
+            Balance.objects.bulk_create([Balance(user_id=user_id, auction_id=auction_id,
+                                                 possible=possible, guaranteed=guaranteed)
+                                         for (user_id, auction_id), (possible, guaranteed) in ledger.items()],
+                                        batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+            AuctionUser.objects.bulk_update([AuctionUser(pk=pk,
+                                                         possible_balance=ledger_totals[pk][0],
+                                                         guaranteed_balance=ledger_totals[pk][1])
+                                             for pk in drifted_users],
+                                            ['possible_balance', 'guaranteed_balance'],
+                                            batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+
+            adjustments = []
+            for user_id, auction_id in unposted:
+                have = ledger.get((user_id, auction_id), ZERO)
+                want = expected.get((user_id, auction_id), ZERO)
+                for account, difference in ((POSSIBLE, want[0] - have[0]), (GUARANTEED, want[1] - have[1])):
+                    adjustments.append(BalanceEntry(user_id=user_id, auction_id=auction_id, account=account,
+                                                    amount=difference, reason='adjust'))
+            post(adjustments)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rewrote {len(drifted)} auction balance(s) and {len(drifted_users)} user total(s) from the ledger, '
+            f'adjusted {len(unposted)}'))
+
+    @staticmethod
+    def pair(balance):
+        possible, guaranteed = balance or ZERO
+        return f'${possible:.2f}, ${guaranteed:.2f}'
+
+    @staticmethod
+    def ledger_balances():
+        """
+        :return: {(user id, auction id): (possible, guaranteed)} summed over every ledger entry
+        """
+        rows = (BalanceEntry.objects.order_by()
+                .values('user_id', 'auction_id')
+                .annotate(possible=Sum('amount', filter=Q(account=POSSIBLE)),
+                          guaranteed=Sum('amount', filter=Q(account=GUARANTEED))))
+        return {(row['user_id'], row['auction_id']): (row['possible'] or Decimal(0), row['guaranteed'] or Decimal(0))
+                for row in rows}
+
+    @staticmethod
+    def item_balances():
+        """
+        Balances as the items imply them: each top bid is held against its bidder's possible balance,
+        and each sold item's price is owed by its winner
+        :return: {(user id, auction id): (possible, guaranteed)}
+        """
+        balances = defaultdict(lambda: ZERO)
+        held = (Item.objects.filter(top_bid__isnull=False).order_by()
+                .values_list('top_bid__bidder_id', 'auction_id').annotate(total=Sum('top_bid__price')))
+        for user_id, auction_id, total in held:
+            balances[user_id, auction_id] = (total, balances[user_id, auction_id][1])
+        won = (Item.objects.filter(is_sold=True, winner__isnull=False).order_by()
+               .values_list('winner_id', 'auction_id').annotate(total=Sum('current_price')))
+        for user_id, auction_id, total in won:
+            balances[user_id, auction_id] = (balances[user_id, auction_id][0], total)
+        return dict(balances)
@@ -0,0 +1,143 @@
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from auction.models import Auction, Item
+
+
+# Share of guest requests per route during a closing rush. One extra client plays the admin,
+# who keeps reloading the participants page to follow the totals
+ROUTE_WEIGHTS = {
+    'item': 45,
+    'submit_bid': 25,
+    'auction_detail': 20,
+    'my_bids': 10,
+}
+ROUTES = list(ROUTE_WEIGHTS) + ['participants']
+# Most of the rush lands on the few items still being fought over
+HOT_ITEM_SHARE = 0.1
+HOT_TRAFFIC_SHARE = 0.8
+
+
+def percentile(values, p):
+    # values must be sorted
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Command(BaseCommand):
+    help = ('Replays a closing-rush workload against the real URL routes with concurrent in-process clients and '
+            'reports throughput, p50/p95/p99 latency and failures per route')
+
+    def add_arguments(self, parser):
+        parser.add_argument('auction_id', type=int, nargs='?', help='Auction to replay against, '
+                                                                    'by default the newest published one')
+        parser.add_argument('--threads', type=int, default=32, help='Concurrent guests, plus one admin')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['auction_id']:
+            auction = Auction.objects.filter(pk=options['auction_id']).first()
+        else:
+            auction = Auction.objects.filter(published=True).order_by('-pk').first()
+        if auction is None:
+            raise CommandError('No auction to replay against; run seed_auctions first')
+
+        guests = list(auction.participants.all()[:options['threads']])
+        if not guests:
+            raise CommandError(f'{auction.name} has no participants')
+        item_ids = list(auction.item_set.filter(auction_type='silent', is_open=True)
+                        .order_by('-bid_count').values_list('pk', flat=True))
+        if not item_ids:
+            raise CommandError(f'{auction.name} has no open silent items')
+        hot_items = item_ids[:max(1, int(len(item_ids) * HOT_ITEM_SHARE))]
+
+        latencies = defaultdict(list)
+        failures = defaultdict(Counter)
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+        routes, weights = zip(*ROUTE_WEIGHTS.items())
+
+        def guest(index, user):
+            rng = random.Random(options['seed'] + index)
+            client = Client()
+            client.force_login(user)
+            own = defaultdict(list)
+            own_failures = defaultdict(Counter)
+            try:
+                while time.monotonic() < deadline:
+                    route = 'participants' if user == auction.admin else rng.choices(routes, weights)[0]
+                    item_id = rng.choice(hot_items if rng.random() < HOT_TRAFFIC_SHARE else item_ids)
+
+                    began = time.perf_counter()
+                    try:
+                        status = self.request(client, route, auction, item_id)
+                    except Exception as e:
+                        own_failures[route][str(e).splitlines()[0][:80] or type(e).__name__] += 1
+                    else:
+                        if status >= 400:
+                            own_failures[route][f'HTTP {status}'] += 1
+                    own[route].append(time.perf_counter() - began)
+            finally:
+                connection.close()
+            with lock:
+                for route, values in own.items():
+                    latencies[route].extend(values)
+                for route, counts in own_failures.items():
+                    failures[route].update(counts)
+
+        self.stdout.write(f'Replaying against {auction.name} (id {auction.pk}) with {len(guests)} clients '
+                          f'for {options["duration"]:.0f}s...')
+        threads = [threading.Thread(target=guest, args=(index, user))
+                   for index, user in enumerate(guests + [auction.admin])]
+        began = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        self.report(latencies, failures, elapsed)
+
+    def request(self, client, route, auction, item_id):
+        if route == 'submit_bid':
+            # Bid the minimum as last seen, like a guest who has just reloaded the item
+            min_bid = Item.objects.values_list('min_bid', flat=True).get(pk=item_id)
+            response = client.post(reverse('auction:submit_bid', args=[item_id]), {'bid': str(min_bid)})
+        elif route == 'item':
+            response = client.get(reverse('auction:item', args=[item_id]))
+        elif route == 'my_bids':
+            response = client.get(reverse('auction:my_bids'))
+        elif route == 'participants':
+            response = client.get(reverse('auction:participants', args=[auction.pk]))
+        else:
+            response = client.get(reverse('auction:auction_detail', args=[auction.pk]))
+        return response.status_code
+
+    def report(self, latencies, failures, elapsed):
+        total = sum(len(values) for values in latencies.values())
+        self.stdout.write(f'{total} requests in {elapsed:.1f}s, {total / elapsed:.1f} req/s')
+        self.stdout.write(f'{"route":<16}{"count":>8}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+                          f'{"failed":>8}')
+        for route in ROUTES:
+            values = sorted(latencies.get(route, []))
+            if not values:
+                continue
+            n_failed = sum(failures[route].values())
+            self.stdout.write(f'{route:<16}{len(values):>8}{len(values) / elapsed:>9.1f}'
+                              f'{percentile(values, 50) * 1000:>9.1f}{percentile(values, 95) * 1000:>9.1f}'
+                              f'{percentile(values, 99) * 1000:>9.1f}{n_failed:>8}')
+
+        for route, counts in failures.items():
+            for reason, count in counts.most_common():
+                self.stdout.write(self.style.ERROR(f'{route}: {count} x {reason}'))
+        if not any(failures.values()):
+            self.stdout.write(self.style.SUCCESS('No failed requests'))
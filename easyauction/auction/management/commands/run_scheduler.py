@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from auction.scheduler import DeadlineScheduler
+
+
+class Command(BaseCommand):
+    help = ('Opens and closes items at their opens_at and closes_at deadlines, settling silent items as they close. '
+            'Deadlines missed while it was not running are acted on when it starts')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Act on what is due now and exit')
+        parser.add_argument('--batch-size', type=int, help='Items opened or closed per transaction')
+
+    def handle(self, *args, **options):
+        scheduler = DeadlineScheduler(options['batch_size'])
+        if options['once']:
+            scheduler.load()
+            opened, closed, settled = scheduler.run_due()
+            self.stdout.write(self.style.SUCCESS(f'Opened {opened} item(s), closed {closed}, settled {settled}'))
+            return
+
+        try:
+            scheduler.run(log=self.stdout.write)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,128 @@
+import io
+import random
+from decimal import Decimal
+
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+
+from auction.images import ingest_item_image
+from auction.ledger import POSSIBLE, post
+from auction.models import Auction, AuctionUser, BalanceEntry, Bid, Item
+
+
+SEED_PASSWORD = 'seed12345'
+# Distinct pictures shared across items, like donors photographing on the same table
+IMAGE_COUNT = 12
+
+
+class Command(BaseCommand):
+    help = ('Seeds a synthetic deployment: users, published auctions and items with images and a skewed bid '
+            'history, for load testing with replay_bids. Seeded users share the password "seed12345"')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1500, help='Number of guests')
+        parser.add_argument('--auctions', type=int, default=1)
+        parser.add_argument('--items', type=int, default=300, help='Items per auction')
+        parser.add_argument('--bids', type=int, default=20, help='Average bids per silent item')
+        parser.add_argument('--live-share', type=float, default=0.1, help='Fraction of items sold live')
+        parser.add_argument('--prefix', default='seed', help='Prefix of seeded usernames and auction names')
+        parser.add_argument('--no-images', action='store_true', help='Leave items on the default picture')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable runs')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+
+        with transaction.atomic():
+            user_ids = self.create_users(prefix, options['users'])
+            admin = AuctionUser.objects.create_user(username=f'{prefix}_admin', password=SEED_PASSWORD)
+            images = [] if options['no_images'] else self.create_images(prefix, rng)
+
+            auctions = []
+            for a in range(options['auctions']):
+                auction = Auction.objects.create(name=f'{prefix} auction {a}', admin=admin, published=True,
+                                                 opened_for_bidding=True, description='Seeded by seed_auctions')
+                auction.participants.add(*user_ids)
+                self.create_items(auction, options['items'], options['live_share'], images, rng)
+                n_bids = self.create_bids(auction, user_ids, options['bids'], rng)
+                auctions.append(auction)
+                self.stdout.write(f'{auction.name} (id {auction.pk}): {options["items"]} items, {n_bids} bids')
+
+        for auction in auctions:
+            call_command('rebuild_bid_stats', auction=auction.pk, stdout=io.StringIO())
+            self.apply_prices(auction)
+            if images:
+                # Every item shares one of a few pictures, so derivatives are only generated once per picture
+                for item_pk in auction.item_set.values_list('pk', flat=True):
+                    ingest_item_image(item_pk)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(user_ids)} users and {len(auctions)} auction(s); admin is {prefix}_admin'))
+
+    def create_users(self, prefix, count):
+        # Hashing is deliberately slow, so every guest shares one hash
+        password = make_password(SEED_PASSWORD)
+        AuctionUser.objects.bulk_create(
+            [AuctionUser(username=f'{prefix}_guest{x}', first_name='Guest', last_name=str(x), password=password)
+             for x in range(count)], batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+        return list(AuctionUser.objects.filter(username__startswith=f'{prefix}_guest').values_list('pk', flat=True))
+
+    def create_images(self, prefix, rng):
+        names = []
+        for x in range(IMAGE_COUNT):
+            buffer = io.BytesIO()
+            color = tuple(rng.randrange(256) for _ in range(3))
+            Image.new('RGB', (1600, 1200), color).save(buffer, format='JPEG', quality=85)
+            names.append(default_storage.save(f'item_pics/{prefix}_{x}.jpg', ContentFile(buffer.getvalue())))
+        return names
+
+    def create_items(self, auction, count, live_share, images, rng):
+        items = []
+        for x in range(count):
+            price = Decimal(rng.choice([5, 10, 20, 25, 50, 100, 250]))
+            item = Item(auction=auction, name=f'Item {x}', description='Seeded item', starting_price=price,
+                        current_price=price, min_bid=price, bid_increment=max(price // 10, 1), is_open=True,
+                        auction_type='live' if rng.random() < live_share else 'silent')
+            if images:
+                item.image = rng.choice(images)
+            items.append(item)
+        Item.objects.bulk_create(items, batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+
+    def create_bids(self, auction, user_ids, average, rng):
+        """
+        Bids follow a heavy-tailed popularity: most items draw a handful of bids and a few draw dozens.
+        Prices climb by the item's increment, each bid from a different guest than the one before
+        """
+        silent = list(auction.item_set.filter(auction_type='silent').values_list('pk', 'starting_price',
+                                                                                    'bid_increment'))
+        bids = []
+        for item_id, price, increment in silent:
+            n_bids = min(int(rng.paretovariate(1.5) * average / 3), average * 10)
+            bidder_id = None
+            for _ in range(n_bids):
+                bidder_id = rng.choice([pk for pk in rng.sample(user_ids, 2) if pk != bidder_id])
+                bids.append(Bid(item_id=item_id, bidder_id=bidder_id, price=price))
+                price += increment * rng.choice([1, 1, 1, 2, 5])
+        Bid.objects.bulk_create(bids, batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+        return len(bids)
+
+    def apply_prices(self, auction):
+        """
+        Brings prices and bidders' possible balances in line with the top bids, as place_bid would have left them
+        """
+        items = auction.item_set.filter(top_bid__isnull=False)
+        top_price = Bid.objects.filter(pk=OuterRef('top_bid')).values('price')[:1]
+        items.update(current_price=Subquery(top_price))
+        items.update(min_bid=F('current_price') + F('bid_increment'))
+
+        post([BalanceEntry(user_id=bidder_id, auction_id=auction.pk, item_id=item_id,
+                           account=POSSIBLE, amount=price, reason='bid')
+              for item_id, bidder_id, price in items.values_list('pk', 'top_bid__bidder_id', 'top_bid__price')])
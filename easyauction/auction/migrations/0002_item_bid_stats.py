@@ -0,0 +1,40 @@
+# Generated by Django 3.0.14 on 2026-10-18 20:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_bid_stats(apps, schema_editor):
+    Item = apps.get_model('auction', 'Item')
+    for item in Item.objects.all():
+        top_two = list(item.bid_set.order_by('-price', '-pk').values_list('pk', flat=True)[:2])
+        item.bid_count = item.bid_set.count()
+        item.top_bid_id = top_two[0] if len(top_two) > 0 else None
+        item.runner_up_bid_id = top_two[1] if len(top_two) > 1 else None
+        item.save(update_fields=['bid_count', 'top_bid', 'runner_up_bid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auction', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='bid_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='runner_up_bid',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='auction.Bid'),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='top_bid',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='auction.Bid'),
+        ),
+        migrations.RunPython(backfill_bid_stats, migrations.RunPython.noop),
+    ]
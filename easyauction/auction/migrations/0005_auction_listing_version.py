@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auction', '0004_notification_user_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auction',
+            name='listing_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-18 20:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auction', '0005_auction_listing_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auction',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.14 on 2026-10-18 20:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auction', '0006_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['item', '-price'], name='bid_item_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['bidder', '-timestamp'], name='bid_bidder_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['auction', 'auction_type'], name='item_auction_type_idx'),
+        ),
+    ]
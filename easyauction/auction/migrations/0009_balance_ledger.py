@@ -0,0 +1,89 @@
+# Generated by Django 3.0.14 on 2026-10-18 21:18
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_ledger(apps, schema_editor):
+    """
+    Opens the ledger with what the items already imply: each top bid held against its bidder's possible balance,
+    and each sold item's price owed by its winner. Balances and user totals are then built from those entries
+    """
+    Item = apps.get_model('auction', 'Item')
+    BalanceEntry = apps.get_model('auction', 'BalanceEntry')
+    Balance = apps.get_model('auction', 'Balance')
+    AuctionUser = apps.get_model('auction', 'AuctionUser')
+
+    entries = []
+    held = (Item.objects.filter(top_bid__isnull=False)
+            .values_list('pk', 'auction_id', 'top_bid__bidder_id', 'top_bid__price'))
+    for pk, auction_id, user_id, price in held:
+        entries.append(BalanceEntry(user_id=user_id, auction_id=auction_id, item_id=pk,
+                                    account='possible', amount=price, reason='bid'))
+    won = (Item.objects.filter(is_sold=True, winner__isnull=False)
+           .values_list('pk', 'auction_id', 'winner_id', 'current_price', 'auction_type'))
+    for pk, auction_id, user_id, price, auction_type in won:
+        entries.append(BalanceEntry(user_id=user_id, auction_id=auction_id, item_id=pk, account='guaranteed',
+                                    amount=price, reason='result' if auction_type == 'live' else 'win'))
+    entries = [e for e in entries if e.amount]
+
+    balances = defaultdict(lambda: {'possible': Decimal(0), 'guaranteed': Decimal(0)})
+    totals = defaultdict(lambda: {'possible': Decimal(0), 'guaranteed': Decimal(0)})
+    for e in entries:
+        balances[e.user_id, e.auction_id][e.account] += e.amount
+        totals[e.user_id][e.account] += e.amount
+
+    BalanceEntry.objects.bulk_create(entries, batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+    Balance.objects.bulk_create([Balance(user_id=user_id, auction_id=auction_id,
+                                         possible=total['possible'], guaranteed=total['guaranteed'])
+                                 for (user_id, auction_id), total in balances.items()],
+                                batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+    # Totals kept before the ledger existed are replaced by the ledger's, so the two start out agreeing
+    AuctionUser.objects.update(possible_balance=0, guaranteed_balance=0)
+    AuctionUser.objects.bulk_update([AuctionUser(pk=pk, possible_balance=total['possible'],
+                                                 guaranteed_balance=total['guaranteed'])
+                                     for pk, total in totals.items()],
+                                    ['possible_balance', 'guaranteed_balance'],
+                                    batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auction', '0008_watchlist_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(choices=[('possible', 'possible'), ('guaranteed', 'guaranteed')], max_length=10)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('reason', models.CharField(choices=[('bid', 'bid'), ('outbid', 'outbid'), ('retract', 'retract'), ('delete', 'delete'), ('retype', 'retype'), ('win', 'win'), ('result', 'result'), ('reopen', 'reopen'), ('adjust', 'adjust')], max_length=10)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('auction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='auction.Auction')),
+                ('item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='auction.Item')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Balance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('possible', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('guaranteed', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('auction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='auction.Auction')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='balance',
+            constraint=models.UniqueConstraint(fields=('user', 'auction'), name='balance_user_auction_uniq'),
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.14 on 2026-10-18 21:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auction', '0009_balance_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='closes_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='opens_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='soft_close',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['opens_at'], name='item_opens_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['closes_at'], name='item_closes_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+
+# An external-content FTS5 index over item names and descriptions. The text stays in auction_item; triggers keep the
+# index in step with every insert, delete and edit of those columns, however the rows are written.
+# SQLite schema changes that rebuild auction_item drop its triggers, so such a migration must run CREATE again
+CREATE = [
+    "CREATE VIRTUAL TABLE auction_item_fts USING fts5("
+    "name, description, content='auction_item', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER auction_item_fts_insert AFTER INSERT ON auction_item BEGIN "
+    "INSERT INTO auction_item_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER auction_item_fts_delete AFTER DELETE ON auction_item BEGIN "
+    "INSERT INTO auction_item_fts(auction_item_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER auction_item_fts_update AFTER UPDATE OF name, description ON auction_item BEGIN "
+    "INSERT INTO auction_item_fts(auction_item_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO auction_item_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    # Indexes the items that already exist
+    "INSERT INTO auction_item_fts(auction_item_fts) VALUES ('rebuild')",
+]
+
+DROP = [
+    'DROP TRIGGER IF EXISTS auction_item_fts_update',
+    'DROP TRIGGER IF EXISTS auction_item_fts_delete',
+    'DROP TRIGGER IF EXISTS auction_item_fts_insert',
+    'DROP TABLE IF EXISTS auction_item_fts',
+]
+
+
+def run(statements):
+    # Other databases search with a plain filter instead, see auction.search
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auction', '0010_item_deadlines'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE), run(DROP)),
+    ]
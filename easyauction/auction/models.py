@@ -1,9 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from auction.utils import rotate_image
-import os
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from auction.events import auction_event, publish_on_commit
+from auction.images import derivative_name
 
 
 # Extends the base user class to preserve compatibility with Django's auth backend
@@ -45,13 +45,17 @@ class AuctionUser(AbstractUser):
         auction = self.get_auction(pk=pk)
         auction.archive()
 
+    # Watching changes what the item page and watchlist show, so the item is marked as modified
     def watch_item(self, pk: int):
         item = Item.objects.get(pk=pk)
         self.watched_items.add(item)
+        Item.objects.filter(pk=pk).update(updated_at=timezone.now())
 
     def unwatch_item(self, pk:int):
         item = Item.objects.get(pk=pk)
         self.watched_items.remove(item)
+        Item.objects.filter(pk=pk).update(updated_at=timezone.now())
+        WatchlistRemoval.objects.create(user=self, item_id=pk)
 
     def send_notification(self, text, item):
         notification = self.notification_set.create(text=text, item=item)
@@ -67,6 +71,10 @@ class Auction(models.Model):
     description = models.TextField()
     participants = models.ManyToManyField(AuctionUser, related_name='joined_auctions', related_query_name='joined_auction')
     opened_for_bidding = models.BooleanField(default=False)
+    # Bumped whenever the item listing changes; cached listings are keyed on it
+    listing_version = models.PositiveIntegerField(default=0)
+    # Last change to the auction or its listing. Validates conditional GETs of the auction page
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -77,17 +85,21 @@ class Auction(models.Model):
     def archive(self):
         self.published = False
 
+    # The admin's auction and item pages list the participants, so joining marks the auction as modified
+    def add_participant(self, user):
+        self.participants.add(user)
+        Auction.objects.filter(pk=self.pk).update(updated_at=timezone.now())
+
+    # Opens every item with a single UPDATE. No per-item save, so no post_save receivers run
     def open_bidding(self):
         self.opened_for_bidding = True
-        for item in self.item_set.all():
-            item.is_open = True
-            item.save()
+        self.item_set.update(is_open=True, updated_at=timezone.now())
+        publish_on_commit(self.pk, auction_event(is_open=True))
 
     def close_bidding(self):
         self.opened_for_bidding = False
-        for item in self.item_set.all():
-            item.is_open = False
-            item.save()
+        self.item_set.update(is_open=False, updated_at=timezone.now())
+        publish_on_commit(self.pk, auction_event(is_open=False))
 
     def add_item(self, name, starting_price, item_desc):
         item = self.item_set.create(name=name,
@@ -110,26 +122,80 @@ class Item(models.Model):
     bid_increment = models.DecimalField(max_digits=10, decimal_places=2, default=1)
     min_bid = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(default="defaults/default_item_pic.jpg", upload_to="item_pics")
+    image_hash = models.CharField(max_length=64, blank=True, db_index=True)
     description = models.TextField()
     auction_type = models.CharField(max_length=6, choices=AUCTION_TYPES, default='silent')
     is_sold = models.BooleanField(default=False)
     is_paid = models.BooleanField(default=False)
     is_open = models.BooleanField(default=False)
     paid_time = models.DateTimeField(null=True, blank=True)
+    # Optional deadlines, acted on by the deadline scheduler (auction.scheduler). opens_at is cleared once the item has opened
+    opens_at = models.DateTimeField(null=True, blank=True)
+    closes_at = models.DateTimeField(null=True, blank=True)
+    # A bid arriving less than this before closes_at pushes the close back to this long after the bid
+    soft_close = models.DurationField(null=True, blank=True)
     auction = models.ForeignKey(Auction, on_delete=models.CASCADE)
     winner = models.ForeignKey(AuctionUser, on_delete=models.SET_NULL, null=True, blank=True)
     followers = models.ManyToManyField(AuctionUser, related_name='watched_items', related_query_name='watched_item')
 
+    # Denormalized bid statistics, kept current by every path that creates or removes bids
+    bid_count = models.PositiveIntegerField(default=0)
+    top_bid = models.ForeignKey('Bid', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    runner_up_bid = models.ForeignKey('Bid', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    # Last change to anything the item page shows. Paths that write with update() set it themselves
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Auction pages list items by type
+            models.Index(fields=['auction', 'auction_type'], name='item_auction_type_idx'),
+            # Watchlist syncs ask for items changed since a cursor
+            models.Index(fields=['updated_at'], name='item_updated_idx'),
+            # The scheduler loads pending deadlines when it starts
+            models.Index(fields=['opens_at'], name='item_opens_idx'),
+            models.Index(fields=['closes_at'], name='item_closes_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    # Followers' watchlist syncs need to hear that the item is gone
+    def delete(self, *args, **kwargs):
+        WatchlistRemoval.objects.bulk_create([WatchlistRemoval(user_id=user_id, item_id=self.pk)
+                                              for user_id in self.followers.values_list('pk', flat=True)])
+        return super().delete(*args, **kwargs)
+
+    # Derivatives are only available once the upload has been ingested; until then the original is served
+    def image_variant_url(self, variant):
+        if self.image_hash:
+            return default_storage.url(derivative_name(self.image_hash, variant))
+        return self.image.url
+
+    @property
+    def thumbnail_url(self):
+        return self.image_variant_url('thumbnail')
 
-@receiver(post_save, sender=Item, dispatch_uid="update_image_profile")
-def update_image(sender, instance, **kwargs):
-    if instance.image:
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        fullpath = BASE_DIR + instance.image.url
-        rotate_image(fullpath)
+    @property
+    def medium_url(self):
+        return self.image_variant_url('medium')
+
+    @property
+    def print_path(self):
+        if self.image_hash:
+            return default_storage.path(derivative_name(self.image_hash, 'print'))
+        return self.image.path
+
+    # Recomputes the bid statistics from the Bid table. Used after bids are retracted or purged
+    def refresh_bid_stats(self):
+        top_two = list(self.bid_set.order_by('-price', '-pk').values_list('pk', flat=True)[:2])
+        self.bid_count = self.bid_set.count()
+        self.top_bid_id = top_two[0] if len(top_two) > 0 else None
+        self.runner_up_bid_id = top_two[1] if len(top_two) > 1 else None
+        Item.objects.filter(pk=self.pk).update(bid_count=self.bid_count,
+                                               top_bid=self.top_bid_id,
+                                               runner_up_bid=self.runner_up_bid_id,
+                                               updated_at=timezone.now())
 
 
 class Bid(models.Model):
@@ -139,6 +205,14 @@ class Bid(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     won = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Highest bids of an item, for bid statistics and bid history
+            models.Index(fields=['item', '-price'], name='bid_item_price_idx'),
+            # A bidder's bids, newest first, for My Bids
+            models.Index(fields=['bidder', '-timestamp'], name='bid_bidder_time_idx'),
+        ]
+
     def __str__(self):
         return f'Bid for ${self.price} on item {self.item.name} by user {self.bidder.username}'
 
@@ -148,3 +222,53 @@ class Notification(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE, default=None)
     timestamp = models.DateTimeField(auto_now_add=True)
     text = models.TextField()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', '-timestamp'], name='notification_user_time_idx')]
+
+
+# An item leaving a user's watchlist, by unwatching or deletion, so watchlist syncs can report removals.
+# item_id is not a foreign key because the item may no longer exist
+class WatchlistRemoval(models.Model):
+    user = models.ForeignKey(AuctionUser, on_delete=models.CASCADE)
+    item_id = models.PositiveIntegerField()
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'timestamp'], name='watch_removal_user_time_idx')]
+
+
+# Append-only record of every change to a user's balances. Balances and AuctionUser totals are kept
+# as running sums of these entries, so they can always be checked and rebuilt from here
+class BalanceEntry(models.Model):
+    ACCOUNTS = [('possible', 'possible'), ('guaranteed', 'guaranteed')]
+    REASONS = [
+        ('bid', 'bid'),            # became top bidder
+        ('outbid', 'outbid'),      # lost the top bid to a higher one
+        ('retract', 'retract'),    # top bid removed by the admin
+        ('delete', 'delete'),      # item deleted
+        ('retype', 'retype'),      # item moved between silent and live
+        ('win', 'win'),            # silent item settled
+        ('result', 'result'),      # live result entered or corrected
+        ('reopen', 'reopen'),      # auction published again, wins undone
+        ('adjust', 'adjust'),      # correction posted by reconcile_balances
+    ]
+
+    user = models.ForeignKey(AuctionUser, on_delete=models.CASCADE)
+    auction = models.ForeignKey(Auction, on_delete=models.CASCADE)
+    item = models.ForeignKey(Item, on_delete=models.SET_NULL, null=True, blank=True)
+    account = models.CharField(max_length=10, choices=ACCOUNTS)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    reason = models.CharField(max_length=10, choices=REASONS)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+
+# A user's balances within one auction, materialized from the ledger
+class Balance(models.Model):
+    user = models.ForeignKey(AuctionUser, on_delete=models.CASCADE, related_name='balances')
+    auction = models.ForeignKey(Auction, on_delete=models.CASCADE)
+    possible = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    guaranteed = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'auction'], name='balance_user_auction_uniq')]
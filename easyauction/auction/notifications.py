@@ -0,0 +1,130 @@
+import threading
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Bid, Item, Notification
+
+
+# user_id is set for a notification meant for one user. Otherwise the notification goes to everyone following or
+# bidding on the item, except exclude_id
+NotificationEvent = namedtuple('NotificationEvent', ['item_id', 'text', 'user_id', 'exclude_id'])
+
+_outbox = threading.local()
+
+
+def _pending():
+    if not hasattr(_outbox, 'stack'):
+        _outbox.stack = []
+    return _outbox.stack
+
+
+@contextmanager
+def collect_notifications():
+    """
+    Collects the notifications that become due inside the block and writes them all when the outermost block exits.
+    A notification is due once the transaction that raised it commits, and is dropped if that transaction rolls back.
+    Nested blocks hand their events to the enclosing one; a block that raises discards its events
+    :return: the block's due events, which the caller may clear to drop them
+    """
+    stack = _pending()
+    stack.append([])
+    try:
+        yield stack[-1]
+    except BaseException:
+        stack.pop()
+        raise
+    events = stack.pop()
+    if stack:
+        stack[-1].extend(events)
+    else:
+        write_notifications(events)
+
+
+def _deliver(event):
+    stack = _pending()
+    if stack:
+        stack[-1].append(event)
+    else:
+        write_notifications([event])
+
+
+def _raise(event):
+    # Right away outside a transaction
+    transaction.on_commit(lambda: _deliver(event))
+
+
+def notify_user(user_id, item_id, text):
+    _raise(NotificationEvent(item_id, text, user_id, None))
+
+
+def notify_item(item_id, text, exclude=None):
+    _raise(NotificationEvent(item_id, text, None, exclude))
+
+
+def outbid(user_id, item):
+    notify_user(user_id, item.pk, f"Outbid! You have been outbid on the {item}")
+
+
+def item_opened(item_id, name):
+    notify_item(item_id, f"Bidding is now open on the {name}")
+
+
+def item_closed(item_id, name):
+    notify_item(item_id, f"Bidding has closed on the {name}")
+
+
+def item_won(item_id, name, winner_id):
+    notify_user(winner_id, item_id, f"Congratulations! You won the {name}")
+    notify_item(item_id, f"The {name} has been sold", exclude=winner_id)
+
+
+def item_audience(item_ids):
+    """
+    Followers and bidders of each item, read with one query
+    :param item_ids: items to expand
+    :return: dict of item id to set of user ids
+    """
+    followers = Item.followers.through.objects.filter(item_id__in=item_ids).values_list('item_id', 'auctionuser_id')
+    bidders = Bid.objects.filter(item_id__in=item_ids).values_list('item_id', 'bidder_id')
+    audience = defaultdict(set)
+    for item_id, user_id in followers.union(bidders):
+        audience[item_id].add(user_id)
+    return audience
+
+
+def write_notifications(events):
+    """
+    Expands notification events to their recipients and inserts them in batches
+    :param events: list of NotificationEvent
+    """
+    notifications = [Notification(user_id=e.user_id, item_id=e.item_id, text=e.text) for e in events if e.user_id]
+
+    fan_out = [e for e in events if not e.user_id]
+    if fan_out:
+        audience = item_audience({e.item_id for e in fan_out})
+        for e in fan_out:
+            notifications.extend(Notification(user_id=user_id, item_id=e.item_id, text=e.text)
+                                 for user_id in audience[e.item_id] if user_id != e.exclude_id)
+
+    Notification.objects.bulk_create(notifications, batch_size=settings.AUCTION_BULK_BATCH_SIZE)
+
+
+class NotificationOutboxMiddleware:
+    """
+    Writes the notifications raised while handling a request once the view has returned,
+    so no notification insert runs inside a bid transaction. A request that fails sends none,
+    even if part of its work committed
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect_notifications() as events:
+            response = self.get_response(request)
+            # View exceptions arrive here as error responses, not as exceptions
+            if response.status_code >= 500:
+                events.clear()
+        return response
@@ -0,0 +1,203 @@
+import glob
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from reportlab.pdfgen import canvas
+from reportlab.graphics.barcode.qr import QrCodeWidget
+from reportlab.lib.pagesizes import letter
+
+from .timing import timed
+
+
+# 612.0 x 792.0 (letter size)
+X_RES = 612
+Y_RES = 792
+IMAGE_WIDTH = 170
+IMAGE_HEIGHT = 170
+QR_WIDTH = 130
+QR_HEIGHT = 130
+TEXT_SIZE = 20
+
+# Encoding a QR code is the slow part of a label, so finished drawings are kept per URL
+QR_CACHE_SIZE = 4096
+# Below this many uncached codes, starting worker processes costs more than it saves
+MIN_PARALLEL_CODES = 32
+
+_qr_cache = OrderedDict()
+_qr_cache_lock = threading.Lock()
+_pool = None
+
+
+def build_qr_drawing(url):
+    """
+    Encodes a URL as a QR code, returned as the dark module rectangles scaled to the label size.
+    Module-level so it can run in a worker process; plain tuples pickle back to the caller cheaply
+    """
+    group = QrCodeWidget(url).draw()
+    x0, y0, x1, y1 = group.getBounds()
+    sx = QR_WIDTH / (x1 - x0)
+    sy = QR_HEIGHT / (y1 - y0)
+    return tuple(((r.x - x0) * sx, (r.y - y0) * sy, r.width * sx, r.height * sy)
+                 for r in group.contents if r.fillColor is not None)
+
+
+def draw_qr(p, rects, x, y):
+    # One filled path per code is much cheaper to emit than one shape per module
+    path = p.beginPath()
+    for rx, ry, rw, rh in rects:
+        path.rect(x + rx, y + ry, rw, rh)
+    p.drawPath(path, stroke=0, fill=1)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.AUCTION_QR_WORKERS)
+    return _pool
+
+
+def qr_drawings(urls):
+    """
+    Returns a QR drawing for each URL, encoding the ones not cached yet across the worker processes
+    :param urls: list of URLs
+    :return: list of drawings in the same order
+    """
+    with _qr_cache_lock:
+        missing = [url for url in OrderedDict.fromkeys(urls) if url not in _qr_cache]
+    # Encoded outside the lock, so other sheets can use the cache meanwhile
+    drawings = []
+    if settings.AUCTION_QR_WORKERS and len(missing) >= MIN_PARALLEL_CODES:
+        chunksize = max(1, len(missing) // (settings.AUCTION_QR_WORKERS * 4))
+        drawings = _get_pool().map(build_qr_drawing, missing, chunksize=chunksize)
+    elif missing:
+        drawings = map(build_qr_drawing, missing)
+    drawn = dict(zip(missing, drawings))
+
+    result = []
+    with _qr_cache_lock:
+        _qr_cache.update(drawn)
+        for url in urls:
+            if url not in _qr_cache:
+                # Evicted by another sheet since it was looked up
+                _qr_cache[url] = build_qr_drawing(url)
+            _qr_cache.move_to_end(url)
+            result.append(_qr_cache[url])
+        while len(_qr_cache) > QR_CACHE_SIZE:
+            _qr_cache.popitem(last=False)
+    return result
+
+
+def layout_name(include_images):
+    return 'images' if include_images else 'plain'
+
+
+def cache_path(auction, labels, include_images):
+    """
+    Builds the on-disk cache location of a label sheet.
+    The key covers everything drawn on the sheet, so any item change produces a new key. The layout is in the file
+    name too, so sheets with and without images are cached side by side
+    :param auction: auction the sheet is for
+    :param labels: list of (url, item name, image path or None) tuples in print order
+    :param include_images: whether item images are printed
+    """
+    key = hashlib.sha256(repr((include_images, X_RES, Y_RES, labels)).encode()).hexdigest()
+    return os.path.join(settings.AUCTION_QR_CACHE_DIR,
+                        f'auction_{auction.pk}_{layout_name(include_images)}_{key}.pdf')
+
+
+def label_sheet(auction, labels, include_images):
+    """
+    Returns the PDF label sheet for an auction, rendering it only if no cached copy matches.
+    The file is returned open, so a concurrent request evicting it cannot remove it before it is served
+    :param auction: auction the sheet is for
+    :param labels: list of (url, item name, image path or None) tuples in print order
+    :param include_images: whether item images are printed
+    :return: the PDF file, opened for binary reading
+    """
+    path = cache_path(auction, labels, include_images)
+    try:
+        return open(path, 'rb')
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(settings.AUCTION_QR_CACHE_DIR, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    render_label_sheet(tmp_path, labels, include_images)
+    os.replace(tmp_path, path)
+    sheet = open(path, 'rb')
+
+    # Sheets of this layout for the auction's previous item set are stale now
+    pattern = f'auction_{auction.pk}_{layout_name(include_images)}_*.pdf'
+    for old_path in glob.glob(os.path.join(settings.AUCTION_QR_CACHE_DIR, pattern)):
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                # Already evicted by another request
+                pass
+    return sheet
+
+
+@timed('pdf')
+def render_label_sheet(path, labels, include_images):
+    p = canvas.Canvas(path, pagesize=letter)
+
+    num_rows = 4
+    num_cols = 2
+
+    if include_images:
+        num_rows = 2
+        num_cols = 2
+
+    block_width = X_RES / num_cols
+    block_height = Y_RES / num_rows
+
+    space_between = (block_height - QR_HEIGHT - TEXT_SIZE) / 3
+
+    if include_images:
+        space_between = (block_height - IMAGE_HEIGHT - QR_HEIGHT - TEXT_SIZE) / 4
+
+    drawings = qr_drawings([url for url, name, image_path in labels])
+
+    # Draw divider lines on first page
+    for r in range(1, num_rows):
+        for c in range(1, num_cols):
+            p.line(c * block_width, 0, c * block_width, Y_RES)
+            p.line(0, r * block_height, X_RES, r * block_height)
+
+    p.setFont("Times-Roman", TEXT_SIZE)
+
+    for index, ((url, name, image_path), rects) in enumerate(zip(labels, drawings)):
+        if index != 0 and index % (num_rows * num_cols) == 0:
+            # Change to new page, draw divider lines, and reset font
+            p.showPage()
+
+            for r in range(1, num_rows):
+                for c in range(1, num_cols):
+                    p.line(c * block_width, 0, c * block_width, Y_RES)
+                    p.line(0, r * block_height, X_RES, r * block_height)
+
+            p.setFont("Times-Roman", TEXT_SIZE)
+
+        # Bottom left corner of block
+        x_offset = (index % num_cols) * block_width
+        y_offset = (num_rows - 1 - (index // num_cols) % num_rows) * block_height
+
+        # Draw QR code
+        draw_qr(p, rects, x_offset + block_width / 2 - QR_WIDTH / 2, y_offset + space_between)
+
+        # Draw item name
+        p.drawCentredString(x_offset + block_width / 2, y_offset + block_height - TEXT_SIZE - space_between, name)
+
+        if include_images:
+            # Draw item image
+            p.drawImage(image_path,
+                        x_offset + X_RES / 4 - IMAGE_WIDTH / 2, y_offset + QR_HEIGHT + 2 * space_between,
+                        IMAGE_WIDTH, IMAGE_HEIGHT)
+
+    p.save()
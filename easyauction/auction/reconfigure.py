@@ -0,0 +1,154 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .caching import bump_listing_version
+from .events import auction_event, publish_on_commit
+from .ledger import GUARANTEED, POSSIBLE, post
+from .models import BalanceEntry, Bid, Item, WatchlistRemoval
+
+
+def _select(items, reason):
+    """
+    Locks the items an operation applies to, then reads them once along with what is held against them.
+    Run inside the operation's transaction
+    :param items: Item queryset
+    :param reason: ledger reason for releasing the holds
+    :return: (item pks, auction pks, ledger entries releasing every top bid and win held against the items)
+    """
+    # Written before anything is read, so the write lock is taken first, as when bidding.
+    # No bid can then land between reading what is held and releasing it
+    items.update(updated_at=timezone.now())
+    ids, auction_ids, entries = [], set(), []
+    for item_id, auction_id, bidder_id, bid_price, is_sold, winner_id, price in items.values_list(
+            'pk', 'auction_id', 'top_bid__bidder_id', 'top_bid__price', 'is_sold', 'winner_id', 'current_price'):
+        ids.append(item_id)
+        auction_ids.add(auction_id)
+        if bidder_id:
+            entries.append(BalanceEntry(user_id=bidder_id, auction_id=auction_id, item_id=item_id,
+                                        account=POSSIBLE, amount=-bid_price, reason=reason))
+        if is_sold and winner_id:
+            entries.append(BalanceEntry(user_id=winner_id, auction_id=auction_id, item_id=item_id,
+                                        account=GUARANTEED, amount=-price, reason=reason))
+    return ids, auction_ids, entries
+
+
+def _purge_bids(ids):
+    """
+    Deletes every bid on the items in one statement. Items must no longer point at the bids: with those references
+    cleared there is nothing for Django's collector to update, so it is skipped
+    """
+    bids = Bid.objects.filter(item_id__in=ids)
+    bids._raw_delete(bids.db)
+
+
+def _changed(auction_ids, count):
+    for auction_id in auction_ids:
+        bump_listing_version(auction_id)
+        # Open auction pages reload to show the new listing
+        publish_on_commit(auction_id, auction_event(reconfigured=count))
+
+
+def retype_items(items, auction_type):
+    """
+    Moves items between the silent and live auctions. Their bids are dropped, what the bids and any win held against
+    balances is released, and the items start over closed and unsold at their starting price
+    :param items: Item queryset; items already of that type are left alone
+    :param auction_type: 'silent' or 'live'
+    :return: number of items changed
+    """
+    with transaction.atomic():
+        ids, auction_ids, entries = _select(items.exclude(auction_type=auction_type), 'retype')
+        if not ids:
+            return 0
+        post(entries)
+        Item.objects.filter(pk__in=ids).update(auction_type=auction_type,
+                                               winner=None,
+                                               is_sold=False,
+                                               is_open=False,
+                                               current_price=F('starting_price'),
+                                               min_bid=F('starting_price'),
+                                               bid_count=0,
+                                               top_bid=None,
+                                               runner_up_bid=None,
+                                               updated_at=timezone.now())
+        _purge_bids(ids)
+        _changed(auction_ids, len(ids))
+    return len(ids)
+
+
+def reprice_items(items, starting_price=None, bid_increment=None):
+    """
+    Sets the starting price and/or bid increment of unsold items. Items without bids open at the new starting price;
+    items with bids keep their price and need the new increment on top of it
+    :param items: Item queryset; sold items are left alone
+    :return: number of items changed
+    """
+    fields = {}
+    if starting_price is not None:
+        fields['starting_price'] = starting_price
+    if bid_increment is not None:
+        fields['bid_increment'] = bid_increment
+    if not fields:
+        return 0
+
+    with transaction.atomic():
+        unsold = items.filter(is_sold=False)
+        # Written before anything is read, so the write lock is taken first, as when bidding
+        if not unsold.update(updated_at=timezone.now(), **fields):
+            return 0
+        rows = list(unsold.values_list('pk', 'auction_id'))
+        ids = [item_id for item_id, _ in rows]
+        changed = Item.objects.filter(pk__in=ids)
+        changed.filter(bid_count=0).update(current_price=F('starting_price'), min_bid=F('starting_price'))
+        changed.filter(bid_count__gt=0).update(min_bid=F('current_price') + F('bid_increment'))
+        _changed({auction_id for _, auction_id in rows}, len(ids))
+    return len(ids)
+
+
+def schedule_items(items, closes_at, opens_at=None, group_size=50, interval=None, soft_close=None):
+    """
+    Sets when unsold items open and close. Items close group_size at a time, interval apart in item order, so an
+    evening's closings are staggered rather than all at once
+    :param items: Item queryset; sold items are left alone
+    :param closes_at: when the first group closes
+    :param opens_at: when the items open, or None to leave opening to the admin
+    :param interval: timedelta between groups, or None to close every item at closes_at
+    :param soft_close: timedelta a late bid extends the close by, or None for a hard close
+    :return: number of items scheduled
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        unsold = items.filter(is_sold=False)
+        # Written before anything is read, so the write lock is taken first, as when bidding
+        unsold.update(updated_at=now)
+        rows = list(unsold.order_by('pk').values_list('pk', 'auction_id'))
+        for start in range(0, len(rows), group_size):
+            group_closes_at = closes_at + interval * (start // group_size) if interval else closes_at
+            Item.objects.filter(pk__in=[item_id for item_id, _ in rows[start:start + group_size]]).update(
+                opens_at=opens_at, closes_at=group_closes_at, soft_close=soft_close, updated_at=now)
+        _changed({auction_id for _, auction_id in rows}, len(rows))
+    return len(rows)
+
+
+def delete_items(items):
+    """
+    Deletes items with their bids, releasing what the bids and any win held against balances
+    :param items: Item queryset
+    :return: number of items deleted
+    """
+    with transaction.atomic():
+        ids, auction_ids, entries = _select(items, 'delete')
+        if not ids:
+            return 0
+        post(entries)
+        # Followers' watchlist syncs need to hear that the items are gone
+        WatchlistRemoval.objects.bulk_create(
+            [WatchlistRemoval(user_id=user_id, item_id=item_id)
+             for user_id, item_id in Item.followers.through.objects.filter(item_id__in=ids)
+             .values_list('auctionuser_id', 'item_id')])
+        Item.objects.filter(pk__in=ids).update(top_bid=None, runner_up_bid=None)
+        _purge_bids(ids)
+        Item.objects.filter(pk__in=ids).delete()
+        _changed(auction_ids, len(ids))
+    return len(ids)
@@ -0,0 +1,52 @@
+import csv
+
+from django.utils import timezone
+
+
+REPORT_HEADER = ['Item', 'Buyer Name', 'Buyer Username', 'Price']
+CHUNK_SIZE = 500
+
+
+class Echo:
+    """
+    File-like object that hands each written line straight back, so csv.writer can feed a streaming response
+    """
+    def write(self, value):
+        return value
+
+
+def report_rows(auction):
+    """
+    Yields the rows of an auction report, silent items first and then live items.
+    Items are read with their winner joined in, a chunk at a time, so memory use does not grow with the auction
+    :param auction: auction to report on
+    :return: generator of row lists
+    """
+    yield [f'{auction.name} report']
+    yield ['Report generated on:', timezone.localtime().strftime('%m/%d/%Y %H:%M:%S')]
+    yield []
+
+    for title, auction_type in (('Silent Items', 'silent'), ('Live Items', 'live')):
+        yield [title]
+        yield REPORT_HEADER
+        items = (auction.item_set.filter(auction_type=auction_type)
+                 .select_related('winner')
+                 .only('auction', 'name', 'current_price',
+                       'winner', 'winner__first_name', 'winner__last_name', 'winner__username')
+                 .order_by('pk'))
+        for item in items.iterator(chunk_size=CHUNK_SIZE):
+            if item.winner:
+                yield [item.name, f'{item.winner.first_name} {item.winner.last_name}', item.winner.username,
+                       item.current_price]
+            else:
+                yield [item.name, 'N/A', 'N/A', 0]
+        yield []
+
+
+def stream_report(auction):
+    writer = csv.writer(Echo())
+    return (writer.writerow(row) for row in report_rows(auction))
+
+
+def report_filename(auction):
+    return f'auction_{auction.pk}_report.csv'
@@ -0,0 +1,209 @@
+import heapq
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .caching import bump_listing_version
+from .events import item_event, publish_on_commit
+from .models import Item
+from .settlement import settle_items
+
+
+OPEN = 'open'
+CLOSE = 'close'
+
+logger = logging.getLogger('auction.scheduler')
+
+# Changes are read from a little before the last sync, so a write committed just after it started is not missed
+SYNC_OVERLAP = timedelta(seconds=2)
+
+
+def pending(opens_at, closes_at, is_open, is_sold):
+    """
+    :return: list of (deadline, action) an item is still waiting on
+    """
+    if is_sold:
+        return []
+    deadlines = []
+    if opens_at is not None and not is_open:
+        deadlines.append((opens_at, OPEN))
+    if closes_at is not None and (is_open or opens_at is not None):
+        deadlines.append((closes_at, CLOSE))
+    return deadlines
+
+
+class DeadlineScheduler:
+    """
+    Opens and closes items at their deadlines. Pending deadlines are kept in a heap, so only items that are due are
+    touched. On start every pending deadline is loaded, deadlines missed while the scheduler was down included; after
+    that only items changed since the last sync are read, through the updated_at index.
+    An item whose deadline changes is pushed again and its old heap entry skipped when popped. Each open and close is
+    a conditional UPDATE, so an entry that has gone stale matches nothing
+    """
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.AUCTION_CLOSE_BATCH_SIZE
+        self.heap = []
+        # (action, item pk) -> deadline of its live heap entry
+        self.scheduled = {}
+        self.cursor = None
+
+    def push(self, item_id, deadlines):
+        for deadline, action in deadlines:
+            if self.scheduled.get((action, item_id)) != deadline:
+                self.scheduled[action, item_id] = deadline
+                heapq.heappush(self.heap, (deadline, action, item_id))
+
+    def load(self):
+        """
+        Reads every pending deadline. Run once at start
+        """
+        self.cursor = timezone.now()
+        items = (Item.objects.filter(Q(opens_at__isnull=False) | Q(closes_at__isnull=False, is_open=True),
+                                     is_sold=False)
+                 .values_list('pk', 'opens_at', 'closes_at', 'is_open', 'is_sold'))
+        for item_id, *state in items.iterator():
+            self.push(item_id, pending(*state))
+
+    def sync(self):
+        """
+        Reads the deadlines of items changed since the last sync: new items, edits, soft-close extensions
+        """
+        since, self.cursor = self.cursor - SYNC_OVERLAP, timezone.now()
+        items = (Item.objects.filter(updated_at__gte=since)
+                 .values_list('pk', 'opens_at', 'closes_at', 'is_open', 'is_sold'))
+        for item_id, *state in items.iterator():
+            self.push(item_id, pending(*state))
+
+    def next_deadline(self):
+        # Entries superseded by a later push are dropped as they reach the top
+        while self.heap:
+            deadline, action, item_id = self.heap[0]
+            if self.scheduled.get((action, item_id)) == deadline:
+                return deadline
+            heapq.heappop(self.heap)
+        return None
+
+    def pop_due(self, now):
+        """
+        :return: ({OPEN: [item pks], CLOSE: [item pks]}) of deadlines at or before now
+        """
+        due = {OPEN: [], CLOSE: []}
+        while self.next_deadline() is not None and self.heap[0][0] <= now:
+            _, action, item_id = heapq.heappop(self.heap)
+            del self.scheduled[action, item_id]
+            due[action].append(item_id)
+        return due
+
+    def run_due(self, now=None):
+        """
+        Opens and closes what is due, in batches of batch_size items per transaction
+        :return: (items opened, items closed, items settled)
+        """
+        now = now or timezone.now()
+        due = self.pop_due(now)
+        opened = closed = settled = 0
+        for start in range(0, len(due[OPEN]), self.batch_size):
+            opened += open_items(due[OPEN][start:start + self.batch_size], now)
+        for start in range(0, len(due[CLOSE]), self.batch_size):
+            batch_closed, batch_settled = close_items(due[CLOSE][start:start + self.batch_size], now)
+            closed += batch_closed
+            settled += batch_settled
+        return opened, closed, settled
+
+    def run(self, stop=None, log=None):
+        """
+        Loads the pending deadlines, then acts on them as they fall due until stop() returns true.
+        Sleeps until the next deadline, waking at least every AUCTION_SCHEDULER_SYNC_SECONDS to pick up changes
+        :param log: optional callable(message)
+        """
+        self.load()
+        while not (stop and stop()):
+            opened, closed, settled = self.run_due()
+            if log and (opened or closed):
+                log(f'Opened {opened} item(s), closed {closed}, settled {settled}')
+
+            wait = settings.AUCTION_SCHEDULER_SYNC_SECONDS
+            deadline = self.next_deadline()
+            if deadline is not None:
+                wait = min(wait, max(0, (deadline - timezone.now()).total_seconds()))
+            time.sleep(wait)
+            self.sync()
+
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def _run_in_thread():
+    while True:
+        try:
+            DeadlineScheduler().run()
+        except Exception:
+            logger.exception('Deadline scheduler failed, restarting')
+            # Start again on a fresh connection, reloading every pending deadline
+            connection.close()
+            time.sleep(settings.AUCTION_SCHEDULER_SYNC_SECONDS)
+
+
+def start_scheduler():
+    """
+    Runs a DeadlineScheduler on a daemon thread in this process, once. Called from the WSGI entry point when
+    AUCTION_SCHEDULER_THREAD is set.
+    Events only reach subscribers in the process that publishes them, so every web process runs its own scheduler.
+    Each one announces the deadlines it sees pass to its own subscribers, whichever process made the change;
+    the conditional UPDATEs mean only one of them actually opens, closes or settles an item
+    """
+    global _thread
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run_in_thread, name='deadline-scheduler', daemon=True)
+            _thread.start()
+
+
+def _announce(rows, **fields):
+    for auction_id in {auction_id for _, auction_id in rows}:
+        bump_listing_version(auction_id)
+    for item_id, auction_id in rows:
+        publish_on_commit(auction_id, item_event(item_id, **fields))
+
+
+def open_items(ids, now):
+    """
+    Opens items whose opens_at has passed, unless their close has passed too. Either way opens_at is cleared, so an
+    item the admin closes again by hand is not reopened.
+    Items another process's scheduler has already opened are announced here too, without being counted
+    :return: number of items opened
+    """
+    with transaction.atomic():
+        due = Item.objects.filter(pk__in=ids, opens_at__lte=now)
+        # Written before anything is read, so the write lock is taken first, as when bidding
+        opened = (due.filter(Q(closes_at__isnull=True) | Q(closes_at__gt=now), is_open=False, is_sold=False)
+                  .update(is_open=True, opens_at=None, updated_at=now))
+        due.update(opens_at=None)
+        _announce(list(Item.objects.filter(pk__in=ids, is_open=True).values_list('pk', 'auction_id')), is_open=True)
+    return opened
+
+
+def close_items(ids, now):
+    """
+    Closes open items whose closes_at has passed and awards silent items to their top bidders.
+    Items another process's scheduler has already closed are announced here too, without being counted
+    :return: (items closed, items settled)
+    """
+    with transaction.atomic():
+        closed = Item.objects.filter(pk__in=ids, is_open=True, closes_at__lte=now).update(is_open=False,
+                                                                                         updated_at=now)
+        settled = 0
+        if closed:
+            # The statement above stamped exactly the items it closed
+            settled = settle_items(Item.objects.filter(pk__in=ids, is_open=False, updated_at=now,
+                                                       auction_type='silent'))
+        rows = list(Item.objects.filter(pk__in=ids, is_open=False, closes_at__lte=now).values_list('pk', 'auction_id'))
+        _announce(rows, is_open=False)
+    return closed, settled
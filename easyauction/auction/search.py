@@ -0,0 +1,61 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Item
+
+
+# FTS5 index over item names and descriptions, kept in sync by triggers (see migration 0011_item_search)
+FTS_TABLE = 'auction_item_fts'
+
+# bm25 weight of a match in the name relative to one in the description
+NAME_WEIGHT = 10.0
+
+SEARCH_LIMIT = 20
+
+# Words of description shown around the best match
+SNIPPET_WORDS = 12
+
+
+def match_query(text):
+    """
+    Turns what a user typed into an FTS5 query. Every word must appear, each as a prefix so results narrow while
+    typing. Only words are kept and each is quoted, so FTS5 syntax in the input is never interpreted
+    :param text: search box contents
+    :return: FTS5 MATCH expression, or '' if there are no words
+    """
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+
+def search_items(text, auctions, limit=SEARCH_LIMIT):
+    """
+    Finds items by name and description, best matches first, from the index in one query.
+    Items carry `snippet`, a few words of description around the match. The description itself is not loaded
+    :param text: search box contents
+    :param auctions: Auction queryset to search within, e.g. one auction or a user's auctions
+    :param limit: most items returned
+    :return: list of items
+    """
+    query = match_query(text)
+    if not query:
+        return []
+
+    # Without FTS5 fall back to a scan, best matches not first
+    if connection.vendor != 'sqlite':
+        words = Q()
+        for word in re.findall(r'\w+', text):
+            words &= Q(name__icontains=word) | Q(description__icontains=word)
+        items = list(Item.objects.filter(words, auction__in=auctions).defer('description').order_by('pk')[:limit])
+        for item in items:
+            item.snippet = ''
+        return items
+
+    auction_sql, auction_params = auctions.values('pk').query.sql_with_params()
+    return list(Item.objects.raw(
+        f'SELECT i.id, i.name, i.auction_id, i.image, i.image_hash, i.auction_type, i.current_price, '
+        f'i.is_open, i.is_sold, snippet({FTS_TABLE}, 1, \'\', \'\', \'…\', {SNIPPET_WORDS}) AS snippet '
+        f'FROM {FTS_TABLE} JOIN auction_item i ON i.id = {FTS_TABLE}.rowid '
+        f'WHERE {FTS_TABLE} MATCH %s AND i.auction_id IN ({auction_sql}) '
+        f'ORDER BY bm25({FTS_TABLE}, {NAME_WEIGHT}, 1.0) LIMIT %s',
+        [query, *auction_params, limit]))
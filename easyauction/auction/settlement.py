@@ -0,0 +1,44 @@
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .ledger import GUARANTEED, post
+from .models import BalanceEntry, Bid
+from .notifications import collect_notifications, item_won
+
+
+def settle_items(items):
+    """
+    Awards every unsold item in the queryset to its top bidder in one transaction.
+    The winning bids come from one query over Item.top_bid. Items and bids are then updated with one statement each,
+    balances through the ledger and notifications after commit, so the query count does not grow with the number of items
+    :param items: Item queryset to settle, items without bids are left untouched
+    :return: number of items settled
+    """
+    with collect_notifications(), transaction.atomic():
+        unsold = items.filter(is_sold=False, top_bid__isnull=False)
+        winning = list(unsold.values_list('pk', 'auction_id', 'name', 'top_bid__bidder_id', 'top_bid__price'))
+        if not winning:
+            return 0
+
+        entries = []
+        for item_id, auction_id, name, bidder_id, price in winning:
+            entries.append(BalanceEntry(user_id=bidder_id, auction_id=auction_id, item_id=item_id,
+                                        account=GUARANTEED, amount=price, reason='win'))
+            # Tell the winner, and everyone else following or bidding on the item
+            item_won(item_id, name, bidder_id)
+
+        # Mark bids as winning bids. The same items are selected again by subquery, so no id lists are sent
+        Bid.objects.filter(pk__in=unsold.values('top_bid')).update(won=True)
+
+        # Assign winners
+        unsold.update(is_sold=True, updated_at=timezone.now(), winner=Subquery(Bid.objects.filter(pk=OuterRef('top_bid')).values('bidder')[:1]))
+
+        # Update winners balances
+        post(entries)
+
+    return len(winning)
+
+
+def settle_auction(auction):
+    return settle_items(auction.item_set.filter(auction_type='silent'))
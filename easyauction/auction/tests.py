@@ -1,9 +1,50 @@
-from django.test import TestCase
-from .models import AuctionUser, Bid
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import connection, transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import cache
+from .caching import bump_listing_version
+from .models import Auction, AuctionUser, Balance, BalanceEntry, Bid, Item, Notification, WatchlistRemoval
 from django.urls import reverse
+from django.apps import apps
 from .forms import AddItemForm
+from .bidding import REJECTED_CLOSED, place_bid
+from .bid_queue import BidWriter
+from .ledger import GUARANTEED, entry, post
+from .notifications import collect_notifications, item_closed, outbid
+from .settlement import settle_auction
+from .scheduler import DeadlineScheduler
+from .qr_codes import label_sheet
+from .events import EventBroker, broker, item_event
+from . import timing
+from .timing import RequestTimer, timed
+from decimal import Decimal
+from PIL import Image
+import io
+import os
+import shutil
+import tempfile
 import time
 import json
+from datetime import timedelta
+from django.utils import timezone
+import zipfile
+from unittest import mock
+from contextlib import contextmanager
+from importlib import import_module
+from concurrent.futures import Future
+
+
+# Every test uses an in-memory cache, so nothing is written to the project's cache directory
+test_caches = override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+
+
+def setUpModule():
+    test_caches.enable()
+
+
+def tearDownModule():
+    test_caches.disable()
 
 
 class AuthTests(TestCase):
@@ -110,6 +151,21 @@ class AuthTests(TestCase):
         self.assertEqual(response.url, reverse('auction:change_password_done'))
 
 
+@contextmanager
+def commit_hooks():
+    """
+    TestCase never commits, so on_commit callbacks registered inside the block are run as it exits, as a commit
+    would run them. Notifications they make due are written together, as in a request
+    """
+    with collect_notifications():
+        start = len(connection.run_on_commit)
+        yield
+        callbacks = connection.run_on_commit[start:]
+        del connection.run_on_commit[start:]
+        for _, callback in callbacks:
+            callback()
+
+
 def create_user(username, password, email=None):
     user = AuctionUser.objects.create_user(username=username, password=password, email=email)
     return user
@@ -603,3 +659,1426 @@ class BidTests(TestCase):
         response = self.client.get(reverse('auction:my_bids'), data=data)
         queryset = response.context['object_list']
         self.assertTrue(len(queryset) == 2 and queryset[0].item.winner.pk == bidder.pk and queryset[0].price > queryset[1].price)
+
+    def test_place_bid_moves_balances_to_new_high_bidder(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        item = auction.add_item(name='test item', item_desc='desc', starting_price=5)
+        item.is_open = True
+        item.save()
+
+        bidder1 = create_user('bidder1', 'test12345')
+        bidder2 = create_user('bidder2', 'test12345')
+
+        self.assertTrue(place_bid(item, bidder1, Decimal('5')).accepted)
+        with commit_hooks():
+            self.assertTrue(place_bid(item, bidder2, Decimal('7')).accepted)
+
+        item.refresh_from_db()
+        bidder1.refresh_from_db()
+        bidder2.refresh_from_db()
+        self.assertEqual(item.current_price, Decimal('7'))
+        self.assertEqual(item.min_bid, Decimal('8'))
+        self.assertEqual(bidder1.possible_balance, Decimal('0'))
+        self.assertEqual(bidder2.possible_balance, Decimal('7'))
+        self.assertTrue(bidder1.notification_set.filter(text__startswith='Outbid!').exists())
+
+    def test_place_bid_rejects_stale_minimum(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        item = auction.add_item(name='test item', item_desc='desc', starting_price=5)
+        item.is_open = True
+        item.save()
+
+        bidder1 = create_user('bidder1', 'test12345')
+        bidder2 = create_user('bidder2', 'test12345')
+
+        # Both bidders saw the same minimum, only the first bid to reach the database may win
+        stale_item = Item.objects.get(pk=item.pk)
+        self.assertTrue(place_bid(item, bidder1, Decimal('5')).accepted)
+        result = place_bid(stale_item, bidder2, Decimal('5'))
+
+        self.assertFalse(result.accepted)
+        self.assertEqual(result.reason, 'outbid')
+        self.assertEqual(item.bid_set.count(), 1)
+
+    def test_submit_bid_rejects_unusable_amounts(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        item = auction.add_item(name='test item', item_desc='desc', starting_price=5)
+        Item.objects.filter(pk=item.pk).update(is_open=True)
+        create_user('bidder', 'test12345')
+        self.client.login(username='bidder', password='test12345')
+
+        # Not numbers, infinite, too large for the price columns, or finer than a cent
+        for amount in ['NaN', 'sNaN', 'Infinity', '-Infinity', '1e30', '100000000', '5.001', 'five']:
+            response = self.client.post(reverse('auction:submit_bid', args=[item.pk]), {'bid': amount})
+            self.assertTemplateUsed(response, 'auction/bid_fail.html', amount)
+        self.assertEqual(place_bid(item, admin, Decimal('NaN')).reason, 'invalid')
+        self.assertFalse(item.bid_set.exists())
+
+    def test_place_bid_query_count_is_fixed(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        item = auction.add_item(name='test item', item_desc='desc', starting_price=1)
+        item.is_open = True
+        item.save()
+        bidders = [create_user(f'bidder{x}', 'test12345') for x in range(5)]
+
+        for i, bidder in enumerate(bidders):
+            place_bid(item, bidder, Decimal(i + 1))
+
+        # update item, read previous top bid, insert bid, link top bid, ledger entries, user totals,
+        # auction balances, listing version, notification, plus savepoint
+        with self.assertNumQueries(11), commit_hooks():
+            place_bid(item, bidders[0], Decimal(10))
+
+    def test_remove_bid_promotes_runner_up(self):
+        admin_username = 'admin'
+        admin_password = 'test12345'
+        admin = create_user(admin_username, admin_password)
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        item = auction.add_item(name='test item', item_desc='desc', starting_price=5)
+        item.is_open = True
+        item.save()
+
+        bidder1 = create_user('bidder1', 'test12345')
+        bidder2 = create_user('bidder2', 'test12345')
+        first_bid = place_bid(item, bidder1, Decimal('5')).bid
+        second_bid = place_bid(item, bidder2, Decimal('8')).bid
+
+        item.refresh_from_db()
+        self.assertEqual((item.bid_count, item.top_bid, item.runner_up_bid), (2, second_bid, first_bid))
+
+        self.client.login(username=admin_username, password=admin_password)
+        self.client.get(reverse('auction:remove_bid', args=[item.id, second_bid.id]))
+
+        item.refresh_from_db()
+        self.assertEqual((item.bid_count, item.top_bid, item.runner_up_bid), (1, first_bid, None))
+        self.assertEqual(item.current_price, Decimal('5'))
+
+    def test_edits_keep_concurrent_bids(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        item = admin.auction_set.first().add_item(name='test item', item_desc='desc', starting_price=5)
+        Item.objects.filter(pk=item.pk).update(is_open=True)
+        bidders = [create_user(f'bidder{x}', 'test12345') for x in range(3)]
+        place_bid(Item.objects.get(pk=item.pk), bidders[0], Decimal('5'))
+        retracted = place_bid(Item.objects.get(pk=item.pk), bidders[1], Decimal('8')).bid
+        self.client.login(username='admin', password='test12345')
+        get = Item.objects.get
+
+        # A bid lands after the view has read the item
+        def read_then_outbid(*args, **kwargs):
+            stale = get(*args, **kwargs)
+            place_bid(get(pk=item.pk), bidders[2], stale.min_bid + 1)
+            return stale
+
+        for url, data in ((reverse('auction:edit_item', args=[item.pk]), {'name': 'renamed'}),
+                          (reverse('auction:remove_bid', args=[item.pk, retracted.pk]), None)):
+            with mock.patch.object(Item.objects, 'get', side_effect=read_then_outbid):
+                self.client.post(url, data)
+        item.refresh_from_db()
+        self.assertEqual(item.name, 'renamed')
+        # Neither the edit nor the retraction of what was no longer the top bid wrote back older prices
+        self.assertEqual((item.bid_count, item.current_price, item.min_bid), (4, Decimal('12'), Decimal('13')))
+        self.assertEqual(item.top_bid.bidder, bidders[2])
+        self.assertTrue(Bid.objects.filter(pk=retracted.pk).exists())
+
+    def test_rebuild_bid_stats(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        item = auction.add_item(name='test item', item_desc='desc', starting_price=1)
+        bidder = create_user('bidder', 'test12345')
+
+        # Bids saved directly bypass the bid engine and leave the statistics stale
+        bids = [Bid.objects.create(price=price, bidder=bidder, item=item) for price in (3, 9, 6)]
+        call_command('rebuild_bid_stats', stdout=io.StringIO())
+
+        item.refresh_from_db()
+        self.assertEqual((item.bid_count, item.top_bid, item.runner_up_bid), (3, bids[1], bids[2]))
+
+
+class BulkTransitionTests(TestCase):
+    def test_open_and_close_bidding_are_single_updates(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        for x in range(10):
+            auction.add_item(name=f'test item {x}', item_desc='desc', starting_price=1)
+
+        with self.assertNumQueries(1):
+            auction.open_bidding()
+        self.assertEqual(auction.item_set.filter(is_open=True).count(), 10)
+
+        with self.assertNumQueries(1):
+            auction.close_bidding()
+        self.assertEqual(auction.item_set.filter(is_open=True).count(), 0)
+
+    def test_publish_resets_winners_and_balances(self):
+        admin_username = 'admin'
+        admin_password = 'test12345'
+        admin = create_user(admin_username, admin_password)
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        auction.publish()
+        auction.open_bidding()
+        auction.save()
+        item = auction.add_item(name='test item', item_desc='desc', starting_price=5)
+        item.is_open = True
+        item.save()
+
+        bidder = create_user('bidder', 'test12345')
+        place_bid(item, bidder, Decimal('10'))
+
+        self.client.login(username=admin_username, password=admin_password)
+        self.client.post(reverse('auction:archive', args=[auction.pk]))
+        bidder.refresh_from_db()
+        self.assertEqual(bidder.guaranteed_balance, Decimal('10'))
+
+        self.client.post(reverse('auction:publish', args=[auction.pk]))
+        item.refresh_from_db()
+        bidder.refresh_from_db()
+        self.assertFalse(item.is_sold)
+        self.assertIsNone(item.winner)
+        self.assertFalse(item.bid_set.filter(won=True).exists())
+        self.assertEqual(bidder.guaranteed_balance, Decimal('0'))
+
+
+@override_settings(AUCTION_IMAGE_WORKERS=0)
+class ImageIngestTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.override = override_settings(MEDIA_ROOT=self.media_root)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.media_root)
+
+    def upload_item(self, auction, name, image_bytes):
+        data = {'name': name,
+                'starting_price': 5.00,
+                'description': 'desc',
+                'auction_type': 'silent',
+                'bid_increment': 1.00,
+                'image': SimpleUploadedFile('photo.jpg', image_bytes, content_type='image/jpeg')}
+        self.client.post(reverse('auction:auction_detail', args=[auction.pk]), data)
+        return auction.item_set.get(name=name)
+
+    def test_upload_generates_oriented_derivatives_once(self):
+        username = 'admin'
+        password = 'test12345'
+        admin = create_user(username, password)
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        self.client.login(username=username, password=password)
+
+        # Landscape phone photo tagged "rotate 90 degrees clockwise to display"
+        photo = Image.new('RGB', (1600, 1200), 'red')
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        buffer = io.BytesIO()
+        photo.save(buffer, format='JPEG', exif=exif)
+
+        item1 = self.upload_item(auction, 'item 1', buffer.getvalue())
+        item2 = self.upload_item(auction, 'item 2', buffer.getvalue())
+
+        self.assertTrue(item1.image_hash)
+        self.assertEqual(item1.image_hash, item2.image_hash)
+        self.assertEqual(item1.image.name, item2.image.name)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'item_pics', 'thumbnail'))), 1)
+
+        with Image.open(item1.print_path) as printed:
+            self.assertEqual(printed.size, (540, 720))
+        self.assertTrue(item1.thumbnail_url.endswith(f'thumbnail/{item1.image_hash}.jpg'))
+
+        # Saving the item again leaves the stored files alone
+        mtime = os.path.getmtime(item1.print_path)
+        item1.name = 'renamed'
+        item1.save()
+        self.assertEqual(os.path.getmtime(item1.print_path), mtime)
+
+
+class SettlementTests(TestCase):
+    def test_settle_auction_awards_top_bids(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        bidders = [create_user(f'bidder{x}', 'test12345') for x in range(3)]
+        items = []
+        for x in range(4):
+            item = auction.add_item(name=f'test item {x}', item_desc='desc', starting_price=1)
+            item.is_open = True
+            item.save()
+            items.append(item)
+
+        # bidder2 wins items 0 and 1, bidder1 wins item 2, nobody bids on item 3
+        for item in items[:3]:
+            place_bid(item, bidders[0], Decimal('5'))
+            place_bid(item, bidders[1], Decimal('10'))
+        place_bid(items[0], bidders[2], Decimal('20'))
+        place_bid(items[1], bidders[2], Decimal('30'))
+
+        # savepoint, read winners, bids, items, ledger entries, user totals, auction balances, release,
+        # then followers and bidders, notifications
+        with self.assertNumQueries(10), commit_hooks():
+            settled = settle_auction(auction)
+        self.assertEqual(settled, 3)
+
+        for bidder in bidders:
+            bidder.refresh_from_db()
+        self.assertEqual([b.guaranteed_balance for b in bidders], [Decimal('0'), Decimal('10'), Decimal('50')])
+        self.assertEqual([i.winner_id for i in auction.item_set.order_by('pk')],
+                         [bidders[2].pk, bidders[2].pk, bidders[1].pk, None])
+        self.assertEqual(Bid.objects.filter(won=True).count(), 3)
+        self.assertEqual(bidders[2].notification_set.filter(text__startswith='Congratulations!').count(), 2)
+
+        # Settling again is a no-op
+        self.assertEqual(settle_auction(auction), 0)
+        bidders[2].refresh_from_db()
+        self.assertEqual(bidders[2].guaranteed_balance, Decimal('50'))
+
+
+class ReportTests(TestCase):
+    def test_report_streams_winners(self):
+        admin_username = 'admin'
+        admin_password = 'test12345'
+        admin = create_user(admin_username, admin_password)
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        winner = AuctionUser.objects.create_user(username='winner', password='test12345',
+                                                 first_name='Bob', last_name='Joe')
+        sold = auction.add_item(name='sold item', starting_price=5, item_desc='desc')
+        auction.add_item(name='unsold item', starting_price=5, item_desc='desc')
+        Item.objects.filter(pk=sold.pk).update(winner=winner, is_sold=True, current_price=55)
+
+        self.client.login(username=admin_username, password=admin_password)
+        response = self.client.get(reverse('auction:auction_report', args=[auction.pk]))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('sold item,Bob Joe,winner,55.00', lines)
+        self.assertIn('unsold item,N/A,N/A,0', lines)
+
+    def test_report_restricted_to_admin(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        create_user('user', 'test12345')
+
+        self.client.login(username='user', password='test12345')
+        response = self.client.get(reverse('auction:auction_report', args=[auction.pk]))
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(AUCTION_QR_WORKERS=0)
+class QrCodeTests(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.override = override_settings(AUCTION_QR_CACHE_DIR=self.cache_dir)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.cache_dir)
+
+    def test_label_sheet_cached_until_items_change(self):
+        username = 'admin'
+        password = 'test12345'
+        admin = create_user(username, password)
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        for x in range(10):
+            auction.add_item(name=f'test item {x}', item_desc='desc', starting_price=1)
+        self.client.login(username=username, password=password)
+
+        response = self.client.post(reverse('auction:auction_qr_codes', args=[auction.pk]))
+        pdf = b''.join(response.streaming_content)
+        self.assertTrue(pdf.startswith(b'%PDF'))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        cached = os.listdir(self.cache_dir)[0]
+
+        # Repeat downloads are served from the cached file
+        response = self.client.post(reverse('auction:auction_qr_codes', args=[auction.pk]))
+        self.assertEqual(b''.join(response.streaming_content), pdf)
+        self.assertEqual(os.listdir(self.cache_dir), [cached])
+
+        # Renaming an item replaces the cached sheet
+        Item.objects.filter(auction=auction).update(name='renamed')
+        self.client.post(reverse('auction:auction_qr_codes', args=[auction.pk]))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        self.assertNotEqual(os.listdir(self.cache_dir), [cached])
+
+    def test_layouts_cached_side_by_side(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        image_path = os.path.join(self.cache_dir, 'image.png')
+        Image.new('RGB', (10, 10)).save(image_path)
+        labels = [('http://testserver/item/1', 'test item', image_path)]
+
+        for include_images in (True, False, True, False):
+            label_sheet(auction, labels, include_images).close()
+        sheets = [name for name in os.listdir(self.cache_dir) if name.endswith('.pdf')]
+        self.assertEqual(len(sheets), 2)
+
+        # Only the older sheet of the same layout is evicted
+        label_sheet(auction, [('http://testserver/item/1', 'renamed', image_path)], True).close()
+        sheets = [name for name in os.listdir(self.cache_dir) if name.endswith('.pdf')]
+        self.assertEqual(len(sheets), 2)
+        self.assertEqual(len([name for name in sheets if '_plain_' in name]), 1)
+
+
+class ParticipantsTests(TestCase):
+    def setUp(self):
+        self.admin = create_user('admin', 'test12345')
+        self.admin.create_auction(name='test auction', description='desc')
+        self.auction = self.admin.auction_set.first()
+        self.users = []
+        for x in range(20):
+            user = create_user(f'bidder{x}', 'test12345')
+            self.auction.participants.add(user)
+            self.users.append(user)
+        for x in range(6):
+            item = self.auction.add_item(name=f'test item {x}', item_desc='desc', starting_price=10 + x)
+            Item.objects.filter(pk=item.pk).update(winner=self.users[x % 3], is_sold=True)
+            post([entry(self.users[x % 3].pk, item, GUARANTEED, item.current_price, 'result')])
+        self.client.login(username='admin', password='test12345')
+
+    def test_participants_query_count_is_flat(self):
+        # session, user, auction, grouped totals, won item names
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('auction:participants', args=[self.auction.id]))
+        participants = {p['name']: p for p in json.loads(response.context['participants'])}
+
+        self.assertEqual(len(participants), 20)
+        self.assertEqual(participants['bidder0']['items_won'], ['test item 0', 'test item 3'])
+        self.assertEqual(participants['bidder0']['total_cost'], 23.0)
+        self.assertEqual(participants['bidder5']['total_cost'], 0)
+
+    def test_participants_api_paginates(self):
+        response = self.client.get(reverse('auction:participants_api', args=[self.auction.id]),
+                                   data={'page': 2, 'page_size': 8})
+        data = response.json()
+
+        self.assertEqual((data['count'], data['num_pages'], data['page']), (20, 3, 2))
+        self.assertEqual([p['name'] for p in data['results']], [f'bidder{x}' for x in range(8, 16)])
+
+        response = self.client.get(reverse('auction:participants_api', args=[self.auction.id]),
+                                   data={'filter': 'true'})
+        self.assertEqual([p['name'] for p in response.json()['results']], ['bidder0', 'bidder1', 'bidder2'])
+
+
+class BidFilterTests(TestCase):
+    def setUp(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        self.bidder = create_user('bidder', 'test12345')
+        rival = create_user('rival', 'test12345')
+
+        self.items = []
+        for x in range(3):
+            item = auction.add_item(name=f'test item {x}', item_desc='desc', starting_price=1)
+            item.is_open = True
+            item.save()
+            self.items.append(item)
+
+        # bidder leads on items 0 and 2 and has been outbid on item 1
+        place_bid(self.items[0], rival, Decimal('2'))
+        self.leading0 = place_bid(self.items[0], self.bidder, Decimal('5')).bid
+        place_bid(self.items[1], self.bidder, Decimal('5'))
+        place_bid(self.items[1], rival, Decimal('9'))
+        self.leading2 = place_bid(self.items[2], self.bidder, Decimal('3')).bid
+        self.client.login(username='bidder', password='test12345')
+
+    def test_winning_filter_uses_top_bid(self):
+        # session, user, bids with item and auction joined
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('auction:my_bids'), data={'filter': 'winning', 'order': '-price'})
+            [bid.item.auction.name for bid in response.context['object_list']]
+
+        self.assertEqual(list(response.context['object_list']), [self.leading0, self.leading2])
+
+    def test_unknown_filters_and_orderings_are_ignored(self):
+        response = self.client.get(reverse('auction:my_bids'),
+                                   data={'filter': '{"item__description__contains": "desc"}',
+                                         'order': 'item__description'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['object_list']), 3)
+        self.assertEqual(response.context['object_list'][0], self.leading2)
+
+
+class AuctionEventTests(TestCase):
+    def setUp(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        self.auction = admin.auction_set.first()
+        self.item = self.auction.add_item(name='test item', item_desc='desc', starting_price=1)
+        create_user('outsider', 'test12345')
+
+    def test_broker_fans_out_and_replays(self):
+        events = EventBroker()
+        first = events.subscribe(1)
+        second = events.subscribe(1)
+        other = events.subscribe(2)
+        events.publish(1, {'price': '5'})
+        events.publish(1, {'price': '6'})
+
+        self.assertEqual(first.get_nowait(), (1, {'price': '5'}))
+        self.assertEqual(second.qsize(), 2)
+        self.assertTrue(other.empty())
+
+        # A reconnecting client only gets what it missed
+        late = events.subscribe(1, since=1)
+        self.assertEqual(late.get_nowait(), (2, {'price': '6'}))
+        self.assertTrue(late.empty())
+
+    def test_long_poll_returns_published_events(self):
+        self.client.login(username='admin', password='test12345')
+        since = broker.last_id(self.auction.pk)
+        broker.publish(self.auction.pk, item_event(self.item.pk, price='7.00', bid_count=1))
+
+        response = self.client.get(reverse('auction:auction_events', args=[self.auction.pk]),
+                                   data={'poll': 1, 'since': since, 'timeout': 0})
+        data = response.json()
+
+        self.assertEqual(data['last_id'], since + 1)
+        self.assertEqual(data['events'], [{'id': since + 1, 'type': 'item', 'item': self.item.pk,
+                                           'price': '7.00', 'bid_count': 1}])
+
+        self.client.login(username='outsider', password='test12345')
+        response = self.client.get(reverse('auction:auction_events', args=[self.auction.pk]),
+                                   data={'poll': 1, 'timeout': 0})
+        self.assertEqual(response.status_code, 403)
+
+
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        self.auction = admin.auction_set.first()
+        self.item = self.auction.add_item(name='test item', item_desc='desc', starting_price=1)
+        self.users = [create_user(f'user{x}', 'test12345') for x in range(5)]
+
+    def test_fan_out_to_followers_and_bidders_in_bulk(self):
+        # users 0-2 follow the item, users 2-3 have bid on it
+        for user in self.users[:3]:
+            user.watch_item(self.item.pk)
+        for user in self.users[2:4]:
+            Bid.objects.create(item=self.item, bidder=user, price=5)
+
+        # Nothing is written until the transaction commits and the outermost block exits; then one audience query
+        # and one insert
+        with self.assertNumQueries(2), commit_hooks():
+            with self.assertNumQueries(0), collect_notifications():
+                item_closed(self.item.pk, self.item.name)
+                outbid(self.users[4].pk, self.item)
+
+        closed = Notification.objects.filter(text__startswith='Bidding has closed')
+        self.assertEqual(sorted(n.user_id for n in closed), [u.pk for u in self.users[:4]])
+        self.assertTrue(self.users[4].notification_set.filter(text__startswith='Outbid!').exists())
+
+        # Events raised in a transaction that rolls back are dropped
+        with commit_hooks(), self.assertRaises(ValueError), transaction.atomic():
+            outbid(self.users[0].pk, self.item)
+            raise ValueError
+        self.assertFalse(self.users[0].notification_set.filter(text__startswith='Outbid!').exists())
+
+    def test_failed_request_sends_nothing(self):
+        Item.objects.filter(pk=self.item.pk).update(is_open=True)
+        self.item.refresh_from_db()
+        place_bid(self.item, self.users[0], Decimal(5))
+        self.client.login(username='admin', password='test12345')
+        self.client.raise_request_exception = False
+
+        # The item is settled, then archiving fails
+        with commit_hooks(), self.assertLogs('django.request', 'ERROR'), \
+                mock.patch.object(Auction, 'archive', side_effect=ValueError):
+            response = self.client.post(reverse('auction:archive', args=[self.auction.pk]))
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(Notification.objects.filter(text__startswith='Congratulations').exists())
+
+    def test_home_paginates_notifications(self):
+        self.client.login(username='user0', password='test12345')
+        for x in range(25):
+            Notification.objects.create(user=self.users[0], item=self.item, text=f'note {x}')
+
+        response = self.client.get(reverse('auction:home'))
+        self.assertEqual([n.text for n in response.context['notifications']][:2], ['note 24', 'note 23'])
+        self.assertEqual(len(response.context['notifications']), 20)
+
+        response = self.client.get(reverse('auction:home'), data={'page': 2})
+        self.assertEqual(len(response.context['notifications']), 5)
+
+
+class ListingCacheTests(TestCase):
+    def setUp(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        self.auction = admin.auction_set.first()
+        self.item = self.auction.add_item(name='test item', item_desc='desc', starting_price=1)
+        self.item.is_open = True
+        self.item.save()
+        self.bidder = create_user('bidder', 'test12345')
+        self.client.login(username='admin', password='test12345')
+
+    def test_listing_is_served_from_cache_until_a_bid(self):
+        url = reverse('auction:auction_detail', args=[self.auction.pk])
+        self.client.get(url)
+
+        # session, user, auction, participant count; no item queries
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertContains(response, '<span id="price-%d">1.00</span>' % self.item.pk)
+
+        place_bid(self.item, self.bidder, Decimal('6'))
+        response = self.client.get(url)
+        self.assertContains(response, '<span id="price-%d">6.00</span>' % self.item.pk)
+        self.assertEqual(response.context['item_count'], 1)
+
+    def test_auction_saves_keep_concurrent_version_bumps(self):
+        open_bidding = Auction.open_bidding
+
+        def open_while_bid(auction):
+            open_bidding(auction)
+            # Another request bumps the version after this one loaded the auction
+            bump_listing_version(auction.pk)
+
+        version = self.auction.listing_version
+        with mock.patch.object(Auction, 'open_bidding', open_while_bid):
+            self.client.post(reverse('auction:open_bidding', args=[self.auction.pk]))
+        self.client.post(reverse('auction:publish', args=[self.auction.pk]))
+        self.auction.refresh_from_db()
+        self.assertEqual(self.auction.listing_version, version + 3)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        self.auction = admin.auction_set.first()
+        self.item = self.auction.add_item(name='test item', item_desc='desc', starting_price=1)
+        self.item.is_open = True
+        self.item.save()
+        self.bidder = create_user('bidder', 'test12345')
+        self.auction.participants.add(self.bidder)
+        self.client.login(username='bidder', password='test12345')
+
+    def test_item_view_returns_304_until_a_bid(self):
+        url = reverse('auction:item', args=[self.item.pk])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        place_bid(self.item, create_user('rival', 'test12345'), Decimal('5'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_watchlist_and_auction_detail_revalidate(self):
+        url = reverse('auction:watchlist')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.bidder.watch_item(self.item.pk)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        url = reverse('auction:auction_detail', args=[self.auction.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        place_bid(self.item, self.bidder, Decimal('5'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_admin_pages_revalidate_when_someone_joins(self):
+        self.auction.publish()
+        self.auction.save()
+        self.client.login(username='admin', password='test12345')
+        urls = [reverse('auction:auction_detail', args=[self.auction.pk]), reverse('auction:item', args=[self.item.pk])]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+
+        create_user('newcomer', 'test12345')
+        self.client.login(username='newcomer', password='test12345')
+        self.client.post(reverse('auction:auctions'), {'auction_code': self.auction.pk})
+
+        # The newcomer is counted, and can be picked as a live item's winner
+        self.client.login(username='admin', password='test12345')
+        for url, etag, shown in zip(urls, etags, ['Participants: 2', "participants.push('newcomer')"]):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, shown)
+
+
+@override_settings(AUCTION_QR_WORKERS=0, AUCTION_QR_CACHE_DIR=os.path.join(tempfile.gettempdir(), 'auction_budget_qr'))
+class QueryBudgetTests(TestCase):
+    """
+    Fixes the number of queries each view may run against an event-sized auction: 500 silent items with
+    50 bids each, plus live items, participants, watched items and notifications.
+    A budget that has to go up here usually means a template or view started querying per row
+    """
+    ITEMS = 500
+    BIDS_PER_ITEM = 50
+    LIVE_ITEMS = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin', 'test12345')
+        cls.admin.create_auction(name='test auction', description='desc')
+        cls.auction = cls.admin.auction_set.first()
+        cls.auction.publish()
+        cls.auction.save()
+
+        AuctionUser.objects.bulk_create([AuctionUser(username=f'bidder{x}') for x in range(cls.BIDS_PER_ITEM)])
+        cls.bidders = list(AuctionUser.objects.filter(username__startswith='bidder').order_by('pk'))
+        cls.bidder = cls.bidders[0]
+        cls.bidder.set_password('test12345')
+        cls.bidder.save()
+        cls.auction.participants.add(*cls.bidders)
+
+        Item.objects.bulk_create(
+            [Item(auction=cls.auction, name=f'silent item {x}', description='desc', is_open=True,
+                  starting_price=1, current_price=cls.BIDS_PER_ITEM, min_bid=cls.BIDS_PER_ITEM + 1)
+             for x in range(cls.ITEMS)] +
+            [Item(auction=cls.auction, name=f'live item {x}', description='desc', auction_type='live',
+                  starting_price=1, current_price=1, min_bid=1)
+             for x in range(cls.LIVE_ITEMS)])
+        cls.items = list(cls.auction.item_set.filter(auction_type='silent').order_by('pk'))
+        cls.item = cls.items[0]
+
+        # bidderN bids N + 1 on every item, so the last bidder leads everywhere
+        Bid.objects.bulk_create([Bid(item=item, bidder=bidder, price=x + 1)
+                                 for item in cls.items for x, bidder in enumerate(cls.bidders)])
+        call_command('rebuild_bid_stats', stdout=io.StringIO())
+        cls.item.refresh_from_db()
+
+        cls.bidder.watched_items.add(*cls.items[:100])
+        Notification.objects.bulk_create([Notification(user=cls.bidder, item=item, text='Outbid!')
+                                          for item in cls.items[:100]])
+
+    def setUp(self):
+        cache.clear()
+
+    def assertBudget(self, budget, method, name, *args, data=None):
+        with self.assertNumQueries(budget), commit_hooks():
+            response = getattr(self.client, method)(reverse(f'auction:{name}', args=args), data or {})
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400)
+        return response
+
+    def test_anonymous_pages(self):
+        self.assertBudget(0, 'get', 'login')
+        self.assertBudget(0, 'get', 'signup')
+        self.assertBudget(0, 'get', 'reset_password')
+
+    def test_account_pages(self):
+        self.client.force_login(self.bidder)
+        # session, user, one page of notifications, count
+        self.assertBudget(4, 'get', 'home')
+        self.assertBudget(2, 'get', 'account')
+        self.assertBudget(4, 'get', 'watchlist')
+        self.assertBudget(2, 'get', 'edit_account')
+        self.assertBudget(2, 'get', 'change_password')
+        self.assertBudget(5, 'get', 'auctions')
+        self.assertBudget(3, 'get', 'my_bids')
+        # The whole watchlist, then only what changed since the cursor
+        cursor = self.assertBudget(3, 'get', 'watchlist_api').json()['cursor']
+        self.assertBudget(4, 'get', 'watchlist_api', data={'since': cursor})
+
+    def test_auction_pages(self):
+        self.client.force_login(self.bidder)
+        # session, user, auction, participant check, item count, first page of each type, participant count
+        self.assertBudget(8, 'get', 'auction_detail', self.auction.pk)
+        self.assertBudget(4, 'get', 'auction_events', self.auction.pk, data={'poll': 1, 'timeout': 0})
+        # Matching items come ranked from the index in one query, across joined auctions or within one
+        self.assertBudget(3, 'get', 'item_search', data={'q': 'silent item'})
+        self.assertBudget(4, 'get', 'item_search', data={'q': 'silent item', 'auction': self.auction.pk})
+        # session, user, auction, participant check, then one query per page however deep it is
+        listing = self.assertBudget(5, 'get', 'item_listing_api', self.auction.pk, data={'type': 'silent'}).json()
+        self.assertBudget(5, 'get', 'item_listing_api', self.auction.pk,
+                          data={'type': 'silent', 'after': listing['next'], 'fields': 'name,top_bid,description'})
+
+        self.client.force_login(self.admin)
+        # the listing now comes from the cache
+        self.assertBudget(4, 'get', 'auction_detail', self.auction.pk)
+        self.assertBudget(2, 'get', 'create_auction')
+        self.assertBudget(4, 'get', 'participants', self.auction.pk)
+        self.assertBudget(5, 'get', 'participants_api', self.auction.pk)
+        self.assertBudget(5, 'get', 'auction_report', self.auction.pk)
+        self.assertBudget(5, 'post', 'auction_qr_codes', self.auction.pk)
+
+    def test_item_pages(self):
+        self.client.force_login(self.bidder)
+        # session, user, item with auction and top bid, watch state, bids with bidders, participants
+        self.assertBudget(6, 'get', 'item', self.item.pk)
+        self.assertBudget(14, 'post', 'submit_bid', self.item.pk, data={'bid': '100'})
+        self.assertBudget(9, 'post', 'watch_item', self.item.pk)
+        self.assertBudget(10, 'post', 'unwatch_item', self.item.pk)
+        self.assertBudget(4, 'post', 'clear_notifications', self.bidder.pk)
+
+        self.client.force_login(self.admin)
+        self.assertBudget(6, 'get', 'item', self.item.pk)
+        self.assertBudget(9, 'post', 'edit_item', self.item.pk, data={'name': 'renamed'})
+        self.assertBudget(21, 'get', 'remove_bid', self.item.pk, Item.objects.get(pk=self.item.pk).top_bid_id)
+        self.assertBudget(21, 'post', 'delete_item', self.item.pk)
+
+    def test_admin_tools(self):
+        self.client.force_login(self.admin)
+        self.assertBudget(3, 'get', 'batch_entry', self.auction.pk)
+        # A sheet of results is recorded in the same statements however many rows it has
+        rows = ''.join(f'live item {x}, bidder{x}, {x + 10}\n' for x in range(self.LIVE_ITEMS))
+        self.assertBudget(15, 'post', 'batch_entry', self.auction.pk, data={'mode': 'results', 'rows': rows})
+
+        self.assertBudget(3, 'get', 'item_import', self.auction.pk)
+        # So is an import, however many items it adds
+        csv_text = 'name,starting_price,description\n' + ''.join(f'imported {x},5,desc\n' for x in range(100))
+        self.assertBudget(7, 'post', 'item_import', self.auction.pk,
+                          data={'items': SimpleUploadedFile('items.csv', csv_text.encode(), content_type='text/csv')})
+
+        # Each change to a hundred items with their bids is a fixed set of statements
+        self.assertBudget(4, 'get', 'bulk_edit', self.auction.pk)
+        for budget, action, items, fields in (
+                (11, 'reprice', self.items[:100], {'starting_price': '2', 'bid_increment': '3'}),
+                (11, 'schedule', self.items[:100], {'closes_at': '2030-01-01T19:00'}),
+                (14, 'retype', self.items[100:200], {'auction_type': 'live'}),
+                (22, 'delete', self.items[200:300], {})):
+            self.assertBudget(budget, 'post', 'bulk_edit', self.auction.pk,
+                              data={'action': action, 'items': [item.pk for item in items], **fields})
+
+    def test_auction_transitions(self):
+        self.client.force_login(self.admin)
+        # Opening and closing notify every follower and bidder of every item: these grow with the
+        # number of notifications written, 500 rows per insert, and with nothing else
+        self.assertBudget(58, 'post', 'open_bidding', self.auction.pk)
+        self.assertBudget(58, 'post', 'close_bidding', self.auction.pk)
+        self.assertBudget(67, 'post', 'archive', self.auction.pk)
+        self.assertBudget(13, 'post', 'publish', self.auction.pk)
+        self.assertBudget(3, 'post', 'create_auction', data={'name': 'new auction', 'description': 'desc'})
+
+
+class SeedAuctionsTests(TestCase):
+    def test_seeded_auction_is_consistent(self):
+        call_command('seed_auctions', users=20, items=30, bids=5, prefix='t', no_images=True, stdout=io.StringIO())
+        auction = AuctionUser.objects.get(username='t_admin').auction_set.get()
+
+        self.assertEqual(auction.participants.count(), 20)
+        self.assertEqual(auction.item_set.count(), 30)
+        self.assertTrue(Bid.objects.filter(item__auction=auction).exists())
+        for item in auction.item_set.filter(auction_type='silent').select_related('top_bid'):
+            self.assertEqual(item.bid_count, item.bid_set.count())
+            if item.top_bid:
+                self.assertEqual(item.current_price, item.top_bid.price)
+                self.assertEqual(item.min_bid, item.current_price + item.bid_increment)
+
+        # Only top bids are held against balances
+        held = sum(AuctionUser.objects.filter(joined_auction=auction).values_list('possible_balance', flat=True))
+        self.assertEqual(held, sum(item.current_price for item in auction.item_set.filter(top_bid__isnull=False)))
+
+
+class ServerTimingTests(TestCase):
+    @override_settings(AUCTION_SERVER_TIMING=True)
+    def test_timings_are_reported_per_url_name(self):
+        create_user('bidder', 'test12345')
+        self.client.login(username='bidder', password='test12345')
+
+        with self.assertLogs('auction.timing', 'INFO') as logs:
+            response = self.client.get(reverse('auction:home'))
+        metrics = response['Server-Timing']
+        line = json.loads(logs.records[-1].getMessage())
+
+        self.assertIn('sql;dur=', metrics)
+        self.assertIn('template;dur=', metrics)
+        self.assertEqual(line['url_name'], 'auction:home')
+        # session, user, notification count
+        self.assertEqual(line['queries'], 3)
+        self.assertIn('SELECT', line['slowest_sql'])
+
+    def test_off_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('auction:login')))
+
+    def test_overlapping_calls_keep_their_own_start(self):
+        @timed('work')
+        def work(depth):
+            time.sleep(0.02)
+            if depth:
+                work(depth - 1)
+
+        timer = RequestTimer()
+        timing._local.timer = timer
+        try:
+            work(1)
+        finally:
+            timing._local.timer = None
+        # The outer call spans both sleeps and the inner one its own
+        self.assertGreaterEqual(timer.spans['work'], 0.06)
+
+
+class BidWriterTests(TransactionTestCase):
+    def test_concurrent_bids_are_group_committed(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        item = admin.auction_set.first().add_item(name='test item', item_desc='desc', starting_price=1)
+        Item.objects.filter(pk=item.pk).update(is_open=True)
+        item.refresh_from_db()
+        bidders = [create_user(f'bidder{x}', 'test12345') for x in range(8)]
+
+        # Submitted before the writer drains the queue, so they land in one batch
+        writer = BidWriter(batch_size=32)
+        futures = [writer.submit(item, bidder, Decimal(5 + x)) for x, bidder in enumerate(bidders)]
+        results = [future.result(timeout=10) for future in futures]
+
+        self.assertTrue(all(result.accepted for result in results))
+        item.refresh_from_db()
+        self.assertEqual(item.current_price, Decimal('12'))
+        self.assertEqual(item.bid_count, 8)
+        self.assertEqual(item.top_bid_id, results[-1].bid.pk)
+        # only the final high bid is held, and every outbid bidder was told
+        self.assertEqual(sum(AuctionUser.objects.values_list('possible_balance', flat=True)), Decimal('12'))
+        self.assertEqual(Notification.objects.filter(text__startswith='Outbid!').count(), 7)
+
+    @override_settings(AUCTION_BID_QUEUE_TIMEOUT=0.01)
+    def test_bid_wait_running_out(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        item = admin.auction_set.first().add_item(name='test item', item_desc='desc', starting_price=1)
+        Item.objects.filter(pk=item.pk).update(is_open=True)
+        create_user('bidder', 'test12345')
+        self.client.login(username='bidder', password='test12345')
+        url = reverse('auction:submit_bid', args=[item.pk])
+        writer = BidWriter(batch_size=32)
+
+        # Still queued: withdrawn and reported as not placed, and never placed later
+        with mock.patch('auction.bid_queue.get_writer', return_value=writer), \
+                mock.patch.object(BidWriter, '_start'):
+            response = self.client.post(url, {'bid': '5'})
+        self.assertTemplateUsed(response, 'auction/bid_fail.html')
+        self.assertTrue(response.context['busy'])
+        writer.apply([writer.queue.get_nowait()])
+        self.assertFalse(Bid.objects.exists())
+
+        # Already being placed: the bidder is sent to the item page to see how it went
+        started = Future()
+        started.set_running_or_notify_cancel()
+        with mock.patch.object(BidWriter, 'submit', return_value=started):
+            response = self.client.post(url, {'bid': '5'})
+        self.assertTemplateUsed(response, 'auction/bid_pending.html')
+
+
+class BatchEntryTests(TestCase):
+    def setUp(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        self.auction = admin.auction_set.first()
+        self.live = self.auction.add_item(name='painting', item_desc='desc', starting_price=1)
+        self.silent = self.auction.add_item(name='basket', item_desc='desc', starting_price=10)
+        Item.objects.filter(pk=self.live.pk).update(auction_type='live')
+        Item.objects.filter(pk=self.silent.pk).update(is_open=True)
+        self.silent.refresh_from_db()
+        self.users = [create_user(f'user{x}', 'test12345') for x in range(3)]
+        self.auction.participants.add(*self.users)
+        self.client.login(username='admin', password='test12345')
+        self.url = reverse('auction:batch_entry', args=[self.auction.pk])
+
+    def test_record_live_results(self):
+        response = self.client.post(self.url, {'mode': 'results', 'rows': 'painting, user0, 150\n'})
+        self.assertEqual(response.context['recorded'], 1)
+
+        # Re-entering an item by number and paddle corrects it, so only user1 owes for the painting
+        with commit_hooks():
+            response = self.client.post(self.url, {'mode': 'results', 'rows': f'{self.live.pk}, {self.users[1].pk}, 200'})
+        self.assertEqual(response.context['recorded'], 1)
+        self.live.refresh_from_db()
+        self.assertTrue(self.live.is_sold)
+        self.assertEqual(self.live.winner_id, self.users[1].pk)
+        self.assertEqual(self.live.current_price, Decimal('200'))
+        balances = dict(AuctionUser.objects.filter(pk__in=[u.pk for u in self.users[:2]])
+                        .values_list('username', 'guaranteed_balance'))
+        self.assertEqual(balances, {'user0': Decimal('0'), 'user1': Decimal('200')})
+        self.assertTrue(self.users[1].notification_set.filter(text__startswith='Congratulations').exists())
+
+    def test_unusable_prices_are_row_errors(self):
+        prices = ['NaN', 'Infinity', '1e30', '5.001', '-1']
+        for mode, item in (('results', 'painting'), ('bids', 'basket')):
+            rows = [[item, f'user{x % 3}', price] for x, price in enumerate(prices)]
+            response = self.client.post(self.url, json.dumps({'mode': mode, 'rows': rows}),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(len(response.json()['errors']), len(prices))
+        self.assertFalse(Bid.objects.exists())
+        self.assertFalse(Item.objects.filter(is_sold=True).exists())
+
+    def test_bid_sheet_is_all_or_nothing(self):
+        place_bid(self.silent, self.users[0], Decimal('10'))
+        self.silent.refresh_from_db()
+
+        # The last line is lower than the one before it, so none of the sheet is written
+        rows = [['basket', 'user1', '12'], ['basket', 'user2', '15'], ['basket', 'user1', '14']]
+        response = self.client.post(self.url, json.dumps({'mode': 'bids', 'rows': rows}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), 1)
+        self.assertEqual(Bid.objects.count(), 1)
+
+        rows[2][2] = '16'
+        with commit_hooks():
+            response = self.client.post(self.url, json.dumps({'mode': 'bids', 'rows': rows}),
+                                        content_type='application/json')
+        self.assertEqual(response.json(), {'recorded': 3})
+        self.silent.refresh_from_db()
+        self.assertEqual(self.silent.bid_count, 4)
+        self.assertEqual(self.silent.current_price, Decimal('16'))
+        self.assertEqual(self.silent.top_bid.bidder, self.users[1])
+        self.assertEqual(self.silent.runner_up_bid.price, Decimal('15'))
+        self.assertEqual(sum(AuctionUser.objects.values_list('possible_balance', flat=True)), Decimal('16'))
+        self.assertTrue(self.users[0].notification_set.filter(text__startswith='Outbid!').exists())
+
+
+@override_settings(AUCTION_IMAGE_WORKERS=2)
+class ItemImportTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.override = override_settings(MEDIA_ROOT=self.media_root)
+        self.override.enable()
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        self.auction = admin.auction_set.first()
+        self.client.login(username='admin', password='test12345')
+        self.url = reverse('auction:item_import', args=[self.auction.pk])
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.media_root)
+
+    def upload(self, csv_text, images=None):
+        data = {'items': SimpleUploadedFile('items.csv', csv_text.encode(), content_type='text/csv')}
+        if images:
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w') as archive:
+                for name, color in images.items():
+                    picture = io.BytesIO()
+                    Image.new('RGB', (800, 600), color).save(picture, format='JPEG')
+                    archive.writestr(name, picture.getvalue())
+            data['images'] = SimpleUploadedFile('images.zip', buffer.getvalue(), content_type='application/zip')
+        return self.client.post(self.url, data)
+
+    def test_import_items_with_pictures(self):
+        csv_text = ('Name,Starting_Price,Bid_Increment,Description,Auction_Type,Image\n'
+                    'vase,10,,blue vase,,vase.jpg\n'
+                    'second vase,12,2,the same vase,live,VASE.JPG\n'
+                    'quilt,40,5,hand made,silent,quilt.jpg\n'
+                    'book,5,1,signed,silent,\n')
+        progress = []
+        with mock.patch('auction.views.import_event', side_effect=lambda done, total: progress.append(done) or {}):
+            response = self.upload(csv_text, {'donor/vase.jpg': 'blue', 'donor/quilt.jpg': 'red'})
+        self.assertEqual(response.context['imported'], 4)
+        self.assertEqual(progress[-1], 2)
+
+        items = {item.name: item for item in self.auction.item_set.all()}
+        self.assertEqual(items['vase'].auction_type, 'silent')
+        self.assertEqual(items['vase'].bid_increment, Decimal('1'))
+        self.assertEqual(items['second vase'].min_bid, Decimal('12'))
+        self.assertEqual(items['vase'].image.name, items['second vase'].image.name)
+        self.assertNotEqual(items['vase'].image_hash, items['quilt'].image_hash)
+        self.assertEqual(items['book'].image.name, Item._meta.get_field('image').default)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'item_pics', 'thumbnail'))), 2)
+
+    def test_invalid_rows_import_nothing(self):
+        csv_text = ('name,starting_price,description,auction_type,image\n'
+                    'vase,10,blue vase,silent,vase.jpg\n'
+                    'quilt,lots,hand made,silent,\n'
+                    'book,5,signed,online,\n')
+        response = self.upload(csv_text)
+        self.assertEqual(len(response.context['error_msg']), 3)
+        self.assertTrue(response.context['error_msg'][0].startswith('Line 2: image vase.jpg'))
+        self.assertFalse(self.auction.item_set.exists())
+
+
+class WatchlistSyncTests(TestCase):
+    def setUp(self):
+        admin = create_user('admin', 'test12345')
+        admin.create_auction(name='test auction', description='desc')
+        auction = admin.auction_set.first()
+        self.items = [auction.add_item(name=f'item {x}', item_desc='desc', starting_price=1) for x in range(4)]
+        self.user = create_user('user', 'test12345')
+        for item in self.items:
+            self.user.watch_item(item.pk)
+        self.client.login(username='user', password='test12345')
+        self.url = reverse('auction:watchlist_api')
+
+    def test_sync_returns_changes_and_removals_since_cursor(self):
+        response = self.client.get(self.url).json()
+        self.assertEqual([item['id'] for item in response['items']], [item.pk for item in self.items])
+        self.assertEqual(response['removed'], [])
+
+        # Everything so far happened well before the cursor
+        Item.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+        WatchlistRemoval.objects.update(timestamp=timezone.now() - timedelta(minutes=5))
+        cursor = response['cursor']
+
+        Item.objects.filter(pk=self.items[0].pk).update(current_price=7, updated_at=timezone.now())
+        self.user.unwatch_item(self.items[1].pk)
+        deleted_pk = self.items[2].pk
+        self.items[2].delete()
+
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url, {'since': cursor}).json()
+        self.assertEqual([item['id'] for item in response['items']], [self.items[0].pk])
+        self.assertEqual(response['items'][0]['current_price'], '7.00')
+        self.assertEqual(response['removed'], sorted([self.items[1].pk, deleted_pk]))
+
+
+class BalanceLedgerTests(TestCase):
+    def setUp(self):
+        self.admin = create_user('admin', 'test12345')
+        self.admin.create_auction(name='test auction', description='desc')
+        self.auction = self.admin.auction_set.first()
+        self.items = [self.auction.add_item(name=f'item {x}', item_desc='desc', starting_price=1) for x in range(2)]
+        Item.objects.update(is_open=True)
+        self.bidders = [create_user(f'bidder{x}', 'test12345') for x in range(2)]
+        for item in self.items:
+            item.refresh_from_db()
+            place_bid(item, self.bidders[0], Decimal('5'))
+            place_bid(item, self.bidders[1], Decimal('8'))
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        call_command('reconcile_balances', *args, stdout=out)
+        return out.getvalue()
+
+    def test_balance_changes_are_posted_to_the_ledger(self):
+        self.client.login(username='admin', password='test12345')
+        self.client.get(reverse('auction:remove_bid', args=[self.items[0].pk, self.items[0].top_bid_id]))
+        self.client.post(reverse('auction:archive', args=[self.auction.pk]))
+        self.client.post(reverse('auction:delete_item', args=[self.items[1].pk]))
+
+        # bidder0 holds and has won item 0 at 5 after the retraction; item 1, won by bidder1, is gone
+        balances = {b.user_id: (b.possible, b.guaranteed) for b in Balance.objects.all()}
+        self.assertEqual(balances, {self.bidders[0].pk: (Decimal('5'), Decimal('5')),
+                                    self.bidders[1].pk: (Decimal('0'), Decimal('0'))})
+        self.bidders[0].refresh_from_db()
+        self.assertEqual((self.bidders[0].possible_balance, self.bidders[0].guaranteed_balance),
+                         (Decimal('5'), Decimal('5')))
+        self.assertIn('All balances agree', self.reconcile())
+
+    def test_user_saves_keep_ledger_balances(self):
+        # bidder1 holds both items at 8; while each request runs, bidder0 outbids them on one item
+        outbid_item = Item.objects.get(pk=self.items[0].pk)
+        watch_item = AuctionUser.watch_item
+
+        def watch_while_outbid(user, pk):
+            watch_item(user, pk)
+            place_bid(outbid_item, self.bidders[0], Decimal('10'))
+
+        self.client.login(username='bidder1', password='test12345')
+        with mock.patch.object(AuctionUser, 'watch_item', watch_while_outbid):
+            self.client.post(reverse('auction:watch_item', args=[self.items[1].pk]))
+        self.bidders[1].refresh_from_db()
+        self.assertEqual(self.bidders[1].possible_balance, Decimal('8'))
+
+        stale = AuctionUser.objects.get(pk=self.bidders[1].pk)
+        place_bid(Item.objects.get(pk=self.items[1].pk), self.bidders[0], Decimal('10'))
+        with mock.patch('auction.views.EditAccountView.get_object', return_value=stale):
+            self.client.post(reverse('auction:edit_account'),
+                             {'email': 'b@example.com', 'first_name': 'B', 'last_name': 'One'})
+        self.bidders[1].refresh_from_db()
+        self.assertEqual((self.bidders[1].email, self.bidders[1].possible_balance), ('b@example.com', Decimal('0')))
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        # A stray write behind the ledger's back, and a win that was never posted
+        AuctionUser.objects.filter(pk=self.bidders[1].pk).update(possible_balance=3)
+        Item.objects.filter(pk=self.items[0].pk).update(is_sold=True, winner=self.bidders[1])
+
+        output = self.reconcile()
+        self.assertIn('bidder1: total (possible, guaranteed) $3.00, $0.00, ledger $16.00, $0.00', output)
+        self.assertIn('bidder1 in test auction: ledger (possible, guaranteed) $16.00, $0.00, items $16.00, $8.00',
+                      output)
+
+        self.reconcile('--fix')
+        self.assertTrue(BalanceEntry.objects.filter(reason='adjust', amount=Decimal('8')).exists())
+        self.bidders[1].refresh_from_db()
+        self.assertEqual((self.bidders[1].possible_balance, self.bidders[1].guaranteed_balance),
+                         (Decimal('16'), Decimal('8')))
+        self.assertIn('All balances agree', self.reconcile())
+
+    def test_amounts_are_posted_in_cents(self):
+        post([entry(self.bidders[0].pk, self.items[0], GUARANTEED, Decimal('5.001'), 'result')])
+
+        # Read raw: the ORM rounds decimals on the way out, which would hide what was stored
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT guaranteed FROM auction_balance WHERE user_id = %s', [self.bidders[0].pk])
+            self.assertEqual(Decimal(str(cursor.fetchone()[0])), Decimal('5.00'))
+        self.assertEqual(BalanceEntry.objects.filter(reason='result').get().amount, Decimal('5.00'))
+        self.bidders[0].refresh_from_db()
+        self.assertEqual(self.bidders[0].guaranteed_balance, Decimal('5.00'))
+
+    def test_migration_backfills_ledger_from_items(self):
+        # As the tree stood before the ledger: item 0 won by bidder1, totals kept by hand and out of date
+        Item.objects.filter(pk=self.items[0].pk).update(is_sold=True, winner=self.bidders[1])
+        BalanceEntry.objects.all().delete()
+        Balance.objects.all().delete()
+        AuctionUser.objects.update(possible_balance=3, guaranteed_balance=3)
+
+        import_module('auction.migrations.0009_balance_ledger').backfill_ledger(apps, None)
+
+        self.assertEqual(set(BalanceEntry.objects.values_list('item_id', 'account', 'amount', 'reason')),
+                         {(self.items[0].pk, 'possible', Decimal('8'), 'bid'),
+                          (self.items[1].pk, 'possible', Decimal('8'), 'bid'),
+                          (self.items[0].pk, 'guaranteed', Decimal('8'), 'win')})
+        self.bidders[1].refresh_from_db()
+        self.assertEqual((self.bidders[1].possible_balance, self.bidders[1].guaranteed_balance),
+                         (Decimal('16'), Decimal('8')))
+        self.assertIn('All balances agree', self.reconcile())
+
+
+class ReconfigureTests(TestCase):
+    def setUp(self):
+        self.admin = create_user('admin', 'test12345')
+        self.admin.create_auction(name='test auction', description='desc')
+        self.auction = self.admin.auction_set.first()
+        self.items = [self.auction.add_item(name=f'item {x}', item_desc='desc', starting_price=10) for x in range(3)]
+        Item.objects.update(is_open=True)
+        self.bidders = [create_user(f'bidder{x}', 'test12345') for x in range(2)]
+        for item in self.items[:2]:
+            item.refresh_from_db()
+            for x in range(20):
+                place_bid(item, self.bidders[x % 2], Decimal(10 + x))
+        self.client.login(username='admin', password='test12345')
+
+    def test_retype_purges_bids_and_releases_balances(self):
+        item = self.items[0]
+        # The same statements however many bids the item has
+        with self.assertNumQueries(20):
+            self.client.post(reverse('auction:edit_item', args=[item.pk]), {'auction_type': 'live'})
+
+        item.refresh_from_db()
+        self.assertEqual((item.auction_type, item.bid_count, item.top_bid, item.current_price),
+                         ('live', 0, None, Decimal('10')))
+        self.assertFalse(item.bid_set.exists())
+        # Only the other item's top bid, 29 from bidder1, is still held
+        self.assertEqual(dict(AuctionUser.objects.filter(pk__in=[b.pk for b in self.bidders])
+                              .values_list('username', 'possible_balance')),
+                         {'bidder0': Decimal('0'), 'bidder1': Decimal('29')})
+
+    def test_bulk_reprice_and_delete(self):
+        url = reverse('auction:bulk_edit', args=[self.auction.pk])
+        response = self.client.post(url, {'action': 'reprice', 'items': [self.items[1].pk, self.items[2].pk],
+                                          'starting_price': '15', 'bid_increment': '5'})
+        self.assertEqual(response.context['changed'], 2)
+        self.items[1].refresh_from_db()
+        self.items[2].refresh_from_db()
+        # With bids the price stands and the increment goes on top; without, the item opens at the new price
+        self.assertEqual((self.items[1].current_price, self.items[1].min_bid), (Decimal('29'), Decimal('34')))
+        self.assertEqual((self.items[2].current_price, self.items[2].min_bid), (Decimal('15'), Decimal('15')))
+
+        for price in ('NaN', 'Infinity', '1e30', '5.001', '-1'):
+            response = self.client.post(url, {'action': 'reprice', 'items': [self.items[2].pk], 'starting_price': price})
+            self.assertNotIn('changed', response.context)
+            self.assertIn('dollars and cents', response.context['error_msg'])
+        self.items[2].refresh_from_db()
+        self.assertEqual(self.items[2].starting_price, Decimal('15'))
+
+        response = self.client.post(url, {'action': 'delete', 'items': [item.pk for item in self.items]})
+        self.assertEqual(response.context['changed'], 3)
+        self.assertFalse(self.auction.item_set.exists())
+        self.assertFalse(Bid.objects.exists())
+        self.assertEqual(sum(AuctionUser.objects.values_list('possible_balance', flat=True)), Decimal('0'))
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.admin = create_user('admin', 'test12345')
+        self.admin.create_auction(name='test auction', description='desc')
+        self.auction = self.admin.auction_set.first()
+        self.items = [self.auction.add_item(name=f'item {x}', item_desc='desc', starting_price=10) for x in range(5)]
+        self.bidder = create_user('bidder', 'test12345')
+        self.now = timezone.now()
+
+    def test_missed_closes_are_settled_in_batches(self):
+        Item.objects.update(is_open=True, closes_at=self.now + timedelta(minutes=1))
+        for item in self.items[:2]:
+            item.refresh_from_db()
+            place_bid(item, self.bidder, Decimal(20))
+        # Deadlines that passed while the scheduler was not running
+        Item.objects.exclude(pk=self.items[4].pk).update(closes_at=self.now - timedelta(minutes=5))
+
+        scheduler = DeadlineScheduler(batch_size=2)
+        scheduler.load()
+        # Two batches of two, each a fixed set of statements
+        with self.assertNumQueries(23), commit_hooks():
+            self.assertEqual(scheduler.run_due(), (0, 4, 2))
+
+        self.assertEqual(list(Item.objects.filter(is_open=True).values_list('pk', flat=True)), [self.items[4].pk])
+        self.assertEqual(list(Item.objects.filter(is_sold=True, winner=self.bidder).order_by('pk')
+                              .values_list('pk', flat=True)), [item.pk for item in self.items[:2]])
+        self.bidder.refresh_from_db()
+        self.assertEqual(self.bidder.guaranteed_balance, Decimal(40))
+        self.assertEqual(scheduler.run_due(), (0, 0, 0))
+
+    def test_late_bid_extends_close_and_scheduler_follows(self):
+        item = self.items[0]
+        Item.objects.filter(pk=item.pk).update(opens_at=self.now - timedelta(seconds=1),
+                                               closes_at=self.now + timedelta(seconds=30),
+                                               soft_close=timedelta(minutes=2))
+        scheduler = DeadlineScheduler()
+        scheduler.load()
+        self.assertEqual(scheduler.run_due(), (1, 0, 0))
+
+        item.refresh_from_db()
+        self.assertTrue(place_bid(item, self.bidder, Decimal(10)).accepted)
+        self.assertGreater(item.closes_at, self.now + timedelta(seconds=110))
+        scheduler.sync()
+
+        # The old deadline is skipped; the item closes at the extended one
+        self.assertEqual(scheduler.run_due(self.now + timedelta(minutes=1)), (0, 0, 0))
+        self.assertEqual(scheduler.run_due(item.closes_at), (0, 1, 1))
+        item.refresh_from_db()
+        self.assertEqual((item.is_open, item.winner_id, item.opens_at), (False, self.bidder.pk, None))
+
+    def test_every_process_announces_the_close(self):
+        Item.objects.update(is_open=True, closes_at=self.now - timedelta(seconds=1))
+        # One scheduler per web process, each only able to reach its own subscribers
+        schedulers = [DeadlineScheduler(), DeadlineScheduler()]
+        for scheduler in schedulers:
+            scheduler.load()
+
+        with mock.patch('auction.scheduler.publish_on_commit') as publish:
+            self.assertEqual(schedulers[0].run_due(), (0, 5, 0))
+            self.assertEqual(schedulers[1].run_due(), (0, 0, 0))
+        self.assertEqual(publish.call_count, 10)
+        publish.assert_called_with(self.auction.pk, item_event(self.items[4].pk, is_open=False))
+
+    def test_bid_after_close_time_is_rejected(self):
+        Item.objects.update(is_open=True, closes_at=self.now - timedelta(seconds=1))
+        item = Item.objects.get(pk=self.items[0].pk)
+        self.assertEqual(place_bid(item, self.bidder, Decimal(50)).reason, REJECTED_CLOSED)
+
+    def test_bulk_schedule_staggers_closes(self):
+        self.client.login(username='admin', password='test12345')
+        response = self.client.post(reverse('auction:bulk_edit', args=[self.auction.pk]),
+                                    {'action': 'schedule', 'items': [item.pk for item in self.items],
+                                     'closes_at': '2030-01-01T19:00', 'group_size': '2', 'interval': '15'})
+        self.assertEqual(response.context['changed'], 5)
+        closes = [timezone.localtime(closes_at).strftime('%H:%M')
+                  for closes_at in Item.objects.order_by('pk').values_list('closes_at', flat=True)]
+        self.assertEqual(closes, ['19:00', '19:00', '19:15', '19:15', '19:30'])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.admin = create_user('admin', 'test12345')
+        self.admin.create_auction(name='first auction', description='desc')
+        self.admin.create_auction(name='second auction', description='desc')
+        self.first, self.second = self.admin.auction_set.order_by('pk')
+        self.guest = create_user('guest', 'test12345')
+        self.first.participants.add(self.guest)
+
+        self.lamp = self.first.add_item(name='Brass lamp', item_desc='An antique reading light', starting_price=10)
+        self.chair = self.first.add_item(name='Oak chair', item_desc='Comes with a lamp shade', starting_price=10)
+        self.second.add_item(name='Lamp stand', item_desc='Not in an auction the guest joined', starting_price=10)
+        self.client.login(username='guest', password='test12345')
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('auction:item_search'), {'q': q, **params})
+        return [item['name'] for item in response.json()['items']]
+
+    def test_ranked_prefix_search_in_joined_auctions(self):
+        # Name matches rank above description matches; the other auction's lamp is not searched
+        self.assertEqual(self.search('lam'), ['Brass lamp', 'Oak chair'])
+        self.assertEqual(self.search('antique light'), ['Brass lamp'])
+        # Punctuation, FTS5 syntax included, is dropped rather than interpreted
+        self.assertEqual(self.search('oak" (*'), ['Oak chair'])
+        self.assertEqual(self.client.get(reverse('auction:item_search'),
+                                         {'q': 'lamp', 'auction': self.second.pk}).status_code, 403)
+
+    def test_index_follows_edits_and_deletes(self):
+        Item.objects.filter(pk=self.chair.pk).update(name='Walnut chair', description='No shade')
+        self.assertEqual(self.search('lamp', auction=self.first.pk), ['Brass lamp'])
+        self.assertEqual(self.search('walnut'), ['Walnut chair'])
+
+        self.lamp.delete()
+        self.assertEqual(self.search('lamp'), [])
+
+
+class ItemListingApiTests(TestCase):
+    def setUp(self):
+        self.admin = create_user('admin', 'test12345')
+        self.admin.create_auction(name='test auction', description='desc')
+        self.auction = self.admin.auction_set.first()
+        self.items = [self.auction.add_item(name=f'item {x}', item_desc='a long description', starting_price=10)
+                      for x in range(5)]
+        Item.objects.filter(pk=self.items[4].pk).update(auction_type='live')
+        Item.objects.update(is_open=True)
+        self.bidder = create_user('bidder', 'test12345')
+        self.auction.participants.add(self.bidder)
+        for item in self.items[:3]:
+            item.refresh_from_db()
+            place_bid(item, self.bidder, Decimal(15))
+        self.url = reverse('auction:item_listing_api', args=[self.auction.pk])
+
+    def test_keyset_pages_with_bids_in_fixed_queries(self):
+        self.client.login(username='admin', password='test12345')
+        pages, after = [], ''
+        while after is not None:
+            # session, user, auction, page with top bids and winners joined in
+            with self.assertNumQueries(4):
+                data = self.client.get(self.url, {'type': 'silent', 'limit': 2, 'after': after}).json()
+            pages.append([item['id'] for item in data['items']])
+            after = data['next']
+
+        self.assertEqual(pages, [[self.items[0].pk, self.items[1].pk], [self.items[2].pk, self.items[3].pk]])
+        item = self.client.get(self.url, {'limit': 1}).json()['items'][0]
+        self.assertNotIn('description', item)
+        self.assertEqual((item['bid_count'], item['top_bid']), (1, {'price': '15.00', 'mine': False,
+                                                                     'bidder': 'bidder'}))
+
+    def test_fields_filters_and_access(self):
+        self.client.login(username='bidder', password='test12345')
+        data = self.client.get(self.url, {'fields': 'name,description,top_bid', 'open': '1', 'type': 'live'}).json()
+        self.assertEqual(data, {'items': [{'id': self.items[4].pk, 'name': 'item 4',
+                                           'description': 'a long description', 'top_bid': None}], 'next': None})
+        # Participants only learn whether the top bid is theirs
+        data = self.client.get(self.url, {'fields': 'top_bid', 'limit': 1}).json()
+        self.assertEqual(data['items'][0]['top_bid'], {'price': '15.00', 'mine': True})
+        self.assertEqual(self.client.get(self.url, {'fields': 'password'}).status_code, 400)
+
+        create_user('stranger', 'test12345')
+        self.client.login(username='stranger', password='test12345')
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    @override_settings(AUCTION_LISTING_PAGE_SIZE=2)
+    def test_auction_page_renders_first_page(self):
+        self.client.login(username='bidder', password='test12345')
+        response = self.client.get(reverse('auction:auction_detail', args=[self.auction.pk]))
+        self.assertEqual([item.pk for item in response.context['silent_items']], [self.items[0].pk, self.items[1].pk])
+        self.assertEqual(response.context['next_items'], {'silent': self.items[1].pk, 'live': None})
+        self.assertEqual(response.context['item_count'], 5)
+        self.assertNotContains(response, 'a long description')
+
+    @override_settings(AUCTION_LISTING_PAGE_SIZE=2)
+    def test_bid_beyond_first_page(self):
+        self.client.login(username='bidder', password='test12345')
+        beyond = self.items[3]
+        response = self.client.post(reverse('auction:submit_bid', args=[beyond.pk]), {'bid': '30'})
+        self.assertTemplateUsed(response, 'auction/bid_success.html')
+
+        # The item is not a row of the page, so its bid events are ignored there rather than reloading it;
+        # rows that are shown carry their open state for the events to be checked against
+        response = self.client.get(reverse('auction:auction_detail', args=[self.auction.pk]))
+        self.assertNotContains(response, f'id="item-{beyond.pk}"')
+        self.assertContains(response, f'id="item-{self.items[0].pk}" data-open="true"')
+        data = self.client.get(self.url, {'type': 'silent', 'after': self.items[1].pk}).json()
+        self.assertEqual([(item['id'], item['current_price']) for item in data['items']],
+                         [(self.items[2].pk, '15.00'), (beyond.pk, '30.00')])
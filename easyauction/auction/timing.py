@@ -0,0 +1,135 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ContextDecorator
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+
+logger = logging.getLogger('auction.timing')
+
+# Longest SQL text kept in a log line
+MAX_SQL_LENGTH = 500
+
+_local = threading.local()
+
+
+class RequestTimer:
+    """
+    Timings for one request. Installed with connection.execute_wrapper, so queries are counted and timed as they
+    run without keeping them in connection.queries
+    """
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_sql = ''
+        self.spans = defaultdict(float)
+
+    def __call__(self, execute, sql, params, many, context):
+        began = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - began
+            self.queries += 1
+            self.sql_time += elapsed
+            if elapsed > self.slowest_time:
+                self.slowest_time = elapsed
+                self.slowest_sql = sql
+
+
+class timed(ContextDecorator):
+    """
+    Adds the time spent in a block or function to the current request's timings under `name`.
+    Does nothing outside a timed request, e.g. in worker threads or management commands
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def _recreate_cm(self):
+        # Each call of a decorated function gets its own instance, so calls that overlap, in other threads or
+        # recursively, don't overwrite each other's start time
+        return timed(self.name)
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        timer = getattr(_local, 'timer', None)
+        if timer is not None:
+            timer.spans[self.name] += time.perf_counter() - self.began
+        return False
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The standard Django template backend, with each top-level render counted as template time
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+class ServerTimingMiddleware:
+    """
+    Reports query count, SQL time, template time and image/PDF work for each request as a Server-Timing header
+    and a JSON log line on the auction.timing logger, keyed by URL name.
+    Enabled by AUCTION_SERVER_TIMING. Work done while a streaming response is consumed is not included
+    """
+    def __init__(self, get_response):
+        if not settings.AUCTION_SERVER_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = RequestTimer()
+        _local.timer = timer
+        began = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timer):
+                response = self.get_response(request)
+        finally:
+            _local.timer = None
+        total = time.perf_counter() - began
+
+        metrics = [f'total;dur={_ms(total)}', f'sql;dur={_ms(timer.sql_time)};desc="{timer.queries} queries"']
+        metrics += [f'{name};dur={_ms(seconds)}' for name, seconds in timer.spans.items()]
+        response['Server-Timing'] = ', '.join(metrics)
+
+        match = request.resolver_match
+        url_name = match.view_name if match else None
+        logger.info(json.dumps({
+            'url_name': url_name,
+            'method': request.method,
+            'status': response.status_code,
+            'total_ms': _ms(total),
+            'queries': timer.queries,
+            'sql_ms': _ms(timer.sql_time),
+            'slowest_sql_ms': _ms(timer.slowest_time),
+            'slowest_sql': timer.slowest_sql[:MAX_SQL_LENGTH],
+            **{f'{name}_ms': _ms(seconds) for name, seconds in timer.spans.items()},
+        }), extra={'url_name': url_name})
+        return response
@@ -28,6 +28,8 @@ urlpatterns += [
          name='account'),
     path('account/watchlist/', login_required(views.WatchedItemsView.as_view(template_name='auction/watchlist.html')),
          name='watchlist'),
+    path('account/watchlist/json', login_required(views.watchlist_api),
+         name='watchlist_api'),
     path('account/edit/', login_required(views.EditAccountView.as_view()),
          name='edit_account'),
     path('account/change_password/', login_required(auth_views.PasswordChangeView.as_view(success_url=reverse_lazy('auction:change_password_done'))),
@@ -56,13 +58,21 @@ urlpatterns += [
   path('auction/item/<int:item_id>/unwatch_item/', login_required(views.unwatch_item), name='unwatch_item'),
   path('auction/item/<int:item_id>/submit_bid/', login_required(views.submit_bid), name='submit_bid'),
   path('auction/item/<int:item_id>/remove_bid/<int:bid_id>', login_required(views.remove_bid), name='remove_bid'),
+  path('auction/search', login_required(views.item_search), name='item_search'),
   path('auction/my_bids', login_required(views.MyBidListView.as_view(template_name='auction/my_bids.html')), name='my_bids'),
   path('auction/auction_detail/<int:pk>/qr_codes', login_required(views.auction_qr_codes), name='auction_qr_codes'),
   path('auction/auction_detail/<int:pk>/publish', login_required(views.publish), name='publish'),
   path('auction/auction_detail/<int:pk>/archive', login_required(views.archive), name='archive'),
+  path('auction/auction_detail/<int:pk>/report', login_required(views.auction_report), name='auction_report'),
+  path('auction/auction_detail/<int:pk>/batch_entry', login_required(views.batch_entry), name='batch_entry'),
+  path('auction/auction_detail/<int:pk>/import', login_required(views.item_import), name='item_import'),
+  path('auction/auction_detail/<int:pk>/bulk_edit', login_required(views.bulk_edit), name='bulk_edit'),
+  path('auction/auction_detail/<int:pk>/items/json', login_required(views.item_listing_api), name='item_listing_api'),
+  path('auction/auction_detail/<int:pk>/events', login_required(views.auction_events), name='auction_events'),
   path('auction/auction_detail/<int:auction_id>/open_bidding', login_required(views.open_bidding), name='open_bidding'),
   path('auction/auction_detail/<int:auction_id>/close_bidding', login_required(views.close_bidding), name='close_bidding'),
   path('auction/participants/<int:auction_id>', login_required(views.participants_list), name='participants'),
+  path('auction/participants/<int:auction_id>/json', login_required(views.participants_api), name='participants_api'),
   path('clear_notifications/<int:user_id>', login_required(views.clear_notifications), name='clear_notifications')
 ]
 
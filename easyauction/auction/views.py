@@ -1,28 +1,45 @@
 import decimal
-import io
 import os
 
+from django.conf import settings
 from django.urls import reverse_lazy
 from django.views import generic
 from django.shortcuts import render, redirect
-from django.http import HttpResponseRedirect, HttpResponseForbidden, Http404, FileResponse
+from django.http import HttpResponseRedirect, HttpResponseForbidden, Http404, FileResponse, StreamingHttpResponse, \
+    JsonResponse
 from django.urls import reverse
-from django.conf import settings
 from django.contrib.auth import authenticate, login
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.core.paginator import Paginator
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db.models import Count, Max, OuterRef, Q, Subquery
 
 import json
+from datetime import timedelta
 from decimal import Decimal
-from datetime import datetime
 
-from reportlab.pdfgen import canvas
-from reportlab.graphics.shapes import Drawing 
-from reportlab.graphics.barcode.qr import QrCodeWidget 
-from reportlab.graphics import renderPDF
-from reportlab.lib.pagesizes import letter
 
 from .forms import AuctionForm, UserSignUpForm, AddItemForm
 
-from .models import Auction, AuctionUser, Item, Bid
+from .models import Auction, AuctionUser, Balance, BalanceEntry, Item, Bid
+from .batch_entry import BID_SHEETS, RESULTS, parse_rows, record_batch
+from .bid_queue import BidPending, enqueue_bid
+from .bidding import REJECTED_BUSY, valid_amount
+from .caching import bump_listing_version, item_listing, listing_key, not_modified, page_etag, set_validators
+from .events import broker, import_event, item_event, publish_on_commit, stream_events, wait_for_events
+from .images import schedule_ingest
+from .item_import import COLUMNS, import_items
+from .listing import DEFAULT_FIELDS, FIELDS, MAX_PAGE_SIZE, items_page, serialize
+from .ledger import GUARANTEED, POSSIBLE, post, transfer
+from .reconfigure import delete_items, reprice_items, retype_items, schedule_items
+from .search import search_items
+from .notifications import item_closed, item_opened
+from .settlement import settle_auction
+from .reports import stream_report, report_filename
+from .qr_codes import label_sheet
+from .filters import filter_bids, order_bids
 
 
 # Presents sign up form and submits
@@ -59,12 +76,24 @@ class EditAccountView(generic.UpdateView):
     def get_object(self):
         return self.request.user
 
+    # Only the form's own fields are written: the balances on this user row are kept by the ledger's F() updates,
+    # and a full save would put back whatever they were when the request started
+    def form_valid(self, form):
+        self.object = form.save(commit=False)
+        self.object.save(update_fields=self.fields)
+        return HttpResponseRedirect(self.get_success_url())
+
+
+NOTIFICATIONS_PAGE_SIZE = 20
+
 
 def home(request):
     user = request.user
+    # Newest first, a page at a time, read from the (user, -timestamp) index
+    notifications = user.notification_set.select_related('item').only('user', 'text', 'item__name').order_by('-timestamp')
     context = {
         'user': user,
-        'notifications': user.notification_set.order_by('-timestamp')
+        'notifications': Paginator(notifications, NOTIFICATIONS_PAGE_SIZE).get_page(request.GET.get('page'))
     }
     return render(request, 'auction/home.html', context=context)
 
@@ -86,8 +115,7 @@ def auctions(request):
             if auction_code:
                 auction = Auction.objects.get(pk=auction_code)
                 if auction.published:
-                    auction.participants.add(user)
-                    auction.save()
+                    auction.add_participant(user)
                 else:
                     error_msg = 'This auction has not been published'
                     context['error_msg'] = error_msg
@@ -107,21 +135,21 @@ def auctions(request):
 def auction_detail(request, pk):
     # Get context items
     user = request.user
-    if user.auction_set.filter(pk=pk).exists():
+    auction = Auction.objects.filter(pk=pk).select_related('admin').first()
+    if auction is None:
+        raise Http404("The auction you are trying to view does not exist or may have been deleted")
+    if auction.admin_id == user.pk:
         user_is_admin = True
-        auction = user.auction_set.get(pk=pk)
-        live_items = auction.item_set.filter(auction_type='live')
-        silent_items = auction.item_set.filter(auction_type='silent')
-    elif user.joined_auctions.filter(pk=pk).exists():
-        # TODO: implement count-down on items and only show items with positive countdowns
+    elif auction.participants.filter(pk=user.pk).exists():
         user_is_admin = False
-        auction = user.joined_auctions.get(pk=pk)
-        live_items = auction.item_set.filter(auction_type='live')
-        silent_items = auction.item_set.filter(auction_type='silent')
-    elif Auction.objects.filter(pk=pk).exists():
-        return HttpResponseForbidden()
     else:
-        return Http404()
+        return HttpResponseForbidden()
+
+    if request.method == 'GET':
+        etag = page_etag(request, auction.updated_at, user_is_admin)
+        response = not_modified(request, etag, auction.updated_at)
+        if response:
+            return response
 
     # Save object from form or create new form to put in context
     if request.method == 'POST':
@@ -132,21 +160,70 @@ def auction_detail(request, pk):
             item.current_price = item.starting_price
             item.min_bid = item.starting_price
             item.save()
+            bump_listing_version(auction.pk)
+            schedule_ingest(item)
             return HttpResponseRedirect(reverse('auction:auction_detail', args=[auction.pk]))
     else:
         item_form = AddItemForm()
 
+    # Items and their rendered cards are cached per listing version, so between changes no item query runs
+    listing = item_listing(auction)
     context = {
         'auction': auction,
-        'live_items': live_items,
-        'silent_items': silent_items,
-        'total_items': live_items.union(silent_items),
+        'live_items': listing['live'],
+        'silent_items': listing['silent'],
+        'next_items': listing['next'],
+        'item_count': listing['count'],
+        'listing_key': listing_key(auction),
+        'listing_timeout': settings.AUCTION_LISTING_CACHE_TIMEOUT,
         'item_form': item_form,
         'user_is_admin': user_is_admin,
         'total_participants': auction.participants.count()
     }
 
-    return render(request, 'auction/auction_detail.html', context=context)
+    response = render(request, 'auction/auction_detail.html', context=context)
+    if request.method == 'GET':
+        set_validators(response, etag, auction.updated_at)
+    return response
+
+
+# One page of an auction's items as JSON, for rendering the auction page incrementally. Pages follow ?after=<last id>;
+# ?fields= picks the fields (the description only if asked for), ?type=, ?open= and ?sold= filter
+def item_listing_api(request, pk):
+    user = request.user
+    auction = Auction.objects.filter(pk=pk).first()
+    if auction is None:
+        raise Http404("The auction you are trying to view does not exist or may have been deleted")
+    user_is_admin = auction.admin_id == user.pk
+    if not user_is_admin and not auction.participants.filter(pk=user.pk).exists():
+        return HttpResponseForbidden()
+
+    fields = request.GET.get('fields')
+    fields = fields.split(',') if fields else DEFAULT_FIELDS
+    filters = {}
+    if request.GET.get('type'):
+        filters['auction_type'] = request.GET['type']
+    for param, field in (('open', 'is_open'), ('sold', 'is_sold')):
+        if request.GET.get(param):
+            filters[field] = request.GET[param] in ('1', 'true')
+    after, limit = request.GET.get('after', ''), request.GET.get('limit', '')
+    if (any(field not in FIELDS for field in fields)
+            or filters.get('auction_type', 'silent') not in dict(Item.AUCTION_TYPES)
+            or not (after or '0').isdigit() or not (limit or '1').isdigit()):
+        return JsonResponse({'error': f'Fields are {", ".join(FIELDS)}; type is silent or live; '
+                                      f'after and limit are numbers'}, status=400)
+
+    # Any change to the listing bumps the auction's updated_at, so unchanged pages are answered with a 304
+    etag = page_etag(request, auction.updated_at, user_is_admin, request.GET.urlencode())
+    response = not_modified(request, etag, auction.updated_at)
+    if response:
+        return response
+
+    items, next_after = items_page(auction, fields, after=int(after) if after else None,
+                                   limit=min(int(limit), MAX_PAGE_SIZE) if limit else None, **filters)
+    response = JsonResponse({'items': [serialize(item, fields, user, user_is_admin) for item in items],
+                             'next': next_after})
+    return set_validators(response, etag, auction.updated_at)
 
 
 def create_auction(request):
@@ -168,16 +245,33 @@ def item_view(request, item_id):
     admin = False
 
     try:
-        item = Item.objects.get(pk=item_id)
+        item = Item.objects.select_related('auction', 'top_bid').get(pk=item_id)
     except Item.DoesNotExist:
         raise Http404("The item you are trying to view does not exist or may have been deleted")
 
-    if user.is_admin(item.auction.pk):
+    if item.auction.admin_id == user.pk:
         admin = True
+    watching = user.watched_items.filter(pk=item.pk).exists()
 
     # item_bids = Bid.objects.filter(item=item).order_by('-price')
 
-    return render(request, 'auction/item.html', context={'item': item, 'admin': admin, 'user': user})
+    # Reloads of an unchanged item get a 304 instead of a full render. The admin's page also lists participants
+    last_modified = max(item.updated_at, item.auction.updated_at) if admin else item.updated_at
+    etag = page_etag(request, last_modified, admin, watching)
+    response = not_modified(request, etag, last_modified)
+    if response:
+        return response
+
+    context = {
+        'item': item,
+        'admin': admin,
+        'user': user,
+        'watching': watching,
+        # bid history shows each bidder's name
+        'bids': item.bid_set.select_related('bidder'),
+    }
+    response = render(request, 'auction/item.html', context=context)
+    return set_validators(response, etag, last_modified)
 
 
 def edit_item(request, item_id):
@@ -187,43 +281,53 @@ def edit_item(request, item_id):
         raise Http404("The item you are trying to edit does not exist or may have been deleted")
 
     if request.method == 'POST':
-        item.name = request.POST.get('name', default=item.name)
-        item.starting_price = float(request.POST.get('starting_price', default=item.starting_price))
-        item.bid_increment = float(request.POST.get('bid_increment', default=item.bid_increment))
-        item.description = request.POST.get('description', default=item.description)
-
-        auction_type = request.POST.get('auction_type', default=item.auction_type)
-        if auction_type != item.auction_type:
-            item.winner = None
-            item.is_sold = False
-            item.is_open = False
-            item.current_price = item.starting_price
-            while item.bid_set.count() > 0:
-                item.bid_set.first().delete()
-            item.auction_type = auction_type
-            item.save()
-
-        if item.starting_price > item.current_price:
-            item.current_price = item.starting_price
-
-        if item.bid_set.count() > 0:
-            item.min_bid = float(item.current_price) + float(item.bid_increment)
-        else:
-            item.min_bid = item.starting_price
-
-        # for live items
-        if item.auction_type == 'live':
-            final_price = request.POST.get('final_price')
-            if final_price:
-                item.current_price = final_price
-
-            winner = request.POST.get('winner')
-            if winner:
-                item.winner = AuctionUser.objects.get(username=winner)
-                item.is_sold = True
-                item.is_open = False
-
-        item.save()
+        with transaction.atomic():
+            # Taken before the item is read, so no bid can land between reading its prices and writing them back
+            Item.objects.filter(pk=item.pk).update(updated_at=timezone.now())
+            item.refresh_from_db()
+
+            auction_type = request.POST.get('auction_type', default=item.auction_type)
+            retyped = auction_type != item.auction_type
+            if retyped:
+                # Drops every bid and releases what the bids and any win held
+                retype_items(Item.objects.filter(pk=item.pk), auction_type)
+                item.refresh_from_db()
+
+            # Who has won the item now, to move the win in the ledger if the edit changes it
+            won_before = (item.winner_id, item.current_price) if item.is_sold and item.winner_id else None
+
+            item.name = request.POST.get('name', default=item.name)
+            item.starting_price = float(request.POST.get('starting_price', default=item.starting_price))
+            item.bid_increment = float(request.POST.get('bid_increment', default=item.bid_increment))
+            item.description = request.POST.get('description', default=item.description)
+
+            if retyped or item.starting_price > item.current_price:
+                item.current_price = item.starting_price
+
+            if item.bid_count > 0:
+                item.min_bid = float(item.current_price) + float(item.bid_increment)
+            else:
+                item.min_bid = item.starting_price
+
+            # for live items
+            if item.auction_type == 'live':
+                final_price = request.POST.get('final_price')
+                if final_price:
+                    item.current_price = final_price
+
+                winner = request.POST.get('winner')
+                if winner:
+                    item.winner = AuctionUser.objects.get(username=winner)
+                    item.is_sold = True
+                    item.is_open = False
+
+            # Only the columns edited here; the bid statistics are left as the bidding wrote them
+            item.save(update_fields=['name', 'starting_price', 'bid_increment', 'description', 'current_price',
+                                     'min_bid', 'winner', 'is_sold', 'is_open', 'updated_at'])
+            won_after = ((item.winner_id, Decimal(str(item.current_price)))
+                         if item.is_sold and item.winner_id else None)
+            post(transfer(item, GUARANTEED, won_before, won_after, 'result'))
+            bump_listing_version(item.auction_id)
 
     return redirect('auction:item', item.id)
 
@@ -231,17 +335,13 @@ def edit_item(request, item_id):
 def delete_item(request, item_id):
     try:
         item = Item.objects.get(pk=item_id)
-        auction_id = item.auction.id
     except Item.DoesNotExist:
         raise Http404("The item you are trying to delete does not exist or may have already been deleted")
 
     if request.method == 'POST':
-        highest_bid = item.bid_set.order_by('-price')[0]
-        highest_bid.bidder.possible_balance -= highest_bid.price
-        highest_bid.bidder.save()
-        item.delete()
+        delete_items(Item.objects.filter(pk=item.pk))
 
-    return redirect('auction:auction_detail', auction_id)
+    return redirect('auction:auction_detail', item.auction_id)
 
 
 def remove_bid(request, item_id, bid_id):
@@ -254,39 +354,44 @@ def remove_bid(request, item_id, bid_id):
     except Bid.DoesNotExist:
         raise Http404("The bid you are trying to remove does not exist or may have already been deleted")
 
-    # if there are more bids than just the one bid that we are deleting
-    if bid == item.bid_set.latest('timestamp') and item.bid_set.count() > 1:
-        prev_bid = item.bid_set.all().order_by('-price')[1]
-        item.current_price = prev_bid.price
-
-        item.min_bid = item.current_price + item.bid_increment
-        # For the previous bidder, add his original bid to his possible balance
-        prev_bid.bidder.possible_balance += prev_bid.price
-        prev_bid.bidder.save()
-
-        # For the user whose bid is being deleted, reset his possible balance
-        bid.bidder.possible_balance -= bid.price
-        bid.bidder.save()
-
-        bid.delete()
-        item.save()
-    elif item.bid_set.count() == 1:
-        # For the user whose bid is being deleted, reset his possible balance
-        bid.bidder.possible_balance -= bid.price
-        bid.bidder.save()
-        item.current_price = item.starting_price
-        item.min_bid = item.starting_price
-        bid.delete()
-        item.save()
-
-    # if the item was sold then we needed to change the winner
-    if item.is_sold:
-        if item.bid_set.count() > 0:
-            item.winner = item.bid_set.latest('price').bidder
-        else:
-            item.winner = None
-            item.is_sold = False
-        item.save()
+    with transaction.atomic():
+        # Taken before the item is read, so a bid placed meanwhile is seen as the top bid rather than overwritten
+        Item.objects.filter(pk=item.pk).update(updated_at=timezone.now())
+        item.refresh_from_db()
+
+        # Only the current high bid can be retracted; the runner-up takes its place
+        if bid.pk == item.top_bid_id:
+            prev_bid = item.runner_up_bid
+            won_before = (item.winner_id, item.current_price) if item.is_sold and item.winner_id else None
+            # The runner-up's bid is held against their possible balance instead of the retracted one
+            entries = transfer(item, POSSIBLE, (bid.bidder_id, bid.price),
+                               (prev_bid.bidder_id, prev_bid.price) if prev_bid else None, 'retract')
+            if prev_bid:
+                item.current_price = prev_bid.price
+                item.min_bid = item.current_price + item.bid_increment
+            else:
+                item.current_price = item.starting_price
+                item.min_bid = item.starting_price
+
+            bid.delete()
+            item.refresh_bid_stats()
+
+            # if the item was sold then we needed to change the winner
+            if item.is_sold:
+                if prev_bid:
+                    item.winner_id = prev_bid.bidder_id
+                else:
+                    item.winner = None
+                    item.is_sold = False
+                won_after = (item.winner_id, item.current_price) if item.is_sold else None
+                entries += transfer(item, GUARANTEED, won_before, won_after, 'retract')
+            # The bid statistics were written by refresh_bid_stats
+            item.save(update_fields=['current_price', 'min_bid', 'winner', 'is_sold', 'updated_at'])
+            post(entries)
+            bump_listing_version(item.auction_id)
+            publish_on_commit(item.auction_id, item_event(item.pk, price=str(item.current_price),
+                                                          min_bid=str(item.min_bid), bid_count=item.bid_count,
+                                                          is_open=item.is_open))
 
     return redirect('auction:item', item.id)
 
@@ -299,35 +404,21 @@ def submit_bid(request, item_id):
         raise Http404("The item you are trying to bid on does not exist or may have been deleted")
 
     if request.method == 'POST':
-        bid_amount = Decimal(request.POST.get('bid', -1))
-
-        if bid_amount != -1:
-            if item.is_open:
-                if Bid.objects.count() == 0 or bid_amount >= item.min_bid:
-                    bid = Bid(item=item, bidder=user, price=bid_amount)
-                    bid.save()
-
-                    item.current_price = bid_amount
-                    item.min_bid = item.current_price + item.bid_increment
-                    item.save()
-
-                    # update possible balance for new highest bidder
-                    user.possible_balance += bid.price
-                    user.save()
-
-                    if item.bid_set.count() > 1:
-                        # update possible balance for previous highest bidder
-                        prev_highest_bid = item.bid_set.order_by('-price')[1]
-                        prev_highest_bid.bidder.possible_balance -= prev_highest_bid.price
-                        prev_highest_bid.bidder.save()
-
-                        # send outbid notification to previous highest bidder
-                        text = f"Outbid! You have been outbid on the {item}"
-                        prev_highest_bid.bidder.send_notification(text, item)
+        try:
+            bid_amount = Decimal(request.POST.get('bid', -1))
+        except decimal.InvalidOperation:
+            bid_amount = Decimal(-1)
 
-                    return render(request, 'auction/bid_success.html', context={'bid': bid})
+        # What was typed is shown back as text: it may be NaN or too large to format as a price
+        bid = {'item': item, 'price': request.POST.get('bid', '')}
+        try:
+            result = enqueue_bid(item, user, bid_amount)
+        except BidPending:
+            return render(request, 'auction/bid_pending.html', context={'bid': bid})
+        if result.accepted:
+            return render(request, 'auction/bid_success.html', context={'bid': result.bid})
 
-        return render(request, 'auction/bid_fail.html', context={'bid': {'item': item, 'price': bid_amount}})
+        return render(request, 'auction/bid_fail.html', context={'bid': bid, 'busy': result.reason == REJECTED_BUSY})
     # if not a post, then just redirect to item
     return redirect('auction:item', item.id)
 
@@ -344,97 +435,19 @@ def auction_qr_codes(request, pk):
     if user.is_admin(auction.pk):
         admin = True
 
-    buffer = io.BytesIO()
-
-    # 612.0 x 792.0 (letter size)
-    p = canvas.Canvas(buffer, pagesize=letter)
-    x_res = 612
-    y_res = 792
-
     include_images = 'include_images' in request.POST
 
-    num_rows = 4
-    num_cols = 2
-
-    if include_images:
-        num_rows = 2
-        num_cols = 2
-
-    block_width = x_res / num_cols
-    block_height = y_res / num_rows
-
-    image_width = 170
-    image_height = 170
-    qr_width = 130
-    qr_height = 130
-    text_size = 20
-    space_between = (block_height - qr_height - text_size) / 3
-
-    if include_images:
-        space_between = (block_height - image_height - qr_height - text_size) / 4
-
-    index = 0
-
-    # Draw divider lines on first page
-    for r in range(1, num_rows):
-        for c in range(1, num_cols):
-            p.line(c * block_width, 0, c * block_width, y_res)
-            p.line(0, r * block_height, x_res, r * block_height)
-
-    p.setFont("Times-Roman", text_size)
-
-    for item in auction.item_set.all():
-        if index != 0 and index % (num_rows * num_cols) == 0:
-            # Change to new page, draw divider lines, and reset font
-            p.showPage()
-
-            for r in range(1, num_rows):
-                for c in range(1, num_cols):
-                    p.line(c * block_width, 0, c * block_width, y_res)
-                    p.line(0, r * block_height, x_res, r * block_height)
-
-            p.setFont("Times-Roman", text_size)
-
-        # Generate QR code from item page URL
+    # Everything printed on a label goes into the cache key, so edited items produce a fresh sheet
+    labels = []
+    for item in auction.item_set.only('pk', 'auction', 'name', 'image', 'image_hash').order_by('pk'):
         page_url = request.build_absolute_uri(reverse('auction:item', args=(item.id, )))
+        image_path = item.print_path if include_images else None
+        labels.append((page_url, item.name, image_path))
 
-        qrw = QrCodeWidget(page_url) 
-        b = qrw.getBounds()
-
-        w = b[2] - b[0] 
-        h = b[3] - b[1] 
-
-        d = Drawing()
-        d.add(qrw)
-
-        # Bottom left corner of block
-        x_offset = (index % num_cols) * block_width
-        y_offset = (num_rows - 1 - (index // num_cols) % num_rows) * block_height
-
-        # Draw QR code
-        d.translate(x_offset + block_width / 2 - qr_width / 2, y_offset + space_between)
-
-        d.scale(qr_width / w, qr_height / h)
-
-        renderPDF.draw(d, p, 1, 1)
-
-        # Draw item name
-        p.drawCentredString(x_offset + block_width / 2, y_offset + block_height - text_size - space_between, item.name)
-
-        if include_images:
-            # Draw item image
-            p.drawImage(settings.BASE_DIR + item.image.url,
-                x_offset + x_res / 4 - image_width / 2, y_offset + qr_height + 2 * space_between,
-                image_width, image_height)
-
-        index += 1
-
-    p.save()
-
-    buffer.seek(0)
+    sheet = label_sheet(auction, labels, include_images)
 
     # Return rendered PDF file
-    return FileResponse(buffer, as_attachment=True, filename='QR Codes Printout.pdf')
+    return FileResponse(sheet, as_attachment=True, filename='QR Codes Printout.pdf')
 
 
 class MyBidListView(generic.ListView):
@@ -443,10 +456,9 @@ class MyBidListView(generic.ListView):
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        # Incredibly janky and non-extensible. Should be done with an API call in the future
         filters = [{'text': 'Winning Bids', 'value': 'winning'},
-                   {'text': 'Won Bids', 'value': '{"won": "True"}'},
-                   {'text': 'Open Bids', 'value': '{"item__is_open": "True"}'}]
+                   {'text': 'Won Bids', 'value': 'won'},
+                   {'text': 'Open Bids', 'value': 'open'}]
         context['filters'] = filters
         orderings = [{'text': 'Date', 'value': '-timestamp'},
                      {'text': 'Price', 'value': '-price'}]
@@ -456,30 +468,11 @@ class MyBidListView(generic.ListView):
 
     def get_queryset(self):
         user = self.request.user
-        queryset = self.model.objects.filter(bidder__pk=user.pk)
-
-        filtering_json = self.request.GET.get('filter', None)
-        if filtering_json:
-            if filtering_json == 'winning':
-                user_winning_bids_ids = []
-                for bid in queryset:
-                    winning_bid = bid.item.bid_set.last()
-                    if bid == winning_bid:
-                        user_winning_bids_ids.append(bid.pk)
-                filtered_queryset = queryset.filter(pk__in=user_winning_bids_ids)
-            else:
-                filtering = json.loads(filtering_json)
-                filtered_queryset = queryset.filter(**filtering)
-        else:
-            filtered_queryset = queryset.filter()
+        queryset = self.model.objects.filter(bidder__pk=user.pk).select_related('item__auction')
 
-        ordering = self.request.GET.get('order', '-timestamp')
-        if ordering:
-            ordered_queryset = filtered_queryset.order_by(ordering, '-timestamp')
-        else:
-            ordered_queryset = filtered_queryset.order_by('-timestamp')
-
-        return ordered_queryset
+        # Only whitelisted filters and orderings are applied, see auction/filters.py
+        filtered_queryset = filter_bids(queryset, self.request.GET.get('filter', ''))
+        return order_bids(filtered_queryset, self.request.GET.get('order', ''))
 
 
 class WatchedItemsView(generic.ListView):
@@ -487,10 +480,83 @@ class WatchedItemsView(generic.ListView):
 
     def get_queryset(self):
         user = self.request.user
-        queryset = self.model.objects.filter(pk__in=user.watched_items.all())
+        queryset = user.watched_items.select_related('winner')
 
         return queryset
 
+    def get(self, request, *args, **kwargs):
+        # Watching or unwatching marks the item as modified, so the newest timestamp and the count cover the list
+        state = request.user.watched_items.aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+        last_modified = state['last_modified'] or request.user.date_joined
+        etag = page_etag(request, last_modified, state['count'])
+        response = not_modified(request, etag, last_modified)
+        if response:
+            return response
+        return set_validators(super().get(request, *args, **kwargs), etag, last_modified)
+
+
+# Items can be updated by several writers in the same instant, and one that commits later may carry an earlier
+# timestamp, so each sync looks back this far past its cursor. Clients replace items by id, so repeats are harmless
+WATCHLIST_CURSOR_OVERLAP = timedelta(seconds=2)
+
+
+# Watchlist for clients that poll: with ?since=<cursor from the last response> it only returns watched items
+# changed since then and the ids of items that left the watchlist
+def watchlist_api(request):
+    user = request.user
+    now = timezone.now()
+    items = user.watched_items.select_related('winner').order_by('pk')
+    removed = []
+
+    try:
+        since = parse_datetime(request.GET.get('since', ''))
+    except ValueError:
+        since = None
+    if since is not None:
+        since -= WATCHLIST_CURSOR_OVERLAP
+        items = items.filter(updated_at__gt=since)
+        removed = sorted(set(user.watchlistremoval_set.filter(timestamp__gt=since)
+                             .exclude(item_id__in=user.watched_items.values('pk'))
+                             .values_list('item_id', flat=True)))
+
+    return JsonResponse({'cursor': now.isoformat(),
+                         'items': [{'id': item.pk,
+                                    'name': item.name,
+                                    'auction': item.auction_id,
+                                    'thumbnail': item.thumbnail_url,
+                                    'is_open': item.is_open,
+                                    'is_sold': item.is_sold,
+                                    'current_price': item.current_price,
+                                    'min_bid': item.min_bid,
+                                    'bid_count': item.bid_count,
+                                    'winner': item.winner.username if item.winner else None}
+                                   for item in items],
+                         'removed': removed})
+
+
+# Search as you type, within one auction (?auction=<pk>) or across every auction the user runs or has joined
+def item_search(request):
+    user = request.user
+    auctions = Auction.objects.filter(Q(admin=user) | Q(participants=user))
+    auction_pk = request.GET.get('auction')
+    if auction_pk:
+        if not auction_pk.isdigit() or not auctions.filter(pk=auction_pk).exists():
+            return HttpResponseForbidden()
+        auctions = Auction.objects.filter(pk=auction_pk)
+
+    items = search_items(request.GET.get('q', ''), auctions)
+    return JsonResponse({'items': [{'id': item.pk,
+                                    'name': item.name,
+                                    'auction': item.auction_id,
+                                    'url': reverse('auction:item', args=[item.pk]),
+                                    'thumbnail': item.thumbnail_url,
+                                    'auction_type': item.auction_type,
+                                    'is_open': item.is_open,
+                                    'is_sold': item.is_sold,
+                                    'current_price': item.current_price,
+                                    'snippet': item.snippet}
+                                   for item in items]})
+
 
 def publish(request, pk):
     try:
@@ -499,21 +565,22 @@ def publish(request, pk):
         raise Http404("The auction you are trying to publish does not exist or may have been deleted")
 
     if request.method == "POST":
+        with transaction.atomic():
+            silent_items = auction.item_set.filter(auction_type='silent')
+            won_bids = Bid.objects.filter(item__in=silent_items, won=True)
 
-        # un-assign winners
-        for item in auction.item_set.filter(auction_type='silent'):
-            if item.bid_set.count() > 0:
-                item.bid_set.order_by('-price')[0].won = False
-                item.is_sold = False
-                item.winner = None
-                item.save()
+            # take back what the last archive added to each winner's guaranteed balance
+            post([BalanceEntry(user_id=bidder_id, auction_id=auction.pk, item_id=item_id,
+                               account=GUARANTEED, amount=-price, reason='reopen')
+                  for bidder_id, item_id, price in won_bids.values_list('bidder_id', 'item_id', 'price')])
 
-        # reset guaranteed balance
-        for user in auction.participants.all():
-            user.guaranteed_balance = 0.00
+            # un-assign winners
+            won_bids.update(won=False)
+            silent_items.filter(is_sold=True).update(is_sold=False, winner=None, updated_at=timezone.now())
 
-        auction.publish()
-        auction.save()
+            auction.publish()
+            auction.save(update_fields=['published'])
+            bump_listing_version(auction.pk)
 
     return redirect("auction:auction_detail", pk)
 
@@ -526,65 +593,204 @@ def archive(request, pk):
 
     if request.method == "POST":
 
-        # assign winners
-        for item in auction.item_set.filter(auction_type='silent'):
-            if item.bid_set.count() > 0:
-                # Assign winner
-                item.is_sold = True
-                item.winner = item.bid_set.latest('price').bidder
-                item.save()
+        with transaction.atomic():
+            # assign winners
+            settle_auction(auction)
+
+            auction.close_bidding()
+            auction.archive()
+            auction.save(update_fields=['published', 'opened_for_bidding'])
+            bump_listing_version(auction.pk)
 
-                # Mark bid as a winning bid
-                bid = item.bid_set.latest('price')
-                bid.won = True
-                bid.save()
+    return redirect("auction:auction_detail", pk)
 
-                # Update winners balance
-                item.winner.guaranteed_balance += bid.price
-                item.winner.save()
 
-                # Send notification to winner
-                text = f"Congratulations! You won the {item.name}"
-                item.winner.send_notification(text=text, item=item)
+def auction_report(request, pk):
+    try:
+        auction = Auction.objects.get(pk=pk)
+    except Auction.DoesNotExist:
+        raise Http404("The auction you are trying to report on does not exist or may have been deleted")
 
-        auction.close_bidding()
-        auction.archive()
-        auction.save()
-
-        # csv output file
-        file = open("auction_report.csv", "w")
-        file.write(f"{auction.name} report\n")
-        file.write(f"Auction closed on:, {datetime.now().strftime('%m/%d/%Y %H:%M:%S')}\n\n")
-        file.write("Silent Items\n")
-        file.write("Item, Buyer Name, Buyer Username, Price\n")
-        for item in auction.item_set.filter(auction_type='silent'):
-            if item.winner:
-                first_name = item.winner.first_name
-                last_name = item.winner.last_name
-                user_name = item.winner.username
-                sell_price = item.current_price
+    if auction.admin_id != request.user.pk:
+        return HttpResponseForbidden()
+
+    response = StreamingHttpResponse(stream_report(auction), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{report_filename(auction)}"'
+    return response
+
+
+# Lets a clerk record many live results or paper bid sheet lines at once. Rows are "item, bidder, price":
+# items by number or name, bidders by username or paddle number. JSON bodies are answered with JSON
+def batch_entry(request, pk):
+    try:
+        auction = Auction.objects.get(pk=pk)
+    except Auction.DoesNotExist:
+        raise Http404("The auction you are trying to enter results for does not exist or may have been deleted")
+
+    if auction.admin_id != request.user.pk:
+        return HttpResponseForbidden()
+
+    context = {'auction': auction, 'modes': [RESULTS, BID_SHEETS], 'mode': RESULTS}
+    if request.method == 'POST':
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body)
+                recorded = record_batch(auction, data.get('mode', RESULTS), data.get('rows', []))
+            except (ValueError, AttributeError, TypeError):
+                return JsonResponse({'errors': ['Expected a JSON object with mode and rows']}, status=400)
+            except ValidationError as e:
+                return JsonResponse({'errors': e.messages}, status=400)
+            return JsonResponse({'recorded': recorded})
+
+        context['mode'] = request.POST.get('mode', RESULTS)
+        try:
+            context['recorded'] = record_batch(auction, context['mode'], parse_rows(request.POST.get('rows', '')))
+        except ValidationError as e:
+            # Keep the rows so the clerk can fix them in place
+            context['rows'] = request.POST.get('rows', '')
+            context['error_msg'] = e.messages
+
+    return render(request, 'auction/batch_entry.html', context)
+
+
+# Applies one change to many selected items at once: move them to the silent or live auction, set their starting
+# price and/or bid increment, or delete them. Each change runs as one transaction
+def bulk_edit(request, pk):
+    try:
+        auction = Auction.objects.get(pk=pk)
+    except Auction.DoesNotExist:
+        raise Http404("The auction you are trying to edit does not exist or may have been deleted")
+
+    if auction.admin_id != request.user.pk:
+        return HttpResponseForbidden()
+
+    context = {'auction': auction, 'auction_types': [value for value, _ in Item.AUCTION_TYPES]}
+    if request.method == 'POST':
+        items = auction.item_set.filter(pk__in=[pk for pk in request.POST.getlist('items') if pk.isdigit()])
+        action = request.POST.get('action')
+        if action == 'retype' and request.POST.get('auction_type') in context['auction_types']:
+            context['changed'] = retype_items(items, request.POST['auction_type'])
+        elif action == 'reprice':
+            try:
+                prices = {field: Decimal(request.POST[field]) for field in ('starting_price', 'bid_increment')
+                          if request.POST.get(field)}
+            except decimal.InvalidOperation:
+                prices = None
+            # NaN, infinities and prices the price columns cannot hold would otherwise fail at the database
+            if prices and all(valid_amount(price) for price in prices.values()):
+                context['changed'] = reprice_items(items, **prices)
             else:
-                first_name = "N/A"
-                last_name = " "
-                user_name = "N/A"
-                sell_price = 0
-            file.write(f"{item.name}, {first_name} {last_name}, {user_name}, {sell_price}\n")
-        file.write("\nLive Items\n")
-        file.write("Item, Buyer Name, Buyer Username, Price\n")
-        for item in auction.item_set.filter(auction_type='live'):
-            if item.winner:
-                first_name = item.winner.first_name
-                last_name = item.winner.last_name
-                user_name = item.winner.username
-                sell_price = item.current_price
+                context['error_msg'] = 'Enter a positive starting price or bid increment in dollars and cents'
+        elif action == 'schedule':
+            try:
+                schedule = scheduling_fields(request.POST)
+            except ValueError:
+                schedule = None
+            if schedule:
+                context['changed'] = schedule_items(items, **schedule)
             else:
-                first_name = "N/A"
-                last_name = " "
-                user_name = "N/A"
-                sell_price = 0
-            file.write(f"{item.name}, {first_name} {last_name}, {user_name}, {sell_price}\n")
-        file.close()
-    return redirect("auction:auction_detail", pk)
+                context['error_msg'] = 'Enter when the first items close, and opening after closing is not allowed'
+        elif action == 'delete':
+            context['changed'] = delete_items(items)
+        else:
+            context['error_msg'] = 'Choose what to do with the selected items'
+
+    context['items'] = auction.item_set.order_by('auction_type', 'pk').only(
+        'pk', 'auction', 'name', 'auction_type', 'starting_price', 'bid_increment', 'current_price', 'bid_count',
+        'is_sold', 'opens_at', 'closes_at')
+    context['group_size'] = settings.AUCTION_CLOSE_BATCH_SIZE
+    return render(request, 'auction/bulk_edit.html', context)
+
+
+def scheduling_fields(data):
+    """
+    Reads the bulk edit schedule fields. Times are in the site's time zone, minutes are whole numbers
+    :return: keyword arguments for schedule_items, or None if closes_at is missing or before opens_at
+    :raises ValueError: if a field cannot be read
+    """
+    def when(field):
+        value = parse_datetime(data.get(field) or '')
+        if value is not None and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    def minutes(field):
+        value = int(data.get(field) or 0)
+        if value < 0:
+            raise ValueError(field)
+        return timedelta(minutes=value) if value else None
+
+    closes_at, opens_at = when('closes_at'), when('opens_at')
+    if closes_at is None or (opens_at is not None and opens_at >= closes_at):
+        return None
+    return {'closes_at': closes_at,
+            'opens_at': opens_at,
+            'group_size': max(1, int(data.get('group_size') or settings.AUCTION_CLOSE_BATCH_SIZE)),
+            'interval': minutes('interval'),
+            'soft_close': minutes('soft_close')}
+
+
+# Adds many items at once from a CSV, with their pictures from a ZIP. Image progress is pushed to the page
+# through the auction's event stream while the upload request is still running
+def item_import(request, pk):
+    try:
+        auction = Auction.objects.get(pk=pk)
+    except Auction.DoesNotExist:
+        raise Http404("The auction you are trying to import items into does not exist or may have been deleted")
+
+    if auction.admin_id != request.user.pk:
+        return HttpResponseForbidden()
+
+    context = {'auction': auction, 'columns': COLUMNS}
+    if request.method == 'POST':
+        if 'items' not in request.FILES:
+            context['error_msg'] = ['Choose a CSV of items to import']
+        else:
+            try:
+                context['imported'] = import_items(
+                    auction, request.FILES['items'], request.FILES.get('images'),
+                    progress=lambda done, total: broker.publish(auction.pk, import_event(done, total)))
+            except ValidationError as e:
+                context['error_msg'] = e.messages
+
+    return render(request, 'auction/item_import.html', context)
+
+
+MAX_POLL_SECONDS = 25
+
+
+# Pushes price and open/close changes for an auction's items as server-sent events.
+# With ?poll=1 it long-polls instead and returns the events as JSON
+def auction_events(request, pk):
+    try:
+        auction = Auction.objects.get(pk=pk)
+    except Auction.DoesNotExist:
+        raise Http404("The auction you are trying to follow does not exist or may have been deleted")
+
+    if auction.admin_id != request.user.pk and not auction.participants.filter(pk=request.user.pk).exists():
+        return HttpResponseForbidden()
+
+    try:
+        since = int(request.GET.get('since', request.META.get('HTTP_LAST_EVENT_ID', '')))
+    except ValueError:
+        since = None
+
+    if request.GET.get('poll'):
+        try:
+            timeout = min(float(request.GET.get('timeout', MAX_POLL_SECONDS)), MAX_POLL_SECONDS)
+        except ValueError:
+            timeout = MAX_POLL_SECONDS
+        if since is None:
+            # First poll: start from now rather than replaying history
+            since = broker.last_id(auction.pk)
+        events = wait_for_events(auction.pk, since, max(timeout, 0))
+        return JsonResponse({'last_id': events[-1][0] if events else since,
+                             'events': [dict(data, id=event_id) for event_id, data in events]})
+
+    response = StreamingHttpResponse(stream_events(auction.pk, since), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 def open_bidding(request, auction_id):
@@ -595,7 +801,10 @@ def open_bidding(request, auction_id):
 
     if request.method == "POST":
         auction.open_bidding()
-        auction.save()
+        auction.save(update_fields=['opened_for_bidding'])
+        bump_listing_version(auction.pk)
+        for item_id, name in auction.item_set.values_list('pk', 'name'):
+            item_opened(item_id, name)
 
     return redirect("auction:auction_detail", auction_id)
 
@@ -608,51 +817,97 @@ def close_bidding(request, auction_id):
 
     if request.method == "POST":
         auction.close_bidding()
-        auction.save()
+        auction.save(update_fields=['opened_for_bidding'])
+        bump_listing_version(auction.pk)
+        for item_id, name in auction.item_set.values_list('pk', 'name'):
+            item_closed(item_id, name)
 
     return redirect("auction:auction_detail", auction_id)
 
 
+def participant_totals(auction, winners_only=False):
+    """
+    Items won and total cost for each participant as one grouped query over only the columns the table shows.
+    The total cost is the user's materialized guaranteed balance in the auction
+    :param auction: auction to summarize
+    :param winners_only: only include users who won an item, whether or not they joined the auction
+    :return: values queryset ordered by user id
+    """
+    if winners_only:
+        users = AuctionUser.objects.filter(pk__in=auction.item_set.exclude(winner=None).values('winner'))
+    else:
+        users = auction.participants.all()
+
+    # What each user owes is their guaranteed balance in this auction, as kept by the ledger
+    owed = Balance.objects.filter(user=OuterRef('pk'), auction=auction).values('guaranteed')
+    return (users.order_by('pk')
+            .values('pk', 'username')
+            .annotate(n_won=Count('item', filter=Q(item__auction=auction)),
+                      total_cost=Subquery(owed[:1])))
+
+
+def participant_rows(auction, totals):
+    # Names of the won items for just these users, in one query
+    totals = list(totals)
+    names = {}
+    won_items = auction.item_set.filter(winner__in=[row['pk'] for row in totals if row['n_won']])
+    for winner_id, name in won_items.order_by('pk').values_list('winner_id', 'name'):
+        names.setdefault(winner_id, []).append(name)
+
+    return [{'name': row['username'],
+             'id': row['pk'],
+             'items_won': names.get(row['pk'], []),
+             'total_cost': float(row['total_cost'] or 0)}
+            for row in totals]
+
+
 def participants_list(request, auction_id):
     # Get auction
     try:
         auction = Auction.objects.get(id=auction_id)
-        if auction.admin.pk != request.user.pk:
+        if auction.admin_id != request.user.pk:
             return HttpResponseForbidden()
     except Auction.DoesNotExist:
         return Http404()
 
-    if request.method == 'GET':
-        # Get participants based on filter
-        if 'filter' in request.GET and request.GET['filter'] == 'true':
-            won_items = auction.item_set.exclude(winner=None)
-            participants = set()
-            for item in won_items:
-                if item.winner not in participants:
-                    participants.add(item.winner)
-        else:
-            participants = auction.participants.all()
-    else:
-        participants = auction.participants.all()
+    winners_only = request.GET.get('filter') == 'true'
 
     # Build list of participant json objects to be rendered by v-data-table
-    participant_objs = []
-    for participant in participants:
-        items_won = auction.item_set.filter(winner__id=participant.id)
-        participant_obj = {'name': participant.username,
-                            'id': participant.id,
-                            'items_won': list(map(lambda x: x['name'], items_won.values('name'))),
-                            'total_cost': 0}
-        for item in items_won:
-            participant_obj['total_cost'] += float(item.current_price)
-        participant_objs.append(participant_obj)
-
+    participant_objs = participant_rows(auction, participant_totals(auction, winners_only))
     participants_json = json.dumps(participant_objs)
 
-    context = {'participants': participants_json, 'n_participants': len(participants), 'auction': auction}
+    context = {'participants': participants_json, 'n_participants': len(participant_objs), 'auction': auction}
     return render(request, 'auction/participants.html', context=context)
 
 
+PARTICIPANTS_PAGE_SIZE = 50
+MAX_PARTICIPANTS_PAGE_SIZE = 500
+
+
+# Paginated JSON version of the participants table for server-side v-data-table paging
+def participants_api(request, auction_id):
+    try:
+        auction = Auction.objects.get(id=auction_id)
+    except Auction.DoesNotExist:
+        raise Http404("The auction you are trying to view does not exist or may have been deleted")
+    if auction.admin_id != request.user.pk:
+        return HttpResponseForbidden()
+
+    try:
+        page_size = min(int(request.GET.get('page_size', PARTICIPANTS_PAGE_SIZE)), MAX_PARTICIPANTS_PAGE_SIZE)
+    except ValueError:
+        page_size = PARTICIPANTS_PAGE_SIZE
+
+    winners_only = request.GET.get('filter') == 'true'
+    paginator = Paginator(participant_totals(auction, winners_only), max(page_size, 1))
+    page = paginator.get_page(request.GET.get('page'))
+
+    return JsonResponse({'count': paginator.count,
+                         'num_pages': paginator.num_pages,
+                         'page': page.number,
+                         'results': participant_rows(auction, page.object_list)})
+
+
 def clear_notifications(request, user_id):
     try:
         user = AuctionUser.objects.get(id=user_id)
@@ -666,12 +921,10 @@ def clear_notifications(request, user_id):
 def watch_item(request, item_id: int):
     user = request.user
     user.watch_item(pk=item_id)
-    user.save()
     return item_view(request, item_id=item_id)
 
 
 def unwatch_item(request, item_id: int):
     user = request.user
     user.unwatch_item(pk=item_id)
-    user.save()
     return item_view(request, item_id=item_id)
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'auction.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,13 +57,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'auction.notifications.NotificationOutboxMiddleware',
 ]
 
 ROOT_URLCONF = 'easyauction.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'auction.timing.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')]
         ,
         'APP_DIRS': True,
@@ -83,6 +85,14 @@ WSGI_APPLICATION = 'easyauction.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# File-based so every worker process on the host shares one cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    }
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -132,6 +142,52 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Worker threads that generate item image derivatives after upload. 0 processes uploads on the request thread
+AUCTION_IMAGE_WORKERS = 2
+
+# Worker processes that encode QR codes for label sheets, and where finished sheets are cached. 0 encodes in-process
+AUCTION_QR_WORKERS = 2
+AUCTION_QR_CACHE_DIR = os.path.join(BASE_DIR, 'qr_cache')
+
+# Bids are applied by one writer thread per process, up to this many per transaction.
+# Requests wait at most AUCTION_BID_QUEUE_TIMEOUT seconds for their result
+AUCTION_BID_QUEUE = True
+AUCTION_BID_BATCH_SIZE = 32
+AUCTION_BID_QUEUE_TIMEOUT = 10
+
+# The deadline scheduler opens and closes items at most this many per transaction, and checks for changed
+# deadlines at least every AUCTION_SCHEDULER_SYNC_SECONDS.
+# With AUCTION_SCHEDULER_THREAD each web process runs one on a thread, so its live-update clients hear about
+# items opening and closing. Turn it off to run the run_scheduler command alone instead
+AUCTION_SCHEDULER_THREAD = True
+AUCTION_CLOSE_BATCH_SIZE = 50
+AUCTION_SCHEDULER_SYNC_SECONDS = 5
+
+# Rows per bulk insert or update, which keeps every statement well under SQLite's bound-variable limit
+AUCTION_BULK_BATCH_SIZE = 500
+
+# Milliseconds a SQLite connection waits for the write lock before giving up
+AUCTION_SQLITE_BUSY_TIMEOUT = 5000
+
+# Adds Server-Timing headers and an auction.timing log line with query and render timings to every response
+AUCTION_SERVER_TIMING = False
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'auction.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Seconds a cached auction item listing is kept. Listings are versioned, so this only bounds disk use
+AUCTION_LISTING_CACHE_TIMEOUT = 24 * 60 * 60
+# Items per type on the auction page, and per page of the JSON item listing unless the client asks for fewer
+AUCTION_LISTING_PAGE_SIZE = 50
+
 # Redirect to home page
 LOGIN_REDIRECT_URL = 'auction:home'
 
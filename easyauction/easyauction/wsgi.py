@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'easyauction.settings')
 
 application = get_wsgi_application()
+
+if settings.AUCTION_SCHEDULER_THREAD:
+    from auction.scheduler import start_scheduler
+    start_scheduler()